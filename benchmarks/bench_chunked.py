@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_chunked.py
+# desc:   wall-clock of single-process and chunked encoding
+# usage:  python benchmarks/bench_chunked.py [seconds] [chunks] [workers]
+##########################################################
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import event_log
+from modules import probe
+from modules import quality
+from modules import transcoder
+from modules.media_record import MediaRecord
+
+CONFIG = {
+    "readonly": "False",
+    "targetGlobalSettings": "-map 0",
+    "targetVideoCodec": "libx265",
+    "targetVideoSettings": "-preset fast -crf 28",
+    "targetAudioCodec": "copy",
+    "targetAudioSettings": "",
+    "targetSubtitleCodec": "copy",
+    "targetSubtitleSettings": "",
+    "targetContainer": "mkv",
+    "transcoderHWaccel": "False"
+}
+
+
+class BenchCtrl:
+    def __init__(self):
+        self.probes = probe.ProbeCache(":memory:")
+        self.quality = quality.QualitySearch(dict(CONFIG, qualityCacheFile=":memory:"))
+
+    def notify(self, reason):
+        pass
+
+
+def synthetic_clip(path, seconds):
+    # 1080p test pattern with a sine tone, encoded in an old codec like the files we want to grind
+    subprocess.run(["ffmpeg", "-v", "error", "-y",
+                    "-f", "lavfi", "-i", "testsrc=duration=%d:size=1920x1080:rate=25" % seconds,
+                    "-f", "lavfi", "-i", "sine=frequency=440:duration=%d" % seconds,
+                    "-c:v", "mpeg4", "-q:v", "3", "-g", "50", "-c:a", "aac", str(path)], check=True)
+
+
+def encode(clip, cache, seconds, chunks, workers):
+    config = dict(CONFIG, transcoderCache=str(cache), transcoderChunks=chunks, transcoderChunkWorkers=workers)
+    tr = transcoder.Transcoder(BenchCtrl(), config)
+    start = time.perf_counter()
+    tr.run(MediaRecord(chunks, title="testsrc", locations=[str(clip)], duration=seconds * 1000))
+    duration = time.perf_counter() - start
+    if tr.exit_code != 1:
+        raise RuntimeError("transcoding failed: " + "\n".join(tr.stderrTail))
+    return duration
+
+
+def main(seconds, chunks, workers):
+    work = Path(tempfile.mkdtemp(prefix="video-grinder-bench-"))
+    try:
+        event_log.__LOG__ = event_log.EventLog(work.joinpath("log.csv"), ["date"])
+        clip = work.joinpath("testsrc.mp4")
+        synthetic_clip(clip, seconds)
+        single = encode(clip, work.joinpath("single"), seconds, 0, workers)
+        chunked = encode(clip, work.joinpath("chunked"), seconds, chunks, workers)
+        print("%10s %10s %12s %12s %10s" % ("seconds", "chunks", "single [s]", "chunked [s]", "speedup"))
+        print("%10d %10d %12.2f %12.2f %9.2fx" % (seconds, chunks, single, chunked, single / chunked))
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 60,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 8,
+         int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count())
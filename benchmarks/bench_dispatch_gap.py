@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_dispatch_gap.py
+# desc:   job-to-job gap of the polling and event driven controller
+# usage:  python benchmarks/bench_dispatch_gap.py [jobs] [runningSpeed]
+##########################################################
+
+import logging
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import controller
+from modules import transcoder
+
+JOB_SECONDS = 0.2
+
+
+class FakeFile:
+    def __init__(self, ratingKey):
+        self.ratingKey = ratingKey
+        self.locations = ["/dev/null"]
+
+
+class FakeMonitor:
+    """answers the controller like a monitor of a library with an endless queue"""
+
+    def __init__(self, parent):
+        self.ctrl = parent
+        self.ready = True
+        self.zombie = False
+        self.sleeping = False
+        self.failureReason = {}
+        self.next = 0
+        self.dispatched = []
+
+    def update_data(self):
+        self.ctrl.notify("monitor")
+
+    def get_file(self, lane=transcoder.TRANSCODE):
+        if lane != transcoder.TRANSCODE:
+            return False
+        return FakeFile(self.next)
+
+    def fetch(self, file):
+        return file
+
+    def set_current_transcoding(self, file):
+        self.next += 1
+        self.dispatched.append(time.perf_counter())
+
+    def remove_current_transcoding(self, file):
+        pass
+
+    def set_verifying(self, file):
+        pass
+
+    def set_successfully_transcoded(self, file, detail=None):
+        pass
+
+    def set_failed_to_transcode(self, file, exit_code=None, detail=None):
+        pass
+
+    def ready_to_transcode(self, profile=None):
+        return True
+
+    def ready_to_remux(self):
+        return True
+
+    def queue_full(self):
+        return False
+
+    def get_states(self):
+        return {}
+
+
+class FakeOrganizer:
+    def __init__(self):
+        self.ready = True
+        self.zombie = False
+        self.organizing = False
+
+
+class FakeTranscoder(transcoder.Transcoder):
+    finished = []
+
+    def run(self, file):
+        self.ready = False
+        self.file = file
+        time.sleep(JOB_SECONDS)
+        self.exit_code = 1
+        FakeTranscoder.finished.append(time.perf_counter())
+
+
+class BenchCtrl(controller.Ctrl):
+    def add_monitor(self):
+        self.monitors.append(FakeMonitor(self))
+
+    def add_transcoder(self, lane=transcoder.TRANSCODE, profile=None):
+        self.transcoders.append(FakeTranscoder(self, self.config, lane, profile))
+
+    def add_organizer(self):
+        self.organizers.append(FakeOrganizer())
+
+
+def legacy_take_control(ctrl):
+    """the former state machine: IDLE, SELFCHECK and QUEUE, one tick of runningSpeed each"""
+    ctrl.running = True
+    steps = [lambda: ctrl.idle(True), ctrl.selfcheck, ctrl.queue]
+    step = 0
+    while ctrl.running:
+        time.sleep(ctrl.runningSpeed)
+        steps[step]()
+        step = (step + 1) % len(steps)
+
+
+def run(take_control, jobs, runningSpeed):
+    FakeTranscoder.finished = []
+    ctrl = BenchCtrl({"runningSpeed": runningSpeed, "readonly": "True", "jobStoreFile": ":memory:", "probeCacheFile": ":memory:",
+                      "qualityCacheFile": ":memory:", "targetVideoCodec": "libx265",
+                      "transcoderCount": 1})
+    thread = threading.Thread(target=take_control, args=(ctrl,))
+    thread.start()
+    while len(FakeTranscoder.finished) < jobs:
+        time.sleep(0.01)
+    ctrl.stop()
+    thread.join()
+    dispatched = ctrl.monitors[0].dispatched
+    # the gap between the end of a job and the start of the next one
+    return [dispatched[i + 1] - FakeTranscoder.finished[i] for i in range(jobs - 1)]
+
+
+def main(jobs, runningSpeed):
+    logging.basicConfig(level=logging.WARNING)
+    print("%10s %12s %12s %12s" % ("controller", "mean [ms]", "median [ms]", "max [ms]"))
+    for name, take_control in [("polling", legacy_take_control), ("events", controller.Ctrl.take_control)]:
+        gaps = [g * 1000 for g in run(take_control, jobs, runningSpeed)]
+        print("%10s %12.2f %12.2f %12.2f" % (name, statistics.mean(gaps), statistics.median(gaps), max(gaps)))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 0.5)
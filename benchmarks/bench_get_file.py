@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_get_file.py
+# desc:   compares eval based and precompiled/queued get_file() per dispatch
+# usage:  python benchmarks/bench_get_file.py [sizes...]
+##########################################################
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import config_loader
+from modules import job_store
+from modules import monitor
+from modules import probe
+from modules import scheduler
+from modules import transcoder
+
+FILES_FILTER = {"videoCodec": "!= 'hevc'"}
+
+
+class FakeMedia:
+    def __init__(self, codec):
+        self.videoCodec = codec
+
+
+class FakeFile:
+    def __init__(self, ratingKey, codec):
+        self.ratingKey = ratingKey
+        self.title = self.titleSort = "file %08d" % ratingKey
+        self.media = [FakeMedia(codec)]
+        # files without location are never probed
+        self.locations = []
+
+
+def legacy_get_file(files, history, files_filter):
+    """the former implementation: history lists and one eval per filter and file"""
+    history["all"] = history["current"] + history["success"] + history["failure"]
+    for file in files:
+        if len(history["all"]) == 0 or file.ratingKey not in history["all"]:
+            if len(files_filter) != 0:
+                ok = True
+                for f in files_filter:
+                    if not hasattr(file, 'media') \
+                            or not len(file.media) > 0 \
+                            or not eval("file.media[0]." + f + " " + files_filter[f]):
+                        ok = False
+                if ok:
+                    return file
+            else:
+                return file
+    return False
+
+
+def library(size):
+    # worst case: everything but the very last file is already hevc
+    return [FakeFile(rk, "hevc") for rk in range(size - 1)] + [FakeFile(size - 1, "h264")]
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        duration = time.perf_counter() - start
+        best = duration if best is None or duration < best else best
+    return best
+
+
+def main(sizes):
+    history = {"current": list(range(-3, 0)), "success": list(range(-1000, -3)), "failure": [], "all": []}
+    jobs = job_store.JobStore(":memory:")
+    for rk in history["current"]:
+        jobs.set_state(rk, job_store.RUNNING)
+    for rk in history["success"]:
+        jobs.set_state(rk, job_store.DONE)
+
+    mo = monitor.Monitor.__new__(monitor.Monitor)
+    mo.jobs = jobs
+    mo.probes = probe.ProbeCache(":memory:")
+    mo.config = {"plexLibraryFilesFilter": FILES_FILTER,
+                 "predicates": {"plexLibraryFilesFilter": config_loader.compile_files_filter(FILES_FILTER)}}
+
+    # the queues are filled once per library sync and serve every dispatch until the next one: the
+    # comparison charges a whole enqueue to a single dispatch, the worst case of the queued implementation
+    print("%10s %14s %14s %14s %14s %10s" % ("items", "eval [s]", "enqueue [s]", "get_file [s]", "dispatch [s]",
+                                            "speedup"))
+    for size in sizes:
+        files = library(size)
+        mo.plexLibrary = {"date": 0, "files": {f.ratingKey: f for f in files}}
+        repeat = 3 if size >= 1000000 else 10
+        legacy = measure(lambda: legacy_get_file(files, history, FILES_FILTER), repeat)
+        # the filters are now evaluated once per library sync when files are queued
+        mo.queues = {lane: scheduler.Scheduler("title") for lane in [transcoder.TRANSCODE, transcoder.REMUX]}
+        start = time.perf_counter()
+        for file in files:
+            mo.enqueue(file)
+        enqueue = time.perf_counter() - start
+        compiled = measure(mo.get_file, repeat)
+        dispatch = enqueue + compiled
+        print("%10d %14.4f %14.4f %14.6f %14.4f %9.1fx" % (size, legacy, enqueue, compiled, dispatch,
+                                                           legacy / dispatch))
+
+
+if __name__ == "__main__":
+    main([int(s) for s in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_gpu_telemetry.py
+# desc:   time a monitor update spends on gpu readings: a reading per update against the background sampler
+# usage:  python benchmarks/bench_gpu_telemetry.py [updates] [devices] [reading delay in ms] [backend]
+##########################################################
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import gpu_telemetry
+from modules import monitor
+
+
+class FakeBackend:
+    """a multi gpu host without a gpu: every reading takes as long as forking nvidia-smi would"""
+    name = "fake"
+
+    def __init__(self, devices, delay):
+        self.count = devices
+        self.delay = delay
+        self.readings = 0
+
+    def devices(self):
+        time.sleep(self.delay)
+        self.readings += 1
+        return [gpu_telemetry.device(i, "fake " + str(i), load=(self.readings * 7 + i * 30) % 100, memoryUtil=40 + i,
+                                     temperature=60 + i, encoder=(self.readings * 3) % 100)
+                for i in range(self.count)]
+
+    def close(self):
+        pass
+
+
+class Direct:
+    """what the monitor did before: read the devices on every update"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def devices(self):
+        return self.backend.devices()
+
+
+class BenchMonitor(monitor.Monitor):
+    def __init__(self, gpus):
+        # only what gpu() needs
+        self.ctrl = type("Ctrl", (), {"gpus": gpus, "profiles": []})()
+        self.states = {"gpu": {}}
+        self.gpuUnavailable = False
+
+
+def run(gpus, updates):
+    mo = BenchMonitor(gpus)
+    started = time.perf_counter()
+    for _ in range(updates):
+        mo.gpu()
+    return (time.perf_counter() - started) / updates, mo.states["gpu"]
+
+
+if __name__ == "__main__":
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    delay = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.04
+    print("%-12s %16s %10s" % ("gpu readings", "per update [ms]", "readings"))
+    for name in ["direct", "sampler"]:
+        backend = FakeBackend(devices, delay) if len(sys.argv) <= 4 else gpu_telemetry.backend(sys.argv[4])
+        gpus = Direct(backend) if name == "direct" else gpu_telemetry.Sampler(backend, interval=1).start()
+        perUpdate, states = run(gpus, updates)
+        if name == "sampler":
+            gpus.close()
+        print("%-12s %16.3f %10s" % (name, perUpdate * 1000, getattr(backend, "readings", "-")))
+    for d in states["devices"]:
+        print("  gpu %d %-12s load %5.1f%%  memory %5.1f%%  %5.1f C  encoder %s%%"
+              % (d["index"], d["name"], d["load"] or 0, d["memoryUtil"] or 0, d["temperature"] or 0, d["encoder"]))
+    if len(states["devices"]) > 0:
+        print("  busiest: load %(load).1f%%, memory %(memoryUtil).1f%%, %(temperature).1f C" % states)
+    else:
+        print("  no gpu telemetry")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_library_memory.py
+# desc:   memory of the library held by the monitor: plexapi objects vs MediaRecords
+# usage:  python benchmarks/bench_library_memory.py [items]
+##########################################################
+
+import gc
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+import psutil
+
+BENCHMARKS = Path(__file__).resolve().parent
+sys.path.append(str(BENCHMARKS.parent))
+sys.path.append(str(BENCHMARKS))
+
+from plexapi.video import Movie
+
+from modules.media_record import project
+
+import fake_plex
+
+INITPATH = "/library/sections/1/all"
+
+
+def element(i):
+    # an item like the plex api returns it in a library search
+    return fake_plex.video({"ratingKey": i, "section": 1, "title": "Movie %06d" % i, "titleSort": "movie %06d" % i,
+                            "addedAt": 1600000000 + i, "updatedAt": 1600000000 + i, "duration": 5400000,
+                            "mediaId": i, "bitrate": 8000000, "width": 1920, "height": 1080, "container": "mkv",
+                            "videoCodec": "h264", "audioCodec": "ac3", "partId": i,
+                            "file": "/media/movies/Movie %06d/Movie %06d.mkv" % (i, i), "size": 5400000000})
+
+
+def measure(items, name):
+    # runs in a fresh process: the growth of its rss is what the library costs
+    build = project if name == "records" else (lambda item: item)
+    process = psutil.Process()
+    gc.collect()
+    before = process.memory_info().rss
+    started = time.perf_counter()
+    library = {}
+    for i in range(1, items + 1):
+        file = build(Movie(None, element(i), INITPATH))
+        library[file.ratingKey] = file
+    seconds = time.perf_counter() - started
+    gc.collect()
+    return process.memory_info().rss - before, seconds
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("%-10s %12s %14s %10s" % ("library", "memory [MB]", "per item [B]", "build [s]"))
+    for name in ["plexapi", "records"]:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            memory, seconds = pool.apply(measure, (items, name))
+        print("%-10s %12.1f %14.0f %10.2f" % (name, memory / 2 ** 20, memory / items, seconds))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_mailer.py
+# desc:   mailer against a slow local smtp stand-in: time spent by the caller, connections and digests
+# usage:  python benchmarks/bench_mailer.py [mails] [server delay in seconds]
+##########################################################
+
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import mailer
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    """just enough smtp to accept mails, every reply is delayed like a slow mail server would"""
+
+    def reply(self, line):
+        time.sleep(self.server.delay)
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline().decode(errors="replace").strip()
+            command = line[:4].upper()
+            if not line or command == "QUIT":
+                self.reply("221 bye")
+                return
+            if command in ["EHLO", "HELO"]:
+                self.reply("250 stand-in")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                data = []
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line.rstrip(b"\r\n") == b".":
+                        break
+                    data.append(data_line.decode(errors="replace"))
+                self.server.mails.append("".join(data))
+                self.reply("250 queued")
+            else:
+                self.reply("250 ok")
+
+
+class SmtpStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.delay = delay
+        self.connections = 0
+        self.mails = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+def config(server, **kwargs):
+    smtp = {"hostname": "127.0.0.1", "port": server.server_address[1], "username": "grinder@localhost",
+            "password": "", "receiver": "admin@localhost", "security": "none", "timeout": 10,
+            "retries": 2, "retryDelay": 0.1}
+    smtp.update(kwargs)
+    return smtp
+
+
+def run(mails, delay, **kwargs):
+    server = SmtpStandIn(delay)
+    m = mailer.Mailer(config(server, **kwargs))
+    started = time.perf_counter()
+    for i in range(mails):
+        m.send("Video-Grinder: test " + str(i), "job " + str(i) + " done")
+        m.digest("job " + str(i) + " done")
+    caller = time.perf_counter() - started
+    m.close()
+    total = time.perf_counter() - started
+    server.shutdown()
+    return caller, total, server.connections, len(server.mails)
+
+
+if __name__ == "__main__":
+    mails = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    print("%-10s %12s %12s %12s %8s" % ("mode", "caller [ms]", "total [s]", "connections", "mails"))
+    for name, kwargs in [("immediate", {}), ("digest", {"digestInterval": 3600})]:
+        caller, total, connections, received = run(mails, delay, **kwargs)
+        print("%-10s %12.2f %12.2f %12d %8d" % (name, caller * 1000, total, connections, received))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_pipeline.py
+# desc:   end-to-end run of the controller against a fake plex
+# usage:  python benchmarks/bench_pipeline.py [--files 12] [--seconds 10] [--transcoders 2] [--workers 0]
+#                                            [--backend api|database] [--output result.json]
+##########################################################
+
+import argparse
+import json
+import logging
+import resource
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+sys.path.append(str(BENCHMARKS.parent))
+sys.path.append(str(BENCHMARKS))
+
+from modules import config_loader
+from modules import controller
+from modules import event_log
+from modules import job_store
+from modules import mailer
+from modules import organizer
+from modules import transcoder
+
+import fake_plex
+import plex_fixture
+import synthetic_library
+
+TOKEN = "video-grinder-bench"
+
+
+class BenchTranscoder(transcoder.Transcoder):
+    starts = []
+    ends = []
+
+    def run(self, file):
+        BenchTranscoder.starts.append(time.monotonic())
+        try:
+            super().run(file)
+        finally:
+            BenchTranscoder.ends.append(time.monotonic())
+
+
+class BenchOrganizer(organizer.Organizer):
+    downtimes = []
+
+    def updatePlexLibaray(self):
+        # called right after plex is back from organizing
+        BenchOrganizer.downtimes.append(self.downtime)
+        super().updatePlexLibaray()
+
+
+class BenchCtrl(controller.Ctrl):
+    remoteResults = []
+
+    def add_transcoder(self, lane=transcoder.TRANSCODE, profile=None):
+        self.transcoders.append(BenchTranscoder(self, self.config, lane, profile))
+
+    def add_organizer(self):
+        self.organizers.append(BenchOrganizer(self, self.config))
+
+    def remote_result(self, file, exit_code, source=None, output=None):
+        BenchCtrl.remoteResults.append(exit_code)
+        return super().remote_result(file, exit_code, source, output)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def write_config(work, server, args):
+    with open(BENCHMARKS.parent.joinpath("config", "example.json")) as f:
+        config = json.load(f)
+    stub = '"' + sys.executable + '" "' + str(BENCHMARKS.joinpath("stub_service.py")) + '" '
+    work.joinpath("veto.txt").write_text("true")
+    config.update({
+        "fakeFileSystem": {},
+        "logLevel": "WARNING",
+        "logFile": str(work.joinpath("debug.log")),
+        "csvLogFile": str(work.joinpath("log.csv")),
+        "organizerVetoFile": str(work.joinpath("veto.txt")),
+        "jobStoreFile": str(work.joinpath("jobs.db")),
+        "probeCacheFile": str(work.joinpath("probes.db")),
+        "qualityCacheFile": str(work.joinpath("quality.db")),
+        "readonly": "False",
+        "runningSpeed": 0.5,
+        "monitorUpdateInterval": 1,
+        "X-Plex-Token": TOKEN,
+        "plexServer": server.url,
+        "plexStatsUpdateInterval": 1,
+        "plexLibraryUpdateInterval": 2,
+        "plexLibraryBackend": args.backend,
+        "plexDB": server.db,
+        "plexLibrarySections": ["Movies"],
+        "plexServiceStartCommand": stub + "start " + server.url,
+        "plexServiceStopCommand": stub + "stop " + server.url,
+        "smtp": {"hostname": "", "port": 465, "username": "", "password": "", "receiver": ""},
+        "targetVideoCodec": args.codec,
+        "targetVideoSettings": args.settings,
+        "transcoderHWaccel": "False",
+        "encoderProfiles": args.profiles,
+        "transcoderCount": args.transcoders,
+        "transcoderCountMax": args.transcoders,
+        "transcoderAutoTune": "False",
+        "transcoderQualitySearch": "False",
+        "transcoderCache": str(work.joinpath("cache")),
+        "transcoderReady": {"plex": {"TranscodeSessionsDelta": ">= 1"}},
+        "organizerReady": {}
+    })
+    if args.workers > 0:
+        config.update({"coordinatorPort": free_port(), "coordinatorAddress": "127.0.0.1",
+                       "coordinatorToken": TOKEN, "coordinatorLeaseTimeout": 30})
+    path = work.joinpath("config.json")
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+    # every worker gets its own cache and logs, the jobs come from the coordinator over loopback
+    for i in range(args.workers):
+        worker = work.joinpath("worker-" + str(i))
+        worker.mkdir()
+        with open(work.joinpath("worker-" + str(i) + ".json"), "w") as f:
+            json.dump(dict(config, **{
+                "logFile": str(worker.joinpath("debug.log")),
+                "csvLogFile": str(worker.joinpath("log.csv")),
+                "probeCacheFile": str(worker.joinpath("probes.db")),
+                "qualityCacheFile": str(worker.joinpath("quality.db")),
+                "transcoderCache": str(worker.joinpath("cache")),
+                "workerCoordinator": "http://127.0.0.1:" + str(config["coordinatorPort"]),
+                "workerName": "worker-" + str(i),
+                "workerPollInterval": 1
+            }), f, indent=2)
+    return config_loader.Cfg(str(path)).config
+
+
+def start_workers(work, args):
+    return [subprocess.Popen([sys.executable, str(BENCHMARKS.parent.joinpath("video-grinder.py")),
+                              str(work.joinpath("worker-" + str(i) + ".json")), "--worker"],
+                             cwd=str(BENCHMARKS.parent), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            for i in range(args.workers)]
+
+
+def dispatch_latencies(starts, ends):
+    # the time from a finished job to the start of the next one
+    starts = sorted(starts)
+    latencies = []
+    for end in sorted(ends):
+        later = [s for s in starts if s >= end]
+        if later:
+            latencies.append(later[0] - end)
+    return latencies
+
+
+def summary(values, scale=1.0):
+    if not values:
+        return None
+    return {"mean": statistics.mean(values) * scale, "median": statistics.median(values) * scale,
+            "max": max(values) * scale, "samples": len(values)}
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(BENCHMARKS.parent),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    work = Path(tempfile.mkdtemp(prefix="video-grinder-pipeline-"))
+    try:
+        media = synthetic_library.create(work.joinpath("library"), args.files, args.seconds)
+        plex_fixture.create(work.joinpath("plex.db"), "Movies", media)
+        server = fake_plex.FakePlex(work.joinpath("plex.db"), TOKEN).start()
+        config = write_config(work, server, args)
+        logging.basicConfig(filename=config["logFile"], level=logging.INFO,
+                            format='%(asctime)s; %(levelname)s; %(message)s')
+        event_log.__LOG__ = event_log.EventLog(config["csvLogFile"], ["date", "type", "action", "code", "status"], config)
+        mailer.__MAIL__ = mailer.Mailer(config["smtp"])
+
+        ctrl = BenchCtrl(config)
+        started = time.monotonic()
+        thread = threading.Thread(target=ctrl.take_control)
+        thread.start()
+        workers = start_workers(work, args)
+        # all jobs are done once every file is organized or failed
+        while time.monotonic() - started < args.timeout:
+            finished = ctrl.jobs.count(job_store.ORGANIZED) + ctrl.jobs.count(job_store.FAILED)
+            if finished >= args.files and all(org.ready for org in ctrl.organizers):
+                break
+            time.sleep(0.2)
+        wall = time.monotonic() - started
+        for worker in workers:
+            worker.terminate()
+            worker.wait(30)
+        ctrl.stop()
+        thread.join(60)
+        server.shutdown()
+
+        organized = ctrl.jobs.count(job_store.ORGANIZED)
+        self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        # ru_maxrss is in kilobytes on linux and in bytes on macos
+        unit = 1 if sys.platform == "darwin" else 1024
+        return {
+            "commit": commit(),
+            "backend": args.backend,
+            "files": args.files,
+            "seconds": args.seconds,
+            "transcoders": args.transcoders,
+            "workers": args.workers,
+            "remoteResults": len(BenchCtrl.remoteResults),
+            "codec": args.codec,
+            "organized": organized,
+            "failed": ctrl.jobs.count(job_store.FAILED),
+            "timedOut": wall >= args.timeout,
+            "wallSeconds": wall,
+            "jobsPerHour": organized / wall * 3600,
+            "firstDispatchSeconds": min(BenchTranscoder.starts) - started if BenchTranscoder.starts else None,
+            "dispatchLatencyMs": summary(dispatch_latencies(BenchTranscoder.starts, BenchTranscoder.ends), 1000),
+            "organizeDowntimeSeconds": {"organizer": BenchOrganizer.downtimes, "service": server.downtimes()},
+            "peakRssMB": {"self": self * unit / 2 ** 20, "children": children * unit / 2 ** 20},
+            "plexRequests": dict(server.requests)
+        }
+    finally:
+        if args.keep:
+            print("work directory kept: " + str(work), file=sys.stderr)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="end-to-end benchmark of the Video-Grinder pipeline")
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--seconds", type=int, default=10, help="duration of every synthetic file")
+    parser.add_argument("--transcoders", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=0, help="worker processes next to the coordinator")
+    parser.add_argument("--backend", choices=["api", "database"], default="api")
+    parser.add_argument("--codec", default="libx265")
+    parser.add_argument("--settings", default="-preset ultrafast -crf 28")
+    parser.add_argument("--profiles", type=json.loads, default={},
+                        help="encoder profiles as json (instead of --codec, --settings and --transcoders)")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--output", help="write the json result to this file as well")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+    result = json.dumps(run(args), indent=2)
+    print(result)
+    if args.output:
+        Path(args.output).write_text(result + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  bench_transfer.py
+# desc:   shutil.move compared to the verified transfer engine
+# usage:  python benchmarks/bench_transfer.py [megabytes] [files] [source dirs...] [destination dir]
+#         defaults: tmpfs to disk (/dev/shm -> /var/tmp) and disk to disk (/var/tmp -> /var/tmp)
+##########################################################
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import transfer
+
+
+def create(directory, megabytes, files):
+    sources = []
+    block = os.urandom(1024 * 1024)
+    for i in range(files):
+        path = Path(directory).joinpath("source_%02d.mkv" % i)
+        with open(path, "wb") as f:
+            for _ in range(megabytes):
+                f.write(block)
+        sources.append(path)
+    return sources
+
+
+def drop_targets(destination):
+    for f in Path(destination).iterdir():
+        f.unlink()
+
+
+def measure(name, fn, source, destination, megabytes, files):
+    sources = create(source, megabytes, files)
+    moves = [(s, Path(destination).joinpath(s.name)) for s in sources]
+    start = time.perf_counter()
+    fn(moves)
+    duration = time.perf_counter() - start
+    drop_targets(destination)
+    print("%14s %10s %10.2f %10.0f" % (name, Path(source).parent.name or "/", duration,
+                                        megabytes * files / duration))
+
+
+def main(megabytes, files, pairs):
+    print("%14s %10s %10s %10s" % ("method", "source", "time [s]", "MB/s"))
+    for sourceRoot, destinationRoot in pairs:
+        source = tempfile.mkdtemp(prefix="video-grinder-src-", dir=sourceRoot)
+        destination = tempfile.mkdtemp(prefix="video-grinder-dst-", dir=destinationRoot)
+        try:
+            if os.stat(source).st_dev == os.stat(destination).st_dev:
+                print("%s and %s share a device: both methods only rename" % (sourceRoot, destinationRoot))
+            measure("shutil.move", lambda moves: [shutil.move(str(s), str(d)) for s, d in moves],
+                    source, destination, megabytes, files)
+            for workers in [1, 2, 4]:
+                engine = transfer.Transfers(workers)
+                measure("transfer x%d" % workers, engine.run, source, destination, megabytes, files)
+                engine.close()
+        finally:
+            shutil.rmtree(source)
+            shutil.rmtree(destination)
+
+
+if __name__ == "__main__":
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    files = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    if len(sys.argv) > 4:
+        pairs = [(s, sys.argv[-1]) for s in sys.argv[3:-1]]
+    else:
+        pairs = [("/dev/shm", "/var/tmp"), ("/var/tmp", "/var/tmp")]
+    main(megabytes, files, pairs)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  fake_plex.py
+# desc:   stand-in for the plex endpoints monitor and organizer use
+# usage:  python benchmarks/fake_plex.py <plex db fixture> [port]
+##########################################################
+
+import re
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+sys.path.append(str(Path(__file__).resolve().parent))
+
+import plex_fixture
+
+
+def resolution(height):
+    if not height:
+        return "sd"
+    for limit, name in [(2160, "4k"), (1080, "1080"), (720, "720"), (576, "576"), (480, "480")]:
+        if height >= limit:
+            return name
+    return "sd"
+
+
+def video(item):
+    element = ET.Element("Video", ratingKey=str(item["ratingKey"]), key="/library/metadata/" + str(item["ratingKey"]),
+                         type="movie", title=item["title"], titleSort=item["titleSort"],
+                         librarySectionID=str(item["section"]), addedAt=str(item["addedAt"]),
+                         updatedAt=str(item["updatedAt"]), duration=str(item["duration"]))
+    media = ET.SubElement(element, "Media", id=str(item["mediaId"]), duration=str(item["duration"]),
+                          bitrate=str((item["bitrate"] or 0) // 1000), width=str(item["width"]),
+                          height=str(item["height"]), container=str(item["container"]),
+                          videoCodec=str(item["videoCodec"]), audioCodec=str(item["audioCodec"]),
+                          videoResolution=resolution(item["height"]))
+    ET.SubElement(media, "Part", id=str(item["partId"]), key="/library/parts/" + str(item["partId"]) + "/file",
+                  file=item["file"], size=str(item["size"]), duration=str(item["duration"]),
+                  container=str(item["container"]))
+    return element
+
+
+def meta():
+    # the filter and sort fields plexapi validates searches against
+    container = ET.Element("MediaContainer", size="0")
+    element = ET.SubElement(container, "Meta")
+    for libtype, searchType in [("movie", "1"), ("episode", "4")]:
+        filterType = ET.SubElement(element, "Type", key="/library/sections/1/all?type=" + searchType, type=libtype,
+                                   title=libtype, active="1")
+        for key in ["titleSort", "addedAt", "updatedAt"]:
+            ET.SubElement(filterType, "Sort", key=key, title=key, defaultDirection="asc", descKey=key + ":desc")
+        for key in ["addedAt", "updatedAt"]:
+            ET.SubElement(filterType, "Field", key=key, title=key, type="date")
+    fieldType = ET.SubElement(element, "FieldType", type="date")
+    for key in [">>=", "<<="]:
+        ET.SubElement(fieldType, "Operator", key=key, title=key)
+    return container
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, element=None, status=200):
+        body = ET.tostring(element if element is not None else ET.Element("MediaContainer", size="0"))
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.route()
+
+    def do_PUT(self):
+        self.route()
+
+    def do_POST(self):
+        self.route()
+
+    def do_DELETE(self):
+        self.route()
+
+    def route(self):
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        server = self.server
+        server.requests[url.path] += 1
+        # the stub service commands stop and start the server
+        if url.path in ["/bench/stop", "/bench/start"]:
+            server.set_running(url.path == "/bench/start")
+            return self.reply()
+        if not server.running:
+            return self.reply(status=503)
+        if self.headers.get("X-Plex-Token", query.get("X-Plex-Token")) != server.token:
+            return self.reply(status=401)
+
+        if url.path == "/":
+            return self.reply(ET.Element("MediaContainer", size="0", friendlyName="Video-Grinder Bench",
+                                         machineIdentifier="video-grinder-bench", version="1.25.0.0",
+                                         platform="Linux", myPlex="0"))
+        if url.path == "/library":
+            return self.reply(ET.Element("MediaContainer", size="0", title1="Plex Library"))
+        if url.path == "/library/sections":
+            container = ET.Element("MediaContainer")
+            for sectionId, name, sectionType in plex_fixture.sections(server.db):
+                ET.SubElement(container, "Directory", key=str(sectionId), title=name,
+                              type="movie" if sectionType == plex_fixture.MOVIE else "show",
+                              agent="tv.plex.agents.movie", scanner="Plex Movie", language="en",
+                              uuid="video-grinder-bench-" + str(sectionId))
+            return self.reply(container)
+        match = re.fullmatch(r"/library/sections/(\d+)/(all|collections)", url.path)
+        if match:
+            if query.get("includeMeta") == "1":
+                return self.reply(meta())
+            if match.group(2) == "collections":
+                return self.reply()
+            return self.reply(self.search(int(match.group(1)), query))
+        match = re.fullmatch(r"/library/metadata/(\d+)", url.path)
+        if match:
+            items = plex_fixture.items(server.db, "AND mi.id = ?", (int(match.group(1)),))
+            if len(items) == 0:
+                return self.reply(status=404)
+            container = ET.Element("MediaContainer", size="1")
+            container.append(video(items[0]))
+            return self.reply(container)
+        if re.fullmatch(r"/library/sections/(\d+|all)/(refresh|analyze)", url.path):
+            return self.reply()
+        if url.path in ["/status/sessions", "/transcode/sessions"]:
+            return self.reply()
+        if url.path == "/statistics/resources":
+            container = ET.Element("MediaContainer", size="1")
+            ET.SubElement(container, "StatisticsResources", timespan="6", at=str(int(time.time())),
+                          hostCpuUtilization="10.0", processCpuUtilization="1.0",
+                          hostMemoryUtilization="20.0", processMemoryUtilization="2.0")
+            return self.reply(container)
+        return self.reply(status=404)
+
+    def search(self, sectionId, query):
+        where = "AND mi.library_section_id = ?"
+        params = [sectionId]
+        # delta syncs: updatedAt>> or addedAt>> (plexapi combines them with or)
+        since = [int(query[key]) for key in ["updatedAt>>", "addedAt>>"] if key in query]
+        if since:
+            where += " AND (mi.updated_at > ? OR mi.added_at > ?)"
+            params += [min(since), min(since)]
+        items = plex_fixture.items(self.server.db, where, params)
+        start = int(query.get("X-Plex-Container-Start", self.headers.get("X-Plex-Container-Start", 0)))
+        size = int(query.get("X-Plex-Container-Size", self.headers.get("X-Plex-Container-Size", len(items))))
+        page = items[start:start + size]
+        container = ET.Element("MediaContainer", size=str(len(page)), totalSize=str(len(items)), offset=str(start))
+        for item in page:
+            container.append(video(item))
+        return container
+
+
+class FakePlex(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, db, token, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.db = str(db)
+        self.token = token
+        self.running = True
+        self.requests = Counter()
+        # (time.monotonic(), running) of every stop and start
+        self.events = []
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:" + str(self.server_address[1])
+
+    def set_running(self, running):
+        self.running = running
+        self.events.append((time.monotonic(), running))
+
+    def downtimes(self):
+        stopped = None
+        downtimes = []
+        for at, running in self.events:
+            if not running and stopped is None:
+                stopped = at
+            elif running and stopped is not None:
+                downtimes.append(at - stopped)
+                stopped = None
+        return downtimes
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    server = FakePlex(sys.argv[1], "video-grinder-bench", int(sys.argv[2]) if len(sys.argv) > 2 else 32400)
+    print("fake plex listening on " + server.url)
+    server.serve_forever()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  plex_fixture.py
+# desc:   plex database fixture (the tables the grinder uses)
+##########################################################
+
+import sqlite3
+from datetime import datetime
+
+# metadata_type of movies in metadata_items, section_type of movie sections in library_sections
+MOVIE = 1
+
+SCHEMA = [
+    "CREATE TABLE library_sections (id INTEGER PRIMARY KEY, name TEXT, section_type INTEGER)",
+    "CREATE TABLE metadata_items (id INTEGER PRIMARY KEY, library_section_id INTEGER, metadata_type INTEGER, "
+    "title TEXT, title_sort TEXT, added_at INTEGER, updated_at INTEGER, deleted_at INTEGER)",
+    "CREATE TABLE media_items (id INTEGER PRIMARY KEY, metadata_item_id INTEGER, container TEXT, "
+    "video_codec TEXT, audio_codec TEXT, bitrate INTEGER, width INTEGER, height INTEGER, duration INTEGER, "
+    "audio_channels INTEGER, display_aspect_ratio REAL, deleted_at INTEGER)",
+    "CREATE TABLE media_parts (id INTEGER PRIMARY KEY, media_item_id INTEGER, file TEXT, size INTEGER, "
+    "duration INTEGER, deleted_at INTEGER)",
+    "CREATE INDEX index_media_parts_on_file ON media_parts (file)"
+]
+
+ITEMS = ("SELECT mi.id, mi.library_section_id, mi.title, mi.title_sort, mi.added_at, mi.updated_at, "
+         "media.id, media.container, media.video_codec, media.audio_codec, media.bitrate, media.width, "
+         "media.height, media.duration, mp.id, mp.file, mp.size "
+         "FROM metadata_items mi "
+         "JOIN media_items media ON media.metadata_item_id = mi.id "
+         "JOIN media_parts mp ON mp.media_item_id = media.id "
+         "WHERE mi.deleted_at IS NULL AND media.deleted_at IS NULL AND mp.deleted_at IS NULL {where} "
+         "ORDER BY mi.title_sort, mi.id")
+COLUMNS = ["ratingKey", "section", "title", "titleSort", "addedAt", "updatedAt", "mediaId", "container",
+           "videoCodec", "audioCodec", "bitrate", "width", "height", "duration", "partId", "file", "size"]
+
+
+def create(path, section, media):
+    """create a plex database with one movie section holding the media (MediaRecords of modules.probe)"""
+    now = int(datetime.timestamp(datetime.now()))
+    dbconn = sqlite3.connect(str(path))
+    for statement in SCHEMA:
+        dbconn.execute(statement)
+    dbconn.execute("INSERT INTO library_sections (id, name, section_type) VALUES (1, ?, ?)", (section, MOVIE))
+    for rk, m in enumerate(media, 1):
+        dbconn.execute("INSERT INTO metadata_items (id, library_section_id, metadata_type, title, title_sort, "
+                       "added_at, updated_at) VALUES (?, 1, ?, ?, ?, ?, ?)",
+                       (rk, MOVIE, m.title, m.title.lower(), now - rk, now - rk))
+        dbconn.execute("INSERT INTO media_items (id, metadata_item_id, container, video_codec, audio_codec, bitrate, "
+                       "width, height, duration, audio_channels, display_aspect_ratio) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (rk, rk, m.container, m.videoCodec, m.audioCodec, (m.bitrate or 0) * 1000, m.width, m.height,
+                        int(m.duration or 0), m.audioChannels, m.aspectRatio))
+        dbconn.execute("INSERT INTO media_parts (id, media_item_id, file, size, duration) VALUES (?, ?, ?, ?, ?)",
+                       (rk, rk, m.locations[0], m.size, int(m.duration or 0)))
+    dbconn.commit()
+    dbconn.close()
+
+
+def items(path, where="", params=()):
+    dbconn = sqlite3.connect(str(path), timeout=30)
+    try:
+        return [dict(zip(COLUMNS, row)) for row in dbconn.execute(ITEMS.format(where=where), params)]
+    finally:
+        dbconn.close()
+
+
+def sections(path):
+    dbconn = sqlite3.connect(str(path), timeout=30)
+    try:
+        return dbconn.execute("SELECT id, name, section_type FROM library_sections").fetchall()
+    finally:
+        dbconn.close()
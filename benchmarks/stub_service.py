@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  stub_service.py
+# desc:   plexServiceStart/StopCommand for the fake plex server
+# usage:  python benchmarks/stub_service.py start|stop <fake plex url>
+##########################################################
+
+import sys
+from urllib.request import urlopen
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ["start", "stop"]:
+        sys.exit("usage: stub_service.py start|stop <fake plex url>")
+    urlopen(sys.argv[2].rstrip("/") + "/bench/" + sys.argv[1], timeout=10).read()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  synthetic_library.py
+# desc:   media library of ffmpeg test patterns in several formats
+# usage:  python benchmarks/synthetic_library.py <directory> [files] [seconds]
+##########################################################
+
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules import probe
+
+# (video codec, audio codec, container) of the files we want to grind, the last one only needs a remux
+PROFILES = [
+    ("mpeg4", "mp3", "avi"),
+    ("libx264", "aac", "mp4"),
+    ("mpeg2video", "mp2", "mpg"),
+    ("libx264", "ac3", "mkv"),
+    ("msmpeg4v2", "mp3", "avi"),
+    ("libx265", "aac", "mp4")
+]
+
+
+def create(directory, files=12, seconds=10, size="640x360", rate=25):
+    """create the files and return them described like plex does (MediaRecords)"""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    media = []
+    for i in range(files):
+        videoCodec, audioCodec, container = PROFILES[i % len(PROFILES)]
+        path = directory.joinpath("Clip %03d (%s).%s" % (i, videoCodec, container))
+        # a different pattern and tone per file, so no two files encode the same
+        subprocess.run(["ffmpeg", "-v", "error", "-y",
+                        "-f", "lavfi", "-i", "testsrc2=duration=%d:size=%s:rate=%d" % (seconds, size, rate),
+                        "-f", "lavfi", "-i", "sine=frequency=%d:duration=%d" % (220 + 20 * i, seconds),
+                        "-c:v", videoCodec, "-c:a", audioCodec, "-shortest", str(path)], check=True)
+        record = probe.as_media(probe.run_ffprobe(path))
+        record.title = path.stem
+        record.locations = [str(path)]
+        media.append(record)
+    return media
+
+
+if __name__ == "__main__":
+    for m in create(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 12,
+                    int(sys.argv[3]) if len(sys.argv) > 3 else 10):
+        print("%-40s %-6s %-12s %-6s %8d kbit/s" % (m.title, m.container, m.videoCodec, m.audioCodec, m.bitrate or 0))
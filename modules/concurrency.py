@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  concurrency.py
+# desc:   adapts the number of concurrent transcodes
+##########################################################
+
+import logging
+import time
+
+from modules import event_log
+
+
+class ConcurrencyTuner:
+    """hill-climbing on the encode throughput (fps x pixels) with hysteresis
+
+    The mean throughput of every tuning window is remembered for the number of transcoders it was
+    measured with. A neighbouring number is only moved to if it was measured to be better by more
+    than the hysteresis, or if it was not measured (recently) and has to be probed. An overloaded
+    cpu or gpu always steps down. Measurements expire, so a changed source mix is explored again.
+    """
+
+    def __init__(self, config, name=""):
+        # the encoder profile whose pool is tuned
+        self.name = name
+        self.enabled = config.get("transcoderAutoTune", "False") == "True"
+        self.minimum = max(1, config.get("transcoderCountMin", 1))
+        self.maximum = max(self.minimum, config.get("transcoderCountMax", config["transcoderCount"]))
+        self.limit = min(max(config["transcoderCount"], self.minimum), self.maximum)
+        self.interval = config.get("transcoderTuneInterval", 300)
+        self.hysteresis = config.get("transcoderTuneHysteresis", 0.05)
+        self.overload = config.get("transcoderTuneOverload", 95)
+        self.memory = config.get("transcoderTuneMemory", 12)
+        # the resources whose overload makes this pool step down
+        self.resources = config.get("transcoderTuneResources", ["cpu", "gpu"])
+        self.direction = 1
+        self.window = 0
+        self.measured = {}
+        self.samples = []
+        self.windowStart = time.monotonic()
+
+    def sample(self, states, busy):
+        """collect one measurement, returns the (new) limit of concurrent transcoders"""
+        if not self.enabled:
+            return self.limit
+        # only saturated windows tell something about the limit: a short queue does not use all slots
+        if busy < self.limit:
+            self.samples = []
+            self.windowStart = time.monotonic()
+            return self.limit
+        self.samples.append((states["transcoder"].get("throughput", 0),
+                             states["sys"].get("cpu", 0), states["gpu"].get("load", 0)))
+        if time.monotonic() - self.windowStart >= self.interval:
+            self.tune(*[sum(s) / len(self.samples) for s in zip(*self.samples)])
+            self.samples = []
+            self.windowStart = time.monotonic()
+        return self.limit
+
+    def known(self, limit):
+        # throughput measured with limit transcoders or None if unknown or expired
+        if limit in self.measured and self.window - self.measured[limit][1] < self.memory:
+            return self.measured[limit][0]
+        return None
+
+    def tune(self, throughput, cpu, gpu):
+        self.window += 1
+        old = self.limit
+        self.measured[old] = (throughput, self.window)
+        neighbours = [n for n in [old + self.direction, old - self.direction] if self.minimum <= n <= self.maximum]
+        better = [n for n in neighbours
+                  if self.known(n) is not None and self.known(n) > throughput * (1 + self.hysteresis)]
+        unknown = [n for n in neighbours if self.known(n) is None]
+        if ("cpu" in self.resources and cpu >= self.overload) or ("gpu" in self.resources and gpu >= self.overload):
+            reason, new = "overloaded", max(old - 1, self.minimum)
+        elif len(better) > 0:
+            reason, new = "better", max(better, key=self.known)
+        elif len(unknown) > 0:
+            reason, new = "probe", unknown[0]
+        else:
+            reason, new = "steady", old
+        if new != old:
+            self.direction = 1 if new > old else -1
+        self.log(reason, old, new, throughput, cpu, gpu)
+        self.limit = new
+
+    def log(self, reason, old, new, throughput, cpu, gpu):
+        logging.info("concurrency: " + (self.name + ": " if self.name else "") + reason + ": " + str(old) + " -> " + str(new) + " transcoders "
+                     + "(throughput " + str(round(throughput)) + " px/s, cpu " + str(round(cpu)) + "%, gpu "
+                     + str(round(gpu)) + "%)")
+        if event_log.__LOG__ is not None:
+            event_log.__LOG__.log(["controller", "concurrency", new, reason, str(old), str(new),
+                                   round(throughput), round(cpu), round(gpu), self.name])
@@ -8,10 +8,109 @@
 # desc:   loading config from a json file
 ##########################################################
 
-import sys
+import ast
+import ipaddress
+import re
 import json
+import operator
+from datetime import datetime, time
 from pathlib import Path
 
+from modules import event_log
+from modules import gpu_telemetry
+from modules import media_record
+from modules import scheduler
+
+# supported operators of config expressions like "< 75" or "!= 'hevc'" (longest first)
+OPERATORS = [("not in", lambda a, b: a not in b), ("in", lambda a, b: a in b),
+             ("<=", operator.le), (">=", operator.ge), ("==", operator.eq), ("!=", operator.ne),
+             ("<", operator.lt), (">", operator.gt)]
+EXPRESSION = re.compile(r"^\s*(" + "|".join(re.escape(o) for o, _ in OPERATORS) + r")\s*(.+?)\s*$")
+
+
+def is_time_between(begin_time, end_time, check_time=None):
+    # If check time is not given, default to current UTC time
+    check_time = check_time or datetime.utcnow().time()
+    if begin_time < end_time:
+        return check_time >= begin_time and check_time <= end_time
+    else:  # crosses midnight
+        return check_time >= begin_time or check_time <= end_time
+
+
+def local_path(config, location):
+    """path of a library file as seen by the grinder (fakeFileSystem maps the paths of the plex server)"""
+    path = str(location)
+    if "fakeFileSystem" in config and len(config["fakeFileSystem"]) > 0:
+        path = path.replace(config["fakeFileSystem"]["search"][0], config["fakeFileSystem"]["replace"][0]) \
+            .replace(config["fakeFileSystem"]["search"][1], config["fakeFileSystem"]["replace"][1])
+    return Path(path)
+
+
+def loopback(address):
+    # coordinator uploads end up in the plex library: only this box may send them without a token
+    if address == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def compile_expression(expression):
+    """compile a config expression once into a function, returns None if the expression is disabled (-1)"""
+    if expression == -1:
+        return None
+    # a list of time windows: {"start": [h, m], "end": [h, m]}
+    if isinstance(expression, list):
+        if len(expression) == 0:
+            return None
+        windows = [(time(w["start"][0], w["start"][1]), time(w["end"][0], w["end"][1])) for w in expression]
+        return lambda v: any(is_time_between(begin, end, v) for begin, end in windows)
+    match = EXPRESSION.match(str(expression))
+    if not match:
+        raise ValueError("Config expression invalid: " + str(expression))
+    compare = dict(OPERATORS)[match.group(1)]
+    try:
+        value = ast.literal_eval(match.group(2))
+    except (ValueError, SyntaxError):
+        raise ValueError("Config expression invalid: " + str(expression))
+    return lambda v: compare(v, value)
+
+
+def compile_readiness(readiness):
+    # flatten {"counter": {"value": expression}} into a list of (counter, value, check)
+    checks = []
+    for counter in readiness:
+        for value in readiness[counter]:
+            check = compile_expression(readiness[counter][value])
+            if check is not None:
+                checks.append((counter, value, check))
+    return checks
+
+
+def compile_files_filter(files_filter):
+    # a list of (media attribute getter, check) for every enabled filter
+    checks = []
+    for attr in files_filter:
+        # the library only keeps compact records: an attribute they do not have would fail every sync
+        if attr not in media_record.FILTERABLE:
+            raise ValueError("Config filter invalid: " + str(attr) + " is not one of " + str(list(media_record.FILTERABLE)))
+        check = compile_expression(files_filter[attr])
+        if check is not None:
+            checks.append((operator.attrgetter(attr), check))
+    return checks
+
+
+def compile_predicates(config):
+    return {
+        "transcoderReady": compile_readiness(config["transcoderReady"]),
+        "organizerReady": compile_readiness(config["organizerReady"]),
+        "queueFull": [(counter, value, check) for counter, value, check
+                      in compile_readiness({"fs": config["transcoderReady"].get("fs", {})})
+                      if value in ["transcoderCacheSize", "transcoderCacheDiskFree"]],
+        "plexLibraryFilesFilter": compile_files_filter(config.get("plexLibraryFilesFilter", {}))
+    }
+
 
 class Cfg:
     def __init__(self, cfg_file):
@@ -37,3 +136,43 @@ class Cfg:
         for m in self.mandatory:
             if m not in self.config and self.config[m]:
                 raise ValueError("Config file invalid: " + m + " not found or empty in" + str(path.absolute()))
+
+        # the job store lives next to the config file unless configured otherwise
+        if "jobStoreFile" not in self.config or not self.config["jobStoreFile"]:
+            self.config["jobStoreFile"] = str(path.parent.joinpath("jobs.db"))
+        if "probeCacheFile" not in self.config or not self.config["probeCacheFile"]:
+            self.config["probeCacheFile"] = str(path.parent.joinpath("probes.db"))
+        if "qualityCacheFile" not in self.config or not self.config["qualityCacheFile"]:
+            self.config["qualityCacheFile"] = str(path.parent.joinpath("quality.db"))
+
+        if self.config.get("transcoderSchedulingPolicy", "title") not in scheduler.POLICIES:
+            raise ValueError("Config file invalid: transcoderSchedulingPolicy must be one of "
+                             + str(list(scheduler.POLICIES)) + " in " + str(path.absolute()))
+
+        try:
+            for libtype in ["movies", "shows"]:
+                scheduler.parse_sort(self.config["plexLibrarySort"][libtype])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError("Config file invalid: plexLibrarySort needs a sort for movies and shows ("
+                             + str(e) + ") in " + str(path.absolute()))
+
+        if self.config.get("eventLogFormat", "csv") not in event_log.FORMATS:
+            raise ValueError("Config file invalid: eventLogFormat must be one of "
+                             + str(event_log.FORMATS) + " in " + str(path.absolute()))
+        if self.config.get("eventLogOverflow", "drop") not in ["drop", "block"]:
+            raise ValueError("Config file invalid: eventLogOverflow must be one of "
+                             + str(["drop", "block"]) + " in " + str(path.absolute()))
+        if self.config.get("gpuTelemetry", "auto") not in ["auto"] + list(gpu_telemetry.BACKENDS):
+            raise ValueError("Config file invalid: gpuTelemetry must be one of "
+                             + str(["auto"] + list(gpu_telemetry.BACKENDS)) + " in " + str(path.absolute()))
+        if self.config.get("coordinatorPort", 0) and not self.config.get("coordinatorToken") and \
+                not loopback(self.config.get("coordinatorAddress", "127.0.0.1")):
+            raise ValueError("Config file invalid: coordinatorToken is needed for a coordinatorAddress other than "
+                             "the loopback in " + str(path.absolute()))
+        for name, profile in self.config.get("encoderProfiles", {}).items():
+            if not isinstance(profile, dict) or not profile.get("codec"):
+                raise ValueError("Config file invalid: encoder profile " + name + " needs a codec in "
+                                 + str(path.absolute()))
+
+        # parse all expressions once, the monitor only calls the resulting functions
+        self.config["predicates"] = compile_predicates(self.config)
@@ -9,19 +9,19 @@
 ##########################################################
 
 import logging
+import threading
 import time
 from modules import monitor
 from modules import transcoder
 from modules import organizer
 from modules import mailer
-from enum import Enum, auto
-
-
-class CtrlStates(Enum):
-    IDLE = auto()
-    SELFCHECK = auto()
-    QUEUE = auto()
-    ORGANIZE = auto()
+from modules import job_store
+from modules import probe
+from modules import coordinator
+from modules import encoders
+from modules import gpu_telemetry
+from modules import verifier
+from modules import quality
 
 
 class Ctrl:
@@ -32,9 +32,38 @@ class Ctrl:
         self.transcoders = []
         self.organizers = []
         self.runningSpeed = self.config["runningSpeed"]
+        # the monitor used to be updated every fourth tick of the former state machine
+        self.monitorUpdateInterval = self.config.get("monitorUpdateInterval", 4 * self.runningSpeed)
+        # readonly runs must not leave any traces in the persistent job store
+        if self.config["readonly"] == "False":
+            self.jobs = job_store.JobStore(self.config["jobStoreFile"])
+        else:
+            self.jobs = job_store.JobStore(":memory:")
+        # ffprobe results of the media files, shared by monitor, transcoders and organizer (in memory if readonly)
+        probes = self.config["probeCacheFile"] if self.config["readonly"] == "False" else ":memory:"
+        self.probes = probe.ProbeCache(probes, self.config.get("probeWorkers", 2), self.config.get("probeBacklog", 1000))
+        # encoder profiles that work on this box: every one has its own pool of transcoders, its own
+        # concurrency (fixed to its count unless auto tuning is enabled) and searches its own settings per title
+        self.profiles = encoders.profiles(self.config)
+        for profile in self.profiles:
+            profile.quality = quality.QualitySearch(profile.config)
+        # gpu readings of all devices, sampled in the background at their own rate
+        self.gpus = gpu_telemetry.sampler(self.config).start()
+        # transcoded files are verified in their own pool before they are organized
+        self.verifier = verifier.Verifier(self, self.config)
+        # complete outputs of an earlier run are kept, the monitor restores them as successfully transcoded
+        self.verifier.adopt(self.jobs)
+        recovered = self.jobs.recover()
+        if len(recovered) > 0:
+            logging.info("controller: " + str(len(recovered)) + " interrupted jobs queued again")
         self.addingInProgress = {"monitors": False, "transcoders": False,
                                  "organizers": False}
-        self.__state = CtrlStates.IDLE
+        self.running = False
+        # set by transcoders, monitors and organizers as soon as they are done with their work
+        self.wakeup = threading.Event()
+        # remote workers claim jobs from the same queue the local transcoders are fed from
+        self.dispatchLock = threading.Lock()
+        self.coordinator = None
         logging.info("controller: initialized")
 
     def add_monitor(self):
@@ -66,28 +95,52 @@ class Ctrl:
                 mos.append(mo)
         return mos
 
-    def add_transcoder(self):
+    def add_transcoder(self, lane=transcoder.TRANSCODE, profile=None):
         self.addingInProgress["transcoders"] = True
-        self.transcoders.append(transcoder.Transcoder(self.config))
+        self.transcoders.append(transcoder.Transcoder(self, self.config, lane, profile))
         self.addingInProgress["transcoders"] = False
-        logging.info("transcoder: created")
+        logging.info("transcoder: created (" + lane + (", " + profile.name if profile is not None else "") + ")")
 
-    def get_transcoder(self):
-        for tr in self.transcoders:
-            if tr.ready:
+    def get_transcoders(self, lane, profile=None):
+        return [tr for tr in self.transcoders if tr.lane == lane and (profile is None or tr.profile is profile)]
+
+    def get_transcoder(self, lane=transcoder.TRANSCODE, file=None, ready=None):
+        # ready checks the resources: for the lane or, for encoders, for the profile of the transcoder
+        if lane != transcoder.TRANSCODE:
+            tr = self.get_ready_transcoder(self.get_transcoders(lane))
+            return tr if tr and (ready is None or ready()) else False
+        # the first profile taking the file gets it, files no profile takes go to any of them
+        profiles = [profile for profile in self.profiles if file is None or profile.accepts(file)] or self.profiles
+        for profile in profiles:
+            # the concurrency tuner of the profile decides how many of its encoders may run at once
+            if len(self.get_busy_transcoders(lane, profile)) >= profile.concurrency.limit:
+                continue
+            tr = self.get_ready_transcoder(self.get_transcoders(lane, profile))
+            if tr and (ready is None or ready(profile)):
+                return tr
+        return False
+
+    def get_ready_transcoder(self, transcoders):
+        for tr in transcoders:
+            # a transcoder that finished after queue() collected the results keeps its exit code until the next round
+            if tr.ready and tr.exit_code in [-1, 999]:
                 return tr
         return False
 
-    def get_busy_transcoders(self):
+    def get_busy_transcoders(self, lane=None, profile=None):
         tra = []
         for tr in self.transcoders:
-            if not tr.ready:
+            if not tr.ready and (lane is None or tr.lane == lane) and (profile is None or tr.profile is profile):
                 tra.append(tr)
         return tra
 
+    def transcoder_limit(self):
+        # concurrent transcodes of all profiles together
+        return sum(profile.concurrency.limit for profile in self.profiles)
+
     def add_organizer(self):
         self.addingInProgress["organizers"] = True
-        self.organizers.append(organizer.Organizer(self.config))
+        self.organizers.append(organizer.Organizer(self, self.config))
         self.addingInProgress["organizers"] = False
         logging.info("organizer: created")
 
@@ -106,147 +159,226 @@ class Ctrl:
                 orga.append(org)
         return orga
 
+    def notify(self, reason):
+        # wake up the controller: something finished and the next job might be ready to start
+        logging.debug("controller: notified by " + reason)
+        self.wakeup.set()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
     def take_control(self):
-        while True:
-            # delay loop to avoid heavy load
-            time.sleep(self.runningSpeed)
-            logging.debug("state machine: " + str(self.__state))
-
-            # Here the state machine happens
-            if self.__state == CtrlStates.IDLE:
-                """STATE: IDLE - run maintenance-like jobs"""
-                # check if a organizer is currently organizing files.
-                # If so, send the monitors to sleep; if not, wake the sleeping monitors up.
-                # Why? - Because no transcode and no plex request should be made during organizing.
-                organizing = False
-                for org in self.get_busy_organizers():
-                    if org.organizing:
-                        organizing = True
-                if organizing:
-                    # set monitors to sleep
-                    for mo in self.get_monitors():
-                        mo.sleep()
-                else:
-                    # wake up monitors
-                    for mo in self.get_sleeping_monitors():
-                        mo.wakeup()
+        self.running = True
+        if self.config.get("coordinatorPort", 0) and self.coordinator is None:
+            self.coordinator = coordinator.Coordinator(self, self.config).start()
+        nextUpdate = 0
+        while self.running:
+            # sleep until a component notifies us or the next periodic monitor update is due
+            self.wakeup.wait(max(0, nextUpdate - time.monotonic()))
+            self.wakeup.clear()
+            if not self.running:
+                break
 
-                # get an available monitor and initiate a data update.
-                if self.get_monitor():
-                    self.get_monitor().update_data()
+            update = time.monotonic() >= nextUpdate
+            if update:
+                nextUpdate = time.monotonic() + self.monitorUpdateInterval
 
-                # Next step: run selfchecks
-                self.__state = CtrlStates.SELFCHECK
-                continue
+            self.idle(update)
+            self.selfcheck()
+            if self.queue():
+                self.organize()
+        if self.coordinator is not None:
+            self.coordinator.stop()
+            self.coordinator = None
 
-            if self.__state == CtrlStates.SELFCHECK:
-                """STATE: SELFCHECK - check if there are enough monitors, transcoders and organizers or create them"""
-                # make sure that one monitor exists (you should use only 1 monitor)
-                if len(self.monitors) == 0 and not self.addingInProgress["monitors"]:
-                    self.add_monitor()
+    def idle(self, update):
+        """STEP: IDLE - run maintenance-like jobs"""
+        # check if a organizer is currently organizing files.
+        # If so, send the monitors to sleep; if not, wake the sleeping monitors up.
+        # Why? - Because no transcode and no plex request should be made during organizing.
+        organizing = False
+        for org in self.get_busy_organizers():
+            if org.organizing:
+                organizing = True
+        if organizing:
+            # set monitors to sleep
+            for mo in self.get_monitors():
+                mo.sleep()
+        else:
+            # wake up monitors
+            for mo in self.get_sleeping_monitors():
+                mo.wakeup()
 
-                # check if enough transcoders exist (you can define the number of transcoders in config)
-                if len(self.transcoders) < self.config["transcoderCount"] and not \
-                self.addingInProgress["transcoders"]:
-                    self.add_transcoder()
+        # get an available monitor and initiate a data update (the monitor notifies us when it is done)
+        if update and self.get_monitor():
+            self.get_monitor().update_data()
 
-                # make sure that one organizer exists (you should use only 1 monitor)
-                if len(self.organizers) == 0 and not self.addingInProgress["organizers"]:
-                    self.add_organizer()
+    def selfcheck(self):
+        """STEP: SELFCHECK - check if there are enough monitors, transcoders and organizers or create them"""
+        # make sure that one monitor exists (you should use only 1 monitor)
+        if len(self.monitors) == 0 and not self.addingInProgress["monitors"]:
+            self.add_monitor()
 
-                # Next step: work of the queue
-                self.__state = CtrlStates.QUEUE
-                continue
+        # check if enough transcoders exist for every profile (its concurrency tuner might use up to its maximum)
+        for profile in self.profiles:
+            while len(self.get_transcoders(transcoder.TRANSCODE, profile)) < profile.concurrency.maximum and not \
+                    self.addingInProgress["transcoders"]:
+                self.add_transcoder(transcoder.TRANSCODE, profile)
+        # remuxers do not use an encoder, they get their own lane
+        if self.config.get("transcoderRemux", "False") == "True":
+            while len(self.get_transcoders(transcoder.REMUX)) < self.config.get("remuxerCount", 1) and not \
+                    self.addingInProgress["transcoders"]:
+                self.add_transcoder(transcoder.REMUX)
 
-            if self.__state == CtrlStates.QUEUE:
-                """STATE: QUEUE - run a transcode job if everything is right"""
-                # get an available monitor and check if it is ready for transcode
-                mo = self.get_monitor()
-                if mo:
-                    # do stuff with finished transcoders
-                    for tr in self.transcoders:
-                        # something unexpected happened while transcoding
-                        # -> remove_x will keep the file for transcoding in queue and causes another transcoding
-                        if tr.exit_code not in [-1, 0, 1, 404, 405, 500,
-                                                999] and tr.file is not None:
-                            mo.remove_current_transcoding(tr.file)
-                            tr.exit_code = 999
-                        # last transcoding was successfully
-                        # -> remove_x and set_x will remove the file from transcoder queue and add it to organizer queue
-                        elif tr.exit_code in [0, 1] and tr.file is not None:
-                            mo.remove_current_transcoding(tr.file)
-                            mo.set_successfully_transcoded(tr.file)
-                            tr.exit_code = 999
-                        # last transcoding was not successfully
-                        # -> remove_x and set_x will remove the file from transcoder queue
-                        elif tr.exit_code in [404, 405, 500] and tr.file is not None:
-                            mo.remove_current_transcoding(tr.file)
-                            mo.set_failed_to_transcode(tr.file)
-                            tr.exit_code = 999
-
-                    # do only proceed if no organizer is busy
-                    if len(self.get_busy_organizers()) == 0:
-                        file = mo.get_file()
-
-                        logging.debug(
-                            "monitor: states before transcoding: " + str(mo.get_states()))
-                        # logging.debug("monitor: file before transcoding: " + str(file))
-
-                        # do only proceed if files are in queue and one transcoder is ready
-                        if file and mo.ready_to_transcode():
-                            # get an available transcoder and send task for transcoding
-                            tr = self.get_transcoder()
-                            if tr:
-                                # mark file as being currently transcoded to avoid duplicated jobs
-                                mo.set_current_transcoding(file)
-                                # send transccode job ("Energize" is the keyword)
-                                tr.transcode(file)
-                        else:
-                            if not mo.ready_to_transcode():
-                                if self.get_transcoder():
-                                    logging.info(
-                                        "monitor: not ready to transcode: " + str(
-                                            mo.failureReason))
-                            if not file:
-                                logging.info("monitor: no files to transcode.")
-                                # since there are no files left to transcode we go right to organizing state
-                                self.__state = CtrlStates.ORGANIZE
-                                continue
-                        # if the transcoder queue is full go to organizing state
-                        if mo.queue_full():
-                            # Next step: organize the transcoded files
-                            self.__state = CtrlStates.ORGANIZE
-                            continue
-                # Next step: go to idle state, read: begin from start
-                self.__state = CtrlStates.IDLE
-                continue
+        # make sure that one organizer exists (you should use only 1 monitor)
+        if len(self.organizers) == 0 and not self.addingInProgress["organizers"]:
+            self.add_organizer()
 
-            if self.__state == CtrlStates.ORGANIZE:
-                """STATE: ORGANIZE - do stuff with the transcoded files (order them to plex library)"""
-                # get an available organizer and monitor
-                org = self.get_organizer()
-                mo = self.get_monitor()
-                if org and mo:
-                    # do only organize when nothing is being transcoded
-                    if len(self.get_busy_transcoders()) == 0:
-                        logging.info("organizer veto: " + str(mo.get_veto_organize()))
-                        # if monitor indicated readiness for organizing, start organizing
-                        ready = False
-                        if mo.get_veto_organize() is not False:
-                            if mo.get_veto_organize() is True:
-                                ready = True
-                            elif mo.ready_to_organize() is True:
-                                ready = True
-
-                        if ready:
-                            if org.transcodedFiles():
-                                mailer.__MAIL__.send("Video-Grinder: Organizer starts",
-                                                     "We just let you know that organizer is starting.")
-                                org.organize(mo.get_successfully_transcoded())
-                            else:
-                                logging.info("organizer: nothing to organize")
-                        else:
-                            logging.info("organizer: not ready: " + str(mo.failureReason))
-                # Next step: go to idle state, read: begin from start
-                self.__state = CtrlStates.IDLE
-                continue
+    def queue(self):
+        """STEP: QUEUE - run transcode jobs if everything is right, returns True if it is time to organize"""
+        # get an available monitor and check if it is ready for transcode
+        mo = self.get_monitor()
+        if not mo:
+            return False
+        # do stuff with finished transcoders
+        for tr in self.transcoders:
+            # the file belongs to another lane (ffprobe disagrees with plex)
+            # -> remove_x puts it back into the queue of its lane according to the probe
+            if tr.exit_code == transcoder.REQUEUE and tr.file is not None:
+                mo.remove_current_transcoding(tr.file)
+                tr.exit_code = 999
+            # something unexpected happened while transcoding
+            # -> remove_x will keep the file for transcoding in queue and causes another transcoding
+            elif tr.exit_code not in [-1, 0, 1, 404, 405, 500,
+                                      999] and tr.file is not None:
+                mo.remove_current_transcoding(tr.file)
+                tr.exit_code = 999
+            # last transcoding was successfully
+            # -> the output is verified before it is added to organizer queue
+            elif tr.exit_code in [0, 1] and tr.file is not None:
+                mo.set_verifying(tr.file)
+                self.verifier.submit(tr.file, tr.source, tr.output)
+                tr.exit_code = 999
+            # last transcoding was not successfully
+            # -> remove_x and set_x will remove the file from transcoder queue
+            elif tr.exit_code in [404, 405, 500] and tr.file is not None:
+                mo.remove_current_transcoding(tr.file)
+                mo.set_failed_to_transcode(tr.file, tr.exit_code)
+                tr.exit_code = 999
+
+        # jobs of remote workers that stopped sending heartbeats are queued again
+        if self.coordinator is not None:
+            for file in self.coordinator.expired():
+                mo.remove_current_transcoding(file)
+
+        # verified files are ready to be organized, the others are transcoded again later
+        for file, problems in self.verifier.finished():
+            if len(problems) > 0:
+                mo.set_failed_to_transcode(file, verifier.FAILED, "; ".join(problems))
+            else:
+                mo.set_successfully_transcoded(file, "verified")
+
+        # do only proceed if no organizer is busy
+        if len(self.get_busy_organizers()) == 0:
+            logging.debug("monitor: states before transcoding: " + str(mo.get_states()))
+            # remuxing is quick and does not take up an encoder: serve it first
+            remuxDone = self.dispatch(mo, transcoder.REMUX, mo.ready_to_remux)
+            transcodeDone = self.dispatch(mo, transcoder.TRANSCODE, mo.ready_to_transcode)
+            if remuxDone and transcodeDone:
+                logging.info("monitor: no files to transcode.")
+                # since there are no files left to transcode we go right to organizing
+                return True
+            # if the transcoder queue is full it is time to organize the transcoded files
+            if mo.queue_full():
+                return True
+        return False
+
+    def dispatch(self, mo, lane, ready):
+        """fill all available transcoders of a lane at once, returns True if no files are left in its queue"""
+        while True:
+            with self.dispatchLock:
+                file = mo.get_file(lane)
+                # do only proceed if files are in queue
+                if not file:
+                    return True
+                # get an available transcoder of a profile taking the file and ready to run it
+                tr = self.get_transcoder(lane, file, ready)
+                if not tr:
+                    if self.get_transcoder(lane, file):
+                        logging.info("monitor: not ready to " + lane + ": " + str(mo.failureReason))
+                    return False
+                # the library only holds compact records, the transcoder gets the full plex item
+                file = mo.fetch(file)
+                if not file:
+                    continue
+                # mark file as being currently transcoded to avoid duplicated jobs
+                mo.set_current_transcoding(file)
+            # the transcoder thread might not have started yet: do not hand it out twice
+            tr.ready = False
+            # send transccode job ("Energize" is the keyword)
+            tr.transcode(file)
+
+    def claim(self, worker):
+        """hand out the next transcode job to a remote worker, returns None if there is none"""
+        # remote workers bring their own resources: only organizing and the cache of this box hold them back
+        mo = next((mo for mo in self.monitors if not mo.zombie and not mo.sleeping and mo.plexLibrary["date"] > 0),
+                  None)
+        if mo is None or any(not org.ready for org in self.organizers) or mo.queue_full():
+            return None
+        with self.dispatchLock:
+            record = mo.get_file(transcoder.TRANSCODE)
+            if not record:
+                return None
+            # marked as running, no one else gets it while plex is asked for the full item
+            mo.set_current_transcoding(record)
+        file = mo.fetch(record)
+        if not file:
+            # gone from plex meanwhile
+            mo.remove_current_transcoding(record)
+            return None
+        return file
+
+    def remote_result(self, file, exit_code, source=None, output=None):
+        """take the result of a remote worker like the one of a local transcoder, returns False to retry later"""
+        mo = next((mo for mo in self.monitors if not mo.zombie), None)
+        if mo is None:
+            return False
+        if exit_code in [0, 1] and output is not None:
+            mo.set_verifying(file)
+            self.verifier.submit(file, source, output)
+        elif exit_code in [404, 405, 500]:
+            mo.set_failed_to_transcode(file, exit_code)
+        else:
+            # something unexpected happened on the worker: the file is transcoded again
+            mo.remove_current_transcoding(file)
+        self.notify("coordinator")
+        return True
+
+    def organize(self):
+        """STEP: ORGANIZE - do stuff with the transcoded files (order them to plex library)"""
+        # get an available organizer and monitor
+        org = self.get_organizer()
+        mo = self.get_monitor()
+        if org and mo:
+            # do only organize when nothing is being transcoded (here or remotely) or verified
+            if len(self.get_busy_transcoders()) == 0 and self.verifier.busy() == 0 and \
+                    (self.coordinator is None or self.coordinator.busy() == 0):
+                logging.info("organizer veto: " + str(mo.get_veto_organize()))
+                # if monitor indicated readiness for organizing, start organizing
+                ready = False
+                if mo.get_veto_organize() is not False:
+                    if mo.get_veto_organize() is True:
+                        ready = True
+                    elif mo.ready_to_organize() is True:
+                        ready = True
+
+                if ready:
+                    if org.transcodedFiles():
+                        mailer.__MAIL__.send("Video-Grinder: Organizer starts",
+                                             "We just let you know that organizer is starting.")
+                        org.organize(mo.get_successfully_transcoded())
+                    else:
+                        logging.info("organizer: nothing to organize")
+                else:
+                    logging.info("organizer: not ready: " + str(mo.failureReason))
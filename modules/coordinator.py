@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  coordinator.py
+# desc:   hands out transcode jobs to remote workers (leases)
+##########################################################
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+
+from modules import config_loader
+from modules.media_record import MediaRecord, project
+
+# results of leases that expired meanwhile are not wanted anymore
+GONE = 410
+# workers keep their outputs below this directory of the transcoder cache, one directory per worker
+WORKER_CACHE = "workers"
+CHUNK = 1024 * 1024
+
+
+def as_dict(file):
+    # workers get the compact record of a file, plexapi objects do not travel
+    record = file if isinstance(file, MediaRecord) else project(file)
+    data = {slot: getattr(record, slot) for slot in MediaRecord.__slots__}
+    data["locations"] = list(record.locations)
+    return data
+
+
+def as_record(data):
+    return MediaRecord(**data)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        logging.debug("coordinator: " + self.address_string() + " " + (format % args))
+
+    def reply(self, status, data=None):
+        body = json.dumps(data).encode() if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.route()
+
+    def do_PUT(self):
+        self.route()
+
+    def route(self):
+        coordinator = self.server
+        url = urlparse(self.path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if coordinator.token and not hmac.compare_digest(self.headers.get("X-Grinder-Token", ""), coordinator.token):
+            self.close_connection = True
+            return self.reply(401)
+        if url.path == "/jobs/claim":
+            return self.claim(query.get("worker", self.address_string()))
+        match = re.fullmatch(r"/jobs/([0-9a-f]+)/(heartbeat|result)", url.path)
+        if match is None:
+            self.close_connection = True
+            return self.reply(404)
+        # a lease being reported must not expire meanwhile
+        lease = coordinator.get_lease(match.group(1)) if match.group(2) == "heartbeat" \
+            else coordinator.hold(match.group(1))
+        if lease is None:
+            # the worker only learns about it after sending its upload: read and forget it
+            self.discard(int(self.headers.get("Content-Length", 0)))
+            return self.reply(GONE)
+        if match.group(2) == "heartbeat":
+            coordinator.extend(match.group(1))
+            return self.reply(200, {"ttl": coordinator.leaseTimeout})
+        return self.result(match.group(1), lease, int(query.get("exit_code", 999)), query.get("name"))
+
+    def claim(self, worker):
+        file = self.server.ctrl.claim(worker)
+        if file is None:
+            return self.reply(204)
+        leaseId = self.server.add_lease(file, worker)
+        return self.reply(200, {"lease": leaseId, "ttl": self.server.leaseTimeout, "file": as_dict(file)})
+
+    def result(self, leaseId, lease, exit_code, name):
+        source, output = None, None
+        length = int(self.headers.get("Content-Length", 0))
+        if exit_code in [0, 1] and length > 0 and name:
+            # the output goes where a local transcoder would have put it
+            file = lease["file"]
+            source = config_loader.local_path(self.server.config, file.locations[0])
+            output = Path(self.server.config["transcoderCache"]).joinpath(str(file.ratingKey), Path(name).name)
+            if not self.receive(output, length, self.headers.get("X-Checksum")):
+                self.server.extend(leaseId)
+                self.close_connection = True
+                return self.reply(422)
+        else:
+            self.discard(length)
+        if not self.server.ctrl.remote_result(lease["file"], exit_code, source, output):
+            self.server.extend(leaseId)
+            return self.reply(503)
+        self.server.remove_lease(leaseId)
+        logging.info("coordinator: " + lease["worker"] + " finished " + str(lease["file"]).encode('ascii', 'replace')
+                     .decode() + " with exit code " + str(exit_code))
+        return self.reply(200)
+
+    def discard(self, length):
+        while length > 0:
+            chunk = self.rfile.read(min(CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+
+    def receive(self, output, length, checksum):
+        output.parent.mkdir(parents=True, exist_ok=True)
+        partial = output.with_name(output.name + ".part")
+        digest = hashlib.sha256()
+        with open(partial, "wb") as f:
+            remaining = length
+            while remaining > 0:
+                chunk = self.rfile.read(min(CHUNK, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        if remaining > 0 or (checksum and checksum != digest.hexdigest()):
+            logging.warning("coordinator: incomplete upload of " + str(output).encode('ascii', 'replace').decode())
+            partial.unlink()
+            return False
+        os.replace(partial, output)
+        return True
+
+
+class Coordinator(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, parent, config):
+        address = config.get("coordinatorAddress", "127.0.0.1")
+        self.token = config.get("coordinatorToken", "")
+        if not self.token and not config_loader.loopback(address):
+            raise ValueError("coordinator: a coordinatorToken is needed to listen on " + address)
+        super().__init__((address, config["coordinatorPort"]), Handler)
+        self.ctrl = parent
+        self.config = config
+        # a worker that did not send a heartbeat within this time is considered dead
+        self.leaseTimeout = config.get("coordinatorLeaseTimeout", 60)
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="coordinator", daemon=True).start()
+        logging.info("coordinator: listening on " + str(self.server_address[0]) + ":" + str(self.server_address[1]))
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def busy(self):
+        with self.lock:
+            return len(self.leases)
+
+    def add_lease(self, file, worker):
+        leaseId = uuid.uuid4().hex
+        with self.lock:
+            self.leases[leaseId] = {"file": file, "worker": worker, "expires": time.monotonic() + self.leaseTimeout}
+        logging.info("coordinator: " + worker + " claimed " + str(file).encode('ascii', 'replace').decode())
+        return leaseId
+
+    def get_lease(self, leaseId):
+        with self.lock:
+            return self.leases.get(leaseId)
+
+    def hold(self, leaseId):
+        with self.lock:
+            lease = self.leases.get(leaseId)
+            if lease is not None:
+                lease["expires"] = float("inf")
+            return lease
+
+    def extend(self, leaseId):
+        with self.lock:
+            if leaseId in self.leases:
+                self.leases[leaseId]["expires"] = time.monotonic() + self.leaseTimeout
+
+    def remove_lease(self, leaseId):
+        with self.lock:
+            self.leases.pop(leaseId, None)
+
+    def expired(self):
+        """remove and return the files of all leases without a heartbeat for too long"""
+        now = time.monotonic()
+        with self.lock:
+            gone = [leaseId for leaseId, lease in self.leases.items() if lease["expires"] < now]
+            leases = [self.leases.pop(leaseId) for leaseId in gone]
+        for lease in leases:
+            logging.warning("coordinator: lease of " + lease["worker"] + " expired: "
+                            + str(lease["file"]).encode('ascii', 'replace').decode())
+        return [lease["file"] for lease in leases]
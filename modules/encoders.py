@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  encoders.py
+# desc:   encoder profiles and which of them work on this box
+##########################################################
+
+import logging
+import subprocess
+from ffmpy import FFmpeg, FFRuntimeError
+
+from modules import concurrency
+from modules import config_loader
+from modules import transcoder
+
+__ENCODERS__ = None
+
+# a few frames of a test pattern: enough to open the encoder and its device
+TEST_SOURCE = "testsrc2=size=640x360:rate=25:duration=1"
+TEST_FRAMES = 10
+
+
+def available_encoders():
+    # ffmpeg is only asked once which encoders it was built with
+    global __ENCODERS__
+    if __ENCODERS__ is None:
+        try:
+            stdout, _ = FFmpeg(global_options="-hide_banner -encoders").run(stdout=subprocess.PIPE,
+                                                                            stderr=subprocess.PIPE)
+            # " V....D libx265   libx265 H.265 / HEVC (codec hevc)": flags, name, description
+            __ENCODERS__ = {line.split()[1] for line in stdout.decode("utf-8", "replace").splitlines()
+                            if len(line.split()) > 2 and len(line.split()[0]) == 6 and line.split()[0][0] == "V"}
+        except (OSError, FFRuntimeError) as e:
+            logging.error("encoders: cannot list the encoders of ffmpeg: " + str(e))
+            __ENCODERS__ = set()
+    return __ENCODERS__
+
+
+class Profile:
+    """one way to encode (e.g. hevc_nvenc or libx265) with its own pool of transcoders
+
+    The transcoders of a profile get a copy of the config with the profile's encoder as the target,
+    so everything downstream (chunking, quality search, logging) works on the profile like on the
+    global settings. A profile only takes the files its filter accepts.
+    """
+
+    def __init__(self, name, config, settings):
+        self.name = name
+        self.codec = settings["codec"]
+        count = settings.get("count", 1)
+        self.config = dict(config, **{
+            "targetVideoCodec": self.codec,
+            "targetVideoSettings": settings.get("settings", ""),
+            "transcoderHWaccel": settings.get("hwaccel", "False"),
+            "transcoderCount": count,
+            "transcoderCountMin": settings.get("countMin", min(count, config.get("transcoderCountMin", 1))),
+            "transcoderCountMax": settings.get("countMax", count),
+            # a gpu profile must not step down because the cpu is busy and vice versa
+            "transcoderTuneResources": settings.get("tuneResources",
+                                                    ["gpu"] if transcoder.is_hardware_encoder(self.codec) else ["cpu"]),
+            "qualitySearchSettings": settings.get("qualitySearchSettings", config.get("qualitySearchSettings", "")),
+            "qualitySearchLevels": settings.get("qualitySearchLevels", config.get("qualitySearchLevels", []))
+        })
+        self.filter = config_loader.compile_files_filter(settings.get("filter", {}))
+        # index of the gpu the profile encodes on (e.g. with -gpu in its settings), its pool is tuned on that device
+        self.device = settings.get("gpu")
+        self.concurrency = concurrency.ConcurrencyTuner(self.config, name)
+        # set by the owner of the transcoders, every profile searches its own settings
+        self.quality = None
+
+    def __repr__(self):
+        return "<Profile " + self.name + " (" + self.codec + ")>"
+
+    def accepts(self, file):
+        if len(self.filter) == 0:
+            return True
+        if not hasattr(file, "media") or len(file.media) == 0:
+            return False
+        return all(check(attr(file.media[0])) for attr, check in self.filter)
+
+    def uses_gpu(self):
+        # hardware encoders and decoders wait for a busy gpu, software encoders do not
+        return transcoder.is_hardware_encoder(self.codec) or self.config["transcoderHWaccel"] != "False"
+
+    def test(self):
+        """encode a few frames of a test pattern, returns the error or None if the encoder works"""
+        if self.codec not in available_encoders():
+            return "not built into ffmpeg"
+        hwaccel = self.config["transcoderHWaccel"]
+        ff = FFmpeg(global_options="-hide_banner -nostdin -v error",
+                    inputs={TEST_SOURCE: "-f lavfi" + (" -hwaccel " + hwaccel if hwaccel != "False" else "")},
+                    outputs={"-": "-frames:v " + str(TEST_FRAMES) + " -c:v " + self.codec + " "
+                                  + self.config["targetVideoSettings"] + " -f null"})
+        try:
+            ff.run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except FFRuntimeError as e:
+            errors = e.stderr.decode("utf-8", "replace").strip() if e.stderr else ""
+            return errors.splitlines()[-1] if errors else "exit code " + str(e.exit_code)
+        except OSError as e:
+            return str(e)
+        return None
+
+
+def profiles(config):
+    """the encoder profiles that work on this box, in the order they are preferred"""
+    if not config.get("encoderProfiles"):
+        # the global settings are the only profile, they are used as configured
+        return [Profile("default", config, {"codec": config["targetVideoCodec"],
+                                            "settings": config.get("targetVideoSettings", ""),
+                                            "hwaccel": config.get("transcoderHWaccel", "False"),
+                                            "count": config["transcoderCount"],
+                                            "countMin": config.get("transcoderCountMin", 1),
+                                            "countMax": config.get("transcoderCountMax", config["transcoderCount"]),
+                                            "tuneResources": ["cpu", "gpu"]})]
+    working = []
+    for name, settings in config["encoderProfiles"].items():
+        profile = Profile(name, config, settings)
+        # readonly runs do not encode anything
+        error = profile.test() if config["readonly"] == "False" else None
+        if error is None:
+            logging.info("encoders: " + name + " (" + profile.codec + ") works, up to "
+                         + str(profile.concurrency.maximum) + " transcoders")
+            working.append(profile)
+        else:
+            logging.warning("encoders: " + name + " (" + profile.codec + ") does not work: " + error)
+    if len(working) == 0:
+        raise ValueError("None of the encoder profiles works: " + ", ".join(config["encoderProfiles"]))
+    return working
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+###################################################################
+# title:  event_log.py
+# desc:   structured event log written by a single background thread
+###################################################################
+
+import atexit
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+__LOG__ = None
+
+# the first fields of every event, anything after them is kept as extra
+FIELDS = ["type", "action", "code", "status", "old", "new"]
+FORMATS = ["csv", "jsonl", "sqlite"]
+
+# ask sqlite directly, e.g. the duration of every job:
+#   SELECT old, MAX(date) - MIN(date) FROM events WHERE type = 'transcoder' GROUP BY old
+# or the bytes saved per file:
+#   SELECT old, json_extract(extra, '$[0]') FROM events WHERE action = 'savings'
+SCHEMA = ("CREATE TABLE IF NOT EXISTS events ("
+          "date REAL NOT NULL, type TEXT, action TEXT, code INTEGER, status TEXT, old TEXT, new TEXT, extra TEXT)")
+
+
+def event(date, row):
+    record = {"date": date}
+    record.update(zip(FIELDS, row))
+    if len(row) > len(FIELDS):
+        record["extra"] = row[len(FIELDS):]
+    return record
+
+
+def dumps(value):
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+class CsvSink:
+
+    def __init__(self, path, header):
+        self.header = header
+        self.file = open(path, 'a', encoding='UTF8', newline='')
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(self.header)
+
+    def write(self, events):
+        self.writer.writerows([str(datetime.fromtimestamp(e["date"]))] + [e.get(f, "") for f in FIELDS]
+                              + [v if isinstance(v, (str, int, float)) else dumps(v) for v in e.get("extra", [])]
+                              for e in events)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlSink:
+
+    def __init__(self, path, header):
+        self.file = open(path, 'a', encoding='UTF8')
+
+    def write(self, events):
+        self.file.write("".join(dumps(e) + "\n" for e in events))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink:
+
+    def __init__(self, path, header):
+        # only the writer thread uses the connection
+        self.dbconn = sqlite3.connect(str(path), check_same_thread=False)
+        self.dbconn.execute(SCHEMA)
+        self.dbconn.commit()
+
+    def write(self, events):
+        self.dbconn.executemany("INSERT INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(e["date"],) + tuple(e.get(f) if f == "code" or e.get(f) is None else str(e.get(f))
+                                                      for f in FIELDS)
+                                 + (dumps(e["extra"]) if "extra" in e else None,) for e in events])
+
+    def flush(self):
+        self.dbconn.commit()
+
+    def close(self):
+        self.dbconn.commit()
+        self.dbconn.close()
+
+
+SINKS = {"csv": CsvSink, "jsonl": JsonlSink, "sqlite": SqliteSink}
+
+
+class EventLog:
+
+    def __init__(self, path, header, config=None):
+        config = config if config is not None else {}
+        self.path = Path(path)
+        self.header = header
+        self.sink = SINKS[config.get("eventLogFormat", "csv")]
+        self.flushInterval = config.get("eventLogFlushInterval", 1)
+        self.batchSize = config.get("eventLogBatchSize", 500)
+        self.rotateBytes = config.get("eventLogRotateBytes", 104857600)
+        self.rotateSeconds = config.get("eventLogRotateSeconds", 0)
+        self.backups = config.get("eventLogBackups", 5)
+        # "drop" loses new events when the writer falls behind, "block" makes the hot threads wait
+        self.overflow = config.get("eventLogOverflow", "drop")
+        self.queue = queue.Queue(maxsize=config.get("eventLogQueueSize", 10000))
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.writer = self.sink(self.path, self.header)
+        self.opened = time.time()
+        self.thread = threading.Thread(target=self.run, name="event-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, row):
+        """queue an event: [type, action, code, status, old, new, extra...], never waits unless configured to"""
+        item = (time.time(), row)
+        if self.overflow == "block":
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def run(self):
+        running = True
+        while running:
+            # wait for the first event, then take whatever else is queued in one batch
+            try:
+                items = [self.queue.get(timeout=self.flushInterval)]
+            except queue.Empty:
+                items = []
+            while len(items) < self.batchSize:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in items:
+                running = False
+                items = items[:items.index(None)]
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped > 0:
+                logging.warning("eventlog: queue full, dropped " + str(dropped) + " events")
+                items.append((time.time(), ["eventlog", "overflow", 1, "queue full", "", "", dropped]))
+            try:
+                if len(items) > 0:
+                    self.writer.write([event(date, row) for date, row in items])
+                    self.writer.flush()
+                self.rotate()
+            except Exception as e:
+                logging.error("eventlog: writing " + str(len(items)) + " events failed: " + str(e))
+        self.writer.close()
+
+    def rotate(self):
+        # rotate by size or age: log -> log.1 -> log.2 ..., the oldest one is removed
+        if not (self.rotateBytes and self.path.stat().st_size >= self.rotateBytes) and \
+                not (self.rotateSeconds and time.time() - self.opened >= self.rotateSeconds):
+            return
+        self.writer.close()
+        for i in range(self.backups - 1, 0, -1):
+            backup = Path(str(self.path) + "." + str(i))
+            if backup.exists():
+                os.replace(backup, str(self.path) + "." + str(i + 1))
+        if self.backups > 0:
+            os.replace(self.path, str(self.path) + ".1")
+        else:
+            self.path.unlink()
+        self.writer = self.sink(self.path, self.header)
+        self.opened = time.time()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  gpu_telemetry.py
+# desc:   gpu load, memory and temperature of all devices, sampled in the background
+##########################################################
+
+import logging
+import re
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+def device(index, name, load=None, memoryUtil=None, temperature=None, encoder=None):
+    """one reading of a device, all values in percent (temperature in degrees celsius), None if unknown"""
+    return {"index": index, "name": name, "load": load, "memoryUtil": memoryUtil, "temperature": temperature,
+            "encoder": encoder}
+
+
+class NullBackend:
+    """no gpu: nothing to read"""
+    name = "null"
+
+    @staticmethod
+    def available():
+        return True
+
+    def devices(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class NvmlBackend:
+    """nvidia management library: no process per reading and the load of the encoder engine as well"""
+    name = "nvml"
+
+    @staticmethod
+    def available():
+        if pynvml is None:
+            return False
+        try:
+            pynvml.nvmlInit()
+            pynvml.nvmlShutdown()
+            return True
+        except pynvml.NVMLError:
+            return False
+
+    def __init__(self):
+        pynvml.nvmlInit()
+
+    def devices(self):
+        devices = []
+        for i in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+            name = pynvml.nvmlDeviceGetName(handle)
+            memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            devices.append(device(i, name.decode() if isinstance(name, bytes) else name,
+                                  load=pynvml.nvmlDeviceGetUtilizationRates(handle).gpu,
+                                  memoryUtil=memory.used / memory.total * 100 if memory.total else None,
+                                  temperature=self.optional(pynvml.nvmlDeviceGetTemperature, handle,
+                                                            pynvml.NVML_TEMPERATURE_GPU),
+                                  encoder=self.optional(lambda h: pynvml.nvmlDeviceGetEncoderUtilization(h)[0],
+                                                        handle)))
+        return devices
+
+    @staticmethod
+    def optional(query, *args):
+        # not every device supports every query
+        try:
+            return query(*args)
+        except pynvml.NVMLError:
+            return None
+
+    def close(self):
+        pynvml.nvmlShutdown()
+
+
+class NvidiaSmiBackend:
+    """nvidia-smi as GPUtil used it: one process per reading"""
+    name = "nvidia-smi"
+    QUERY = "index,name,utilization.gpu,memory.used,memory.total,temperature.gpu"
+
+    @staticmethod
+    def available():
+        return shutil.which("nvidia-smi") is not None
+
+    def devices(self):
+        stdout = subprocess.run(["nvidia-smi", "--query-gpu=" + self.QUERY, "--format=csv,noheader,nounits"],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True, timeout=10).stdout
+        devices = []
+        for line in stdout.decode("utf-8", "replace").splitlines():
+            fields = [f.strip() for f in line.split(",")]
+            if len(fields) < 6:
+                continue
+            index, name = number(fields[0]), fields[1]
+            load, used, total, temperature = [number(f) for f in fields[2:6]]
+            devices.append(device(int(index) if index is not None else len(devices), name, load=load,
+                                  memoryUtil=used / total * 100 if used is not None and total else None,
+                                  temperature=temperature))
+        return devices
+
+    def close(self):
+        pass
+
+
+class SysfsBackend:
+    """the kernel drivers of amd (amdgpu) and intel (i915) gpus, read from /sys/class/drm"""
+    name = "sysfs"
+    DRIVERS = ["amdgpu", "i915"]
+    ROOT = Path("/sys/class/drm")
+
+    @classmethod
+    def cards(cls):
+        # card0, card1, ... but not their connectors (card0-HDMI-A-1)
+        cards = [c for c in cls.ROOT.glob("card*") if re.fullmatch(r"card\d+", c.name)]
+        cards = sorted(cards, key=lambda c: int(c.name[len("card"):]))
+        return [c for c in cards if c.joinpath("device", "driver").exists()
+                and c.joinpath("device", "driver").resolve().name in cls.DRIVERS]
+
+    @classmethod
+    def available(cls):
+        return len(cls.cards()) > 0
+
+    def devices(self):
+        devices = []
+        for card in self.cards():
+            path = card.joinpath("device")
+            driver = path.joinpath("driver").resolve().name
+            temperature = next((read(t) / 1000 for t in path.glob("hwmon/hwmon*/temp1_input") if read(t) is not None),
+                               None)
+            if driver == "amdgpu":
+                used, total = read(path.joinpath("mem_info_vram_used")), read(path.joinpath("mem_info_vram_total"))
+                load = read(path.joinpath("gpu_busy_percent"))
+                memoryUtil = used / total * 100 if used is not None and total else None
+            else:
+                # i915 has no busy counter in sysfs: the actual clock next to the maximum one comes close
+                current, maximum = read(card.joinpath("gt_act_freq_mhz")), read(card.joinpath("gt_max_freq_mhz"))
+                load = current / maximum * 100 if current is not None and maximum else None
+                memoryUtil = None
+            devices.append(device(int(card.name[len("card"):]), driver + " " + path.resolve().name, load=load,
+                                  memoryUtil=memoryUtil, temperature=temperature))
+        return devices
+
+    def close(self):
+        pass
+
+
+def number(value):
+    # nvidia-smi reports "[N/A]" for values a device does not know
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def read(path):
+    try:
+        return number(Path(path).read_text().strip())
+    except OSError:
+        return None
+
+
+# the first available backend is used for "auto"
+BACKENDS = {backend.name: backend for backend in [NvmlBackend, NvidiaSmiBackend, SysfsBackend, NullBackend]}
+
+
+def backend(name="auto"):
+    if name == "auto":
+        name = next(n for n, b in BACKENDS.items() if b.available())
+    elif name not in BACKENDS:
+        raise ValueError("GPU telemetry unknown: " + str(name) + " (use one of " + str(["auto"] + list(BACKENDS)) + ")")
+    elif not BACKENDS[name].available():
+        logging.warning("gpu: " + name + " is not available, no gpu telemetry")
+        name = NullBackend.name
+    return BACKENDS[name]()
+
+
+class Sampler:
+    """reads all devices at its own rate in the background, the callers only get the latest reading"""
+
+    def __init__(self, backend, interval=5):
+        self.backend = backend
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.readings = []
+        self.date = 0
+        self.failing = False
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        # the first reading is there right away
+        self.sample()
+        if not isinstance(self.backend, NullBackend):
+            self.thread = threading.Thread(target=self.run, name="gpu-telemetry", daemon=True)
+            self.thread.start()
+        logging.info("gpu: " + self.backend.name + " telemetry of " + str(len(self.readings)) + " devices every "
+                     + str(self.interval) + " s")
+        return self
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        try:
+            readings = self.backend.devices()
+            if self.failing:
+                logging.info("gpu: " + self.backend.name + " telemetry is back")
+            self.failing = False
+        except Exception as e:
+            # only the first failure is logged, a gpu that is gone does not fill the log
+            if not self.failing:
+                logging.warning("gpu: " + self.backend.name + " telemetry failed: " + str(e))
+            self.failing = True
+            readings = []
+        with self.lock:
+            self.readings = readings
+            self.date = time.monotonic()
+
+    def devices(self):
+        """the latest reading of every device"""
+        with self.lock:
+            return list(self.readings)
+
+    def age(self):
+        with self.lock:
+            return time.monotonic() - self.date
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(self.interval + 10)
+        self.backend.close()
+
+
+def sampler(config):
+    return Sampler(backend(config.get("gpuTelemetry", "auto")), config.get("gpuTelemetryInterval", 5))
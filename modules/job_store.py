@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  job_store.py
+# desc:   persistent state of all transcode jobs (sqlite)
+##########################################################
+
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+
+PENDING = "pending"
+RUNNING = "running"
+VERIFYING = "verifying"
+DONE = "done"
+FAILED = "failed"
+ORGANIZED = "organized"
+
+# every state except pending means that the file must not be picked up again
+PROCESSED = (RUNNING, VERIFYING, DONE, FAILED, ORGANIZED)
+
+
+class JobStore:
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        # the store is shared between controller, monitor and organizer threads
+        self.dbconn = sqlite3.connect(self.path, check_same_thread=False)
+        self.dbconn.execute("PRAGMA journal_mode=WAL")
+        self.dbconn.execute("PRAGMA synchronous=NORMAL")
+        self.dbconn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                            "ratingKey INTEGER PRIMARY KEY, "
+                            "state TEXT NOT NULL, "
+                            "location TEXT, "
+                            "attempts INTEGER NOT NULL DEFAULT 0, "
+                            "exitCode INTEGER, "
+                            "created REAL NOT NULL, "
+                            "updated REAL NOT NULL)")
+        # stores of former versions do not know the detail and started columns yet
+        columns = [row[1] for row in self.dbconn.execute("PRAGMA table_info(jobs)")]
+        if "detail" not in columns:
+            self.dbconn.execute("ALTER TABLE jobs ADD COLUMN detail TEXT")
+        if "started" not in columns:
+            self.dbconn.execute("ALTER TABLE jobs ADD COLUMN started REAL")
+        self.dbconn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated)")
+        self.dbconn.commit()
+        # keep a copy of all states in memory for O(1) lookups within the hot loop
+        self.states = {rk: state for rk, state in self.dbconn.execute("SELECT ratingKey, state FROM jobs")}
+        logging.info("jobstore: loaded " + str(len(self.states)) + " jobs from " + self.path)
+
+    def get_state(self, ratingKey):
+        return self.states.get(int(ratingKey), PENDING)
+
+    def is_processed(self, ratingKey):
+        return self.states.get(int(ratingKey), PENDING) in PROCESSED
+
+    def set_state(self, ratingKey, state, location=None, exit_code=None, detail=None):
+        ratingKey = int(ratingKey)
+        now = datetime.timestamp(datetime.now())
+        with self.lock:
+            # count an attempt every time a job is started
+            attempt = 1 if state == RUNNING else 0
+            started = now if state == RUNNING else None
+            self.dbconn.execute("INSERT INTO jobs (ratingKey, state, location, attempts, exitCode, detail, started, "
+                                "created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                "ON CONFLICT(ratingKey) DO UPDATE SET "
+                                "state = excluded.state, "
+                                "location = COALESCE(excluded.location, location), "
+                                "attempts = attempts + excluded.attempts, "
+                                "exitCode = COALESCE(excluded.exitCode, exitCode), "
+                                "detail = COALESCE(excluded.detail, detail), "
+                                "started = COALESCE(excluded.started, started), "
+                                "updated = excluded.updated",
+                                (ratingKey, state, location, attempt, exit_code, detail, started, now, now))
+            self.dbconn.commit()
+            self.states[ratingKey] = state
+
+    def get_job(self, ratingKey):
+        with self.lock:
+            cur = self.dbconn.execute("SELECT ratingKey, state, location, attempts, exitCode, detail, started, "
+                                      "created, updated FROM jobs WHERE ratingKey = ?", (int(ratingKey),))
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip(["ratingKey", "state", "location", "attempts", "exitCode", "detail", "started", "created",
+                         "updated"], row))
+
+    def get_jobs(self, state):
+        with self.lock:
+            cur = self.dbconn.execute("SELECT ratingKey FROM jobs WHERE state = ? ORDER BY updated", (state,))
+            return [row[0] for row in cur]
+
+    def count(self, state):
+        return sum(1 for s in self.states.values() if s == state)
+
+    def reset(self, states, older_than=0):
+        """set all jobs in one of the given states back to pending and return their ratingKeys"""
+        deadline = datetime.timestamp(datetime.now()) - older_than
+        placeholders = ", ".join("?" for _ in states)
+        with self.lock:
+            cur = self.dbconn.execute("SELECT ratingKey FROM jobs WHERE state IN (" + placeholders + ") "
+                                      "AND updated <= ?", (*states, deadline))
+            keys = [row[0] for row in cur]
+            self.dbconn.executemany("UPDATE jobs SET state = ?, updated = ? WHERE ratingKey = ?",
+                                    [(PENDING, datetime.timestamp(datetime.now()), rk) for rk in keys])
+            self.dbconn.commit()
+            for rk in keys:
+                self.states[rk] = PENDING
+        return keys
+
+    def recover(self):
+        # jobs that were running while the grinder stopped have been interrupted: queue them again
+        # (outputs that were complete anyway are adopted from the transcoder cache before)
+        return self.reset([RUNNING, VERIFYING])
+
+    def retry_failed(self, older_than=0):
+        return self.reset([FAILED], older_than)
+
+    def close(self):
+        with self.lock:
+            self.dbconn.close()
@@ -8,35 +8,139 @@
 # desc:   simple smtp mailer
 ##########################################################
 
+import atexit
+import queue
 import smtplib
 import ssl
 import logging
+import threading
+import time
 from datetime import datetime
 from email import utils
 
 __MAIL__ = None
 
+
 class Mailer:
+    """sends mails from a background thread, callers never wait for the mail server"""
 
     def __init__(self, config):
         self.config = config
+        self.enabled = self.config["hostname"] != ""
+        # "ssl" (smtps), "starttls" or "none" (e.g. a local debugging server)
+        self.security = self.config.get("security", "ssl")
+        self.timeout = self.config.get("timeout", 30)
+        self.retries = self.config.get("retries", 5)
+        self.retryDelay = self.config.get("retryDelay", 30)
+        # the connection is kept open for the next mail, but not forever
+        self.idleTimeout = self.config.get("idleTimeout", 60)
+        # 0 sends every mail right away, otherwise mails and job events are rolled into one summary per interval
+        self.digestInterval = self.config.get("digestInterval", 0)
+        self.queue = queue.Queue(maxsize=self.config.get("queueSize", 100))
+        self.events = []
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.server = None
+        self.lastUsed = 0
+        self.thread = None
+        if self.enabled:
+            self.thread = threading.Thread(target=self.run, name="mailer", daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
 
     def send(self, subject, message):
-        if self.config["hostname"] != "":
-            context = ssl.create_default_context()
-            mailcontent = self.prepare_message(subject, message)
+        if not self.enabled:
+            return
+        if self.digestInterval > 0:
+            self.digest(subject + ": " + message)
+            return
+        try:
+            self.queue.put_nowait((subject, message))
+        except queue.Full:
+            logging.error("mailer: queue full, mail dropped: " + subject)
+
+    def digest(self, event):
+        """remember a job event for the next summary (only used in digest mode)"""
+        if not self.enabled or self.digestInterval <= 0:
+            return
+        with self.lock:
+            self.events.append(datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " " + event)
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.stopping.set()
+            self.queue.put(None)
+            self.thread.join(self.timeout * 2)
+
+    def run(self):
+        nextDigest = time.monotonic() + self.digestInterval
+        while True:
+            wait = self.idleTimeout if self.server is not None else None
+            if self.digestInterval > 0:
+                wait = max(0, min(wait if wait is not None else self.digestInterval, nextDigest - time.monotonic()))
+            try:
+                item = self.queue.get(timeout=wait)
+            except queue.Empty:
+                item = False
+            if self.digestInterval > 0 and (time.monotonic() >= nextDigest or item is None):
+                nextDigest = time.monotonic() + self.digestInterval
+                self.send_digest()
+            if item is None:
+                break
+            if item:
+                self.deliver(*item)
+            if self.server is not None and time.monotonic() - self.lastUsed >= self.idleTimeout:
+                self.disconnect()
+        self.disconnect()
+
+    def send_digest(self):
+        with self.lock:
+            events, self.events = self.events, []
+        if len(events) > 0:
+            self.deliver("Video-Grinder: " + str(len(events)) + " events", "\n".join(events))
+
+    def connect(self):
+        if self.security == "ssl":
+            self.server = smtplib.SMTP_SSL(self.config["hostname"], self.config["port"],
+                                           context=ssl.create_default_context(), timeout=self.timeout)
+        else:
+            self.server = smtplib.SMTP(self.config["hostname"], self.config["port"], timeout=self.timeout)
+            if self.security == "starttls":
+                self.server.starttls(context=ssl.create_default_context())
+        if self.config.get("debug", "False") == "True":
+            self.server.set_debuglevel(1)
+        if self.config.get("username") and self.config.get("password"):
+            self.server.login(self.config["username"], self.config["password"])
+
+    def disconnect(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def deliver(self, subject, message):
+        mailcontent = self.prepare_message(subject, message)
+        for attempt in range(self.retries + 1):
+            reused = self.server is not None
             try:
-                with smtplib.SMTP_SSL(self.config["hostname"], self.config["port"],
-                                      context=context) as server:
-                    server.set_debuglevel(1)
-                    server.login(self.config["username"], self.config["password"])
-                    server.sendmail(self.config["username"],
-                                    self.config["receiver"],
-                                    mailcontent)
-                    server.close()
-            except Exception as e:
-                logging.error("Failed to send mail via smtp: " + str(e))
-                logging.info(mailcontent)
+                if self.server is None:
+                    self.connect()
+                self.server.sendmail(self.config["username"], self.config["receiver"], mailcontent)
+                self.lastUsed = time.monotonic()
+                return True
+            except (smtplib.SMTPException, OSError) as e:
+                self.disconnect()
+                if attempt == self.retries or self.stopping.is_set():
+                    logging.error("Failed to send mail via smtp: " + str(e))
+                    logging.info(mailcontent)
+                    return False
+                # the server might have dropped the reused connection: try a new one right away
+                delay = 0 if reused else self.retryDelay * 2 ** attempt
+                logging.warning("mailer: sending failed (" + str(e) + "), retry in " + str(delay) + "s")
+                self.stopping.wait(delay)
 
     def prepare_message(self, subject, body):
         message_structure = 'From: %s\nTo: %s\nSubject: %s\nDate: %s\n\n%s' % \
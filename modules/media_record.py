@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  media_record.py
+# desc:   lightweight representation of a library item
+##########################################################
+
+from datetime import datetime
+
+
+class MediaRecord:
+    """holds only what the grinder needs of a library item, behaves like a plexapi video for file.media[0]"""
+
+    __slots__ = ("ratingKey", "title", "titleSort", "addedAt", "updatedAt", "locations", "container",
+                 "videoCodec", "audioCodec", "bitrate", "width", "height", "videoResolution", "duration", "size",
+                 "videoProfile", "videoFrameRate", "aspectRatio", "audioProfile", "audioChannels", "section",
+                 "libtype")
+
+    def __init__(self, ratingKey, title=None, titleSort=None, addedAt=0, updatedAt=0, locations=(),
+                 container=None, videoCodec=None, audioCodec=None, bitrate=None, width=None, height=None,
+                 videoResolution=None, duration=None, size=None, videoProfile=None, videoFrameRate=None,
+                 aspectRatio=None, audioProfile=None, audioChannels=None, section=None, libtype=None):
+        self.ratingKey = ratingKey
+        self.title = title
+        self.titleSort = titleSort if titleSort else title
+        self.addedAt = addedAt
+        self.updatedAt = updatedAt
+        self.locations = tuple(locations)
+        self.container = container
+        self.videoCodec = videoCodec
+        self.audioCodec = audioCodec
+        self.bitrate = bitrate
+        self.width = width
+        self.height = height
+        self.videoResolution = videoResolution if videoResolution else resolution(width, height)
+        self.duration = duration
+        self.size = size
+        # only used by the library filters: None if the source of the record does not know them
+        self.videoProfile = videoProfile
+        self.videoFrameRate = videoFrameRate
+        self.aspectRatio = aspectRatio
+        self.audioProfile = audioProfile
+        self.audioChannels = audioChannels
+        # library section title and plex type ("movie" or "episode") of the item
+        self.section = section
+        self.libtype = libtype
+
+    @property
+    def media(self):
+        # a record describes exactly one media item
+        return (self,)
+
+    def __repr__(self):
+        return "<MediaRecord:" + str(self.ratingKey) + ":" + str(self.title) + ">"
+
+
+def project(item):
+    """project a plexapi video into a MediaRecord, the item is read without triggering a reload"""
+    # plexapi reloads partial objects from the server whenever an attribute is None, vars() bypasses that
+    attrs = vars(item)
+    medias = attrs.get("media") or []
+    media = vars(medias[0]) if len(medias) > 0 else {}
+    parts = [part for m in medias for part in (vars(m).get("parts") or [])]
+    return MediaRecord(attrs.get("ratingKey"), title=attrs.get("title"), titleSort=attrs.get("titleSort"),
+                       addedAt=timestamp(attrs.get("addedAt")), updatedAt=timestamp(attrs.get("updatedAt")),
+                       locations=[part.file for part in parts if part.file],
+                       container=media.get("container"), videoCodec=media.get("videoCodec"),
+                       audioCodec=media.get("audioCodec"), bitrate=media.get("bitrate"), width=media.get("width"),
+                       height=media.get("height"), videoResolution=media.get("videoResolution"),
+                       duration=media.get("duration"), size=sum(part.size or 0 for part in parts),
+                       videoProfile=media.get("videoProfile"), videoFrameRate=media.get("videoFrameRate"),
+                       aspectRatio=media.get("aspectRatio"), audioProfile=media.get("audioProfile"),
+                       audioChannels=media.get("audioChannels"), section=attrs.get("librarySectionTitle"),
+                       libtype=attrs.get("type"))
+
+
+# attributes of file.media[0] the library and profile filters can check
+FILTERABLE = tuple(slot for slot in MediaRecord.__slots__
+                   if slot not in ["ratingKey", "locations", "section", "libtype"])
+
+
+def resolution(width, height):
+    # same naming as plex uses for videoResolution
+    if not width or not height:
+        return None
+    if width >= 3200 or height >= 1800:
+        return "4k"
+    if width >= 1700 or height >= 1000:
+        return "1080"
+    if width >= 1100 or height >= 700:
+        return "720"
+    if height >= 560:
+        return "576"
+    if height >= 400:
+        return "480"
+    return "sd"
+
+
+def timestamp(value):
+    # plexapi objects carry datetimes, MediaRecords unix timestamps
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return value
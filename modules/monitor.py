@@ -9,16 +9,24 @@
 ##########################################################
 
 import logging
-from datetime import datetime, time
+from datetime import datetime
 import psutil
 import plexapi
 from plexapi.server import PlexServer
 import math
 from pathlib import Path
 import shutil
-import GPUtil
 import threading
 
+from modules import config_loader
+from modules import job_store
+from modules import mailer
+from modules import probe
+from modules import plex_db
+from modules import scheduler
+from modules import transcoder
+from modules.media_record import MediaRecord, project
+
 
 def threaded(fn):
     def wrapper(*args, **kwargs):
@@ -27,15 +35,6 @@ def threaded(fn):
     return wrapper
 
 
-def is_time_between(begin_time, end_time, check_time=None):
-    # If check time is not given, default to current UTC time
-    check_time = check_time or datetime.utcnow().time()
-    if begin_time < end_time:
-        return check_time >= begin_time and check_time <= end_time
-    else:  # crosses midnight
-        return check_time >= begin_time or check_time <= end_time
-
-
 def wMean(vs, r=0):
     """get a weighted mean of an array: values with higher index as well as higher values counts more (exponential)"""
     s = 0
@@ -49,22 +48,37 @@ def wMean(vs, r=0):
     return round(math.sqrt(s / int(len(vs) * (len(vs) + 1) / 2)), r)
 
 
+def throughput(transcoders):
+    return sum((tr.progress.get("fps") or 0) * scheduler.pixels(tr.file.media[0])
+               for tr in transcoders if tr.file is not None)
+
+
 class Monitor:
 
     def __init__(self, parent, config):
         self.ctrl = parent
         self.config = config
-        self.states = {"sys": {}, "plex": {}, "fs": {}, "gpu": {}, "veto": {}}
-        self.plexLibrary = {"date": 0, "files": []}
+        self.states = {"sys": {}, "plex": {}, "fs": {}, "gpu": {}, "transcoder": {}, "veto": {}}
+        self.plexLibrary = {"date": 0, "reconciled": 0, "watermark": 0, "files": {}}
+        self.failureRetry = {"date": datetime.timestamp(datetime.now())}
+        # one queue per worker lane: remuxing does not wait for an encoder
+        self.queues = {lane: self.queue() for lane in [transcoder.TRANSCODE, transcoder.REMUX]}
         self.plexStats = {"date": 0}
-        self.history = {"current":[], "success":[], "failure":[], "all":[]}
+        self.jobs = parent.jobs
+        self.probes = parent.probes
         self.successfullyTranscoded = []
         self.failureReason = {}
         self.ready = False
         self.zombie = False
         self.sleeping = False
         self.plexSrv = None
-        if self.setup_plexapi():
+        self.plexDB = None
+        self.gpuUnavailable = False
+        if self.config.get("plexLibraryBackend", "api") == "database":
+            self.plexDB = plex_db.PlexDB(self.config["plexDB"])
+        # the database backend reads the library even if plex cannot be reached
+        if self.setup_plexapi() or self.plexDB is not None:
+            self.restore_successfully_transcoded()
             self.update_data()
 
     def setup_plexapi(self):
@@ -72,6 +86,12 @@ class Monitor:
             self.plexSrv = PlexServer(self.config["plexServer"], self.config["X-Plex-Token"])
             return True
         except Exception as e:
+            if self.plexDB is not None:
+                # plex is asked again with the next update of its stats
+                logging.warning("monitor: connecting to plex not possible, reading the library from its database: "
+                                + str(e))
+                self.plexSrv = None
+                return False
             logging.critical("monitor: connecting to plex not possible: " + str(e))
             self.zombie = True
             return False
@@ -79,6 +99,22 @@ class Monitor:
     def destroy_plexapi(self):
         self.plexSrv = None
 
+    def restore_successfully_transcoded(self):
+        # files transcoded before a restart are still waiting in the cache to be organized
+        done = self.jobs.get_jobs(job_store.DONE)
+        records = {}
+        if self.plexDB is not None and len(done) > 0:
+            records = {r.ratingKey: r for r in self.plexDB.candidates(self.config["plexLibrarySections"])}
+        for ratingKey in done:
+            try:
+                self.successfullyTranscoded.append(records[ratingKey] if self.plexDB is not None
+                                                   else project(self.plexSrv.fetchItem(ratingKey)))
+            except Exception as e:
+                logging.warning("monitor: could not restore transcoded file " + str(ratingKey) + ": " + str(e))
+                self.jobs.set_state(ratingKey, job_store.PENDING)
+        if len(self.successfullyTranscoded) > 0:
+            logging.info("monitor: restored " + str(len(self.successfullyTranscoded)) + " transcoded files")
+
     def sleep(self):
         self.ready = False
         self.sleeping = True
@@ -98,7 +134,9 @@ class Monitor:
             self.plex()
             self.fs()
             self.gpu()
+            self.transcoder()
             self.plexlibrary()
+            self.retry_failed()
             self.veto()
             # set readiness to True because all is done
             self.ready = True
@@ -106,126 +144,174 @@ class Monitor:
             logging.critical("monitor: error while updating: " + str(e))
             self.zombie = True
             return False
+        finally:
+            self.ctrl.notify("monitor")
 
     def get_veto_organize(self):
         return self.states["veto"]["organizer"]
 
-    def set_failed_to_transcode(self, file):
-        self.history["failure"].append(file.ratingKey)
+    def set_failed_to_transcode(self, file, exit_code=None, detail=None):
+        self.jobs.set_state(file.ratingKey, job_store.FAILED, exit_code=exit_code, detail=detail)
+        mailer.__MAIL__.digest("failed (" + str(exit_code) + "): " + str(file.locations[0])
+                               + (" - " + detail if detail else ""))
+
+    def set_verifying(self, file):
+        self.jobs.set_state(file.ratingKey, job_store.VERIFYING)
 
-    def set_successfully_transcoded(self, file):
-        self.history["success"].append(file.ratingKey)
+    def set_successfully_transcoded(self, file, detail=None):
+        self.jobs.set_state(file.ratingKey, job_store.DONE, detail=detail)
         self.successfullyTranscoded.append(file)
+        mailer.__MAIL__.digest("transcoded: " + str(file.locations[0]))
 
     def get_successfully_transcoded(self):
+        # forget about files the organizer already took care of
+        self.successfullyTranscoded = [f for f in self.successfullyTranscoded
+                                       if self.jobs.get_state(f.ratingKey) == job_store.DONE]
         return self.successfullyTranscoded
 
     def clean_successfully_transcoded(self):
         self.successfullyTranscoded = []
 
     def set_current_transcoding(self, file):
-        self.history["current"].append(file.ratingKey)
+        self.jobs.set_state(file.ratingKey, job_store.RUNNING, location=file.locations[0])
 
     def remove_current_transcoding(self, file):
-        try:
-            self.history["current"].remove(file.ratingKey)
-        except ValueError as e:
+        if self.jobs.get_state(file.ratingKey) == job_store.RUNNING:
+            self.jobs.set_state(file.ratingKey, job_store.PENDING)
+            self.requeue(file.ratingKey)
+        else:
             logging.warning("monitor: tried to remove file from current transcoding but this failed: "
                             + str(file).encode('ascii', 'replace').decode())
-            pass
 
     def queue_full(self):
-        return not eval('self.states["fs"]["transcoderCacheSize"]' +
-                    self.config["transcoderReady"]["fs"]["transcoderCacheSize"]) \
-               or not eval('self.states["fs"]["transcoderCacheDiskFree"]' +
-                        self.config["transcoderReady"]["fs"]["transcoderCacheDiskFree"])
-
-    def ready_to_transcode(self):
-        # loop through the config and crosscheck with current state
-        for counter in self.config["transcoderReady"]:
-            for value in self.config["transcoderReady"][counter]:
-                if value == "datetime" and len(self.config["transcoderReady"][counter][value]) >= 1:
-                    istime = False
-                    for v in self.config["transcoderReady"][counter][value]:
-                        start = v["start"]
-                        end = v["end"]
-                        if is_time_between(time(start[0], start[1]), time(end[0], end[1]),
-                                           self.states[counter][value]):
-                            istime = True
-                    if not istime:
-                        self.failureReason = {
-                            "counter": counter,
-                            "value": value,
-                            "must": self.config["transcoderReady"][counter][value],
-                            "is": self.states[counter][value]
-                        }
-                        return False
-                elif self.config["transcoderReady"][counter][value] != -1:
-                    if not eval("self.states[counter][value]" + self.config["transcoderReady"][counter][value]):
-                        self.failureReason = {
-                            "counter": counter,
-                            "value": value,
-                            "must": self.config["transcoderReady"][counter][value],
-                            "is": self.states[counter][value]
-                        }
-                        return False
-        self.failureReason = {}
-        return True
+        for counter, value, check in self.config["predicates"]["queueFull"]:
+            if not check(self.states[counter][value]):
+                return True
+        return False
+
+    def ready_to_transcode(self, profile=None):
+        # transcoders might have finished since the last plex update
+        self.transcode_sessions_delta()
+        if profile is None:
+            return self.ready_to("transcoderReady")
+        # every profile is checked on its own slots and devices: a busy gpu does not hold back cpu encoders
+        states = dict(self.states, plex=dict(self.states["plex"]))
+        if "TranscodeSessionsDelta" in states["plex"]:
+            states["plex"]["TranscodeSessionsDelta"] = self.transcode_sessions_delta(profile)
+        if profile.device is not None:
+            states["gpu"] = self.gpu_states(profile.device)
+        return self.ready_to("transcoderReady", states, skip=[] if profile.uses_gpu() else ["gpu"])
+
+    def ready_to_remux(self):
+        # remuxing is i/o bound: it neither competes with plex nor with the encoders
+        return not self.queue_full()
 
     def ready_to_organize(self):
-        # loop through the config and crosscheck with current state
-        for counter in self.config["organizerReady"]:
-            for value in self.config["organizerReady"][counter]:
-                if value == "datetime" and len(self.config["organizerReady"][counter][value]) >= 1:
-                    istime = False
-                    for v in self.config["organizerReady"][counter][value]:
-                        start = v["start"]
-                        end = v["end"]
-                        if is_time_between(time(start[0], start[1]), time(end[0], end[1]),
-                                           self.states[counter][value]):
-                            istime = True
-                    if not istime:
-                        self.failureReason = {
-                            "counter": counter,
-                            "value": value,
-                            "must": self.config["organizerReady"][counter][value],
-                            "is": self.states[counter][value]
-                        }
-                        return False
-                elif self.config["organizerReady"][counter][value] != -1:
-                    if not eval("self.states[counter][value]" + self.config["organizerReady"][counter][value]):
-                        self.failureReason = {
-                            "counter": counter,
-                            "value": value,
-                            "must": self.config["organizerReady"][counter][value],
-                            "is": self.states[counter][value]
-                        }
-                        return False
+        return self.ready_to("organizerReady")
+
+    def ready_to(self, readiness, states=None, skip=()):
+        # loop through the precompiled config checks and crosscheck with current state
+        states = states if states is not None else self.states
+        for counter, value, check in self.config["predicates"][readiness]:
+            if counter in skip:
+                continue
+            # a value not known (yet) is not ready
+            if value not in states[counter] or not check(states[counter][value]):
+                self.failureReason = {
+                    "counter": counter,
+                    "value": value,
+                    "must": self.config[readiness][counter][value],
+                    "is": states[counter].get(value)
+                }
+                return False
         self.failureReason = {}
         return True
 
     def get_states(self):
         return self.states
 
-    def get_file(self):
-        self.history["all"] = self.history["current"] + self.history["success"] + self.history["failure"]
-        for file in self.plexLibrary["files"]:
-            # check if file is neither currently transcoding nor already processed
-            if len(self.history["all"]) == 0 or file.ratingKey not in self.history["all"]:
-                # check if a filter is configured
-                if len(self.config["plexLibraryFilesFilter"]) != 0:
-                    ok = True
-                    # loop through all filters and check if they apply to the file
-                    for f in self.config["plexLibraryFilesFilter"]:
-                        if not hasattr(file, 'media') \
-                                or not len(file.media) > 0 \
-                                or not eval("file.media[0]." + f + " " + self.config["plexLibraryFilesFilter"][f]):
-                            ok = False
-                    if ok:
-                        return file
-                else:
-                    return file
-        return False
+    def get_file(self, lane=transcoder.TRANSCODE):
+        # the scheduler knows the best file, files processed meanwhile are dropped from the queue
+        # as well as files that belong to another lane according to ffprobe (plex might be stale)
+        file = self.queues[lane].peek(
+            skip=lambda f: self.jobs.is_processed(f.ratingKey) or not self.probed_transcodable(f, lane))
+        if file is None:
+            return False
+        return file
+
+    def transcodable(self, file):
+        # check if all configured filters apply to the file
+        filters = self.config["predicates"]["plexLibraryFilesFilter"]
+        if len(filters) != 0:
+            if not hasattr(file, 'media') or not len(file.media) > 0:
+                return False
+            media = file.media[0]
+            return all(check(attr(media)) for attr, check in filters)
+        return True
+
+    def lane(self, file):
+        # the lane a file is processed in or None if it does not need to be processed
+        if hasattr(file, 'media') and len(file.media) > 0 and transcoder.remuxable(file.media[0], self.config):
+            return transcoder.REMUX
+        if self.transcodable(file):
+            return transcoder.TRANSCODE
+        return None
+
+    def probed_transcodable(self, file, lane=transcoder.TRANSCODE):
+        # only cached probes are used: unknown files are trusted to plex
+        if len(file.locations) == 0:
+            return True
+        data = self.probes.get(config_loader.local_path(self.config, file.locations[0]))
+        if data is None:
+            return True
+        probedLane = self.lane(probe.as_media(data))
+        if probedLane is None:
+            logging.info("monitor: skip file, ffprobe disagrees with plex: " + str(file).encode('ascii', 'replace').decode())
+            return False
+        if probedLane != lane:
+            logging.info("monitor: move file to " + probedLane + " queue: " + str(file).encode('ascii', 'replace').decode())
+            self.queues[probedLane].push(file)
+            return False
+        return True
+
+    def queue(self):
+        return scheduler.Scheduler(self.config.get("transcoderSchedulingPolicy", "title"),
+                                   self.config.get("plexLibrarySections", []), self.config.get("plexLibrarySort"))
+
+    def enqueue(self, file, queues=None):
+        queues = queues if queues is not None else self.queues
+        lane = None if self.jobs.is_processed(file.ratingKey) else self.lane(file)
+        for name, queue in queues.items():
+            if name == lane:
+                queue.push(file)
+            else:
+                queue.remove(file.ratingKey)
+        # probe queued files in the background to know them better than plex does
+        if lane is not None and len(file.locations) > 0:
+            self.probes.submit(config_loader.local_path(self.config, file.locations[0]))
+
+    def fetch(self, file):
+        """get the full plexapi object of a file about to be dispatched, returns None if plex does not know it anymore"""
+        if self.plexDB is not None or self.plexSrv is None or not isinstance(file, MediaRecord):
+            return file
+        try:
+            return self.plexSrv.fetchItem(file.ratingKey)
+        except plexapi.exceptions.NotFound:
+            logging.info("monitor: file is gone from plex: " + str(file).encode('ascii', 'replace').decode())
+            self.plexLibrary["files"].pop(file.ratingKey, None)
+            for queue in self.queues.values():
+                queue.remove(file.ratingKey)
+            return None
+        except Exception as e:
+            # the record knows everything a transcoder needs
+            logging.warning("monitor: could not fetch " + str(file).encode('ascii', 'replace').decode() + ": " + str(e))
+            return file
+
+    def requeue(self, ratingKey):
+        # a file is pending again (retry, interrupted): put it back into its queue
+        file = self.plexLibrary["files"].get(ratingKey)
+        if file is not None:
+            self.enqueue(file)
 
     def sys(self):
         # ready system parameters
@@ -237,6 +323,11 @@ class Monitor:
         # read plex parameters: do only update these values after specific delay (defined in config)
         now = datetime.timestamp(datetime.now())
         if now > self.plexStats["date"] + self.config["plexStatsUpdateInterval"]:
+            if self.plexSrv is None and self.plexDB is not None and not self.setup_plexapi():
+                # without plex its stats are unknown: checks on them are not ready until it is back
+                self.states["plex"] = {}
+                self.plexStats["date"] = now
+                return
             resources = self.plexSrv.resources()
             self.states["plex"]["PlayingSessions"] = self.plexSrv.sessions()
             self.states["plex"]["PlayingSessionsCount"] = len(self.plexSrv.sessions())
@@ -246,11 +337,22 @@ class Monitor:
             self.states["plex"]["hostMemoryUtilization"] = wMean([r.hostMemoryUtilization for r in resources])
             self.states["plex"]["processCpuUtilization"] = wMean([r.processCpuUtilization for r in resources])
             self.states["plex"]["processMemoryUtilization"] = wMean([r.processMemoryUtilization for r in resources])
-            self.states["plex"]["TranscodeSessionsDelta"] = self.config["transcoderCount"] - \
-                                                            len(self.ctrl.get_busy_transcoders()) - \
-                                                            len(self.plexSrv.transcodeSessions())
+            self.transcode_sessions_delta()
             self.plexStats["date"] = now
 
+    def transcode_sessions_delta(self, profile=None):
+        # free transcoding slots: our own busy transcoders and the transcode sessions of plex count
+        # the slots of a profile are its own limit, the state holds the ones of all profiles together
+        if "TranscodeSessionsCount" not in self.states["plex"]:
+            return None
+        if profile is not None:
+            return profile.concurrency.limit - len(self.ctrl.get_busy_transcoders(transcoder.TRANSCODE, profile)) - \
+                   self.states["plex"]["TranscodeSessionsCount"]
+        self.states["plex"]["TranscodeSessionsDelta"] = self.ctrl.transcoder_limit() - \
+                                                        len(self.ctrl.get_busy_transcoders(transcoder.TRANSCODE)) - \
+                                                        self.states["plex"]["TranscodeSessionsCount"]
+        return self.states["plex"]["TranscodeSessionsDelta"]
+
     def fs(self):
         # read filesystem parameters
         try:
@@ -263,17 +365,48 @@ class Monitor:
         self.states["fs"]["transcoderCacheDiskFree"], = shutil.disk_usage(self.config["transcoderCache"])
 
     def gpu(self):
-        # read gpu parameters if any gpu is found
-        gpus = GPUtil.getGPUs()
-        if len(gpus) > 0:
-            gpu = gpus[0]
-            self.states["gpu"]["load"] = gpu.load * 100
-            self.states["gpu"]["memoryUtil"] = gpu.memoryUtil * 100
-            self.states["gpu"]["temperature"] = gpu.temperature
-        else:
-            self.states["gpu"]["load"] = 0
-            self.states["gpu"]["memoryUtil"] = 0
-            self.states["gpu"]["temperature"] = 0
+        # the sampler reads all devices in the background, the busiest one counts for the readiness checks
+        devices = self.ctrl.gpus.devices()
+        # without a reading the gpu is not known to be idle: the gpu checks of profiles on a gpu are not ready
+        self.states["gpu"] = {"devices": devices}
+        if len(devices) == 0:
+            if not self.gpuUnavailable and any(profile.uses_gpu() for profile in self.ctrl.profiles):
+                logging.warning("monitor: no gpu telemetry, profiles encoding or decoding on a gpu are not ready")
+            self.gpuUnavailable = True
+            return
+        self.gpuUnavailable = False
+        for value in ["load", "memoryUtil", "temperature"]:
+            self.states["gpu"][value] = max([d[value] or 0 for d in devices])
+
+    def gpu_states(self, index):
+        # the readings of one device for the profiles bound to it
+        device = next((d for d in self.states["gpu"].get("devices", []) if d["index"] == index), None)
+        if device is None:
+            return self.states["gpu"]
+        return dict(self.states["gpu"], **{value: device[value] or 0 for value in ["load", "memoryUtil", "temperature"]})
+
+    def transcoder(self):
+        # read the live progress of all running transcoders
+        busy = self.ctrl.get_busy_transcoders()
+        progress = [tr.progress for tr in busy]
+        self.states["transcoder"]["fps"] = sum(p.get("fps") or 0 for p in progress)
+        self.states["transcoder"]["speed"] = sum(p.get("speed") or 0 for p in progress)
+        self.states["transcoder"]["progress"] = progress
+        for p in progress:
+            logging.debug("monitor: transcoding progress: " + str(p))
+        # encoded pixels per second: comparable between sources of different resolution
+        encoders = [tr for tr in busy if tr.lane == transcoder.TRANSCODE]
+        self.states["transcoder"]["throughput"] = throughput(encoders)
+        # every profile tunes its own pool on its own throughput
+        self.states["transcoder"]["profiles"] = {}
+        for profile in self.ctrl.profiles:
+            pool = [tr for tr in encoders if tr.profile is profile]
+            self.states["transcoder"]["profiles"][profile.name] = {"busy": len(pool), "throughput": throughput(pool),
+                                                                   "limit": profile.concurrency.limit}
+            states = dict(self.states, transcoder=dict(self.states["transcoder"], throughput=throughput(pool)))
+            if profile.device is not None:
+                states["gpu"] = self.gpu_states(profile.device)
+            profile.concurrency.sample(states, len(pool))
 
     def veto(self):
         if Path(self.config["organizerVetoFile"]).is_file():
@@ -288,37 +421,98 @@ class Monitor:
         else:
             self.states["veto"]["organizer"] = -1
 
+    def retry_failed(self):
+        # failed files get another chance after a specific delay (defined in config, -1 to never retry)
+        interval = self.config.get("transcoderRetryInterval", self.config["plexLibraryUpdateInterval"])
+        now = datetime.timestamp(datetime.now())
+        if interval != -1 and now > self.failureRetry["date"] + interval:
+            retried = self.jobs.retry_failed(older_than=interval)
+            for ratingKey in retried:
+                self.requeue(ratingKey)
+            if len(retried) > 0:
+                logging.info("monitor: retry " + str(len(retried)) + " failed files")
+            self.failureRetry["date"] = now
+
+    def search_library(self, lib, libtype, sort, since=None):
+        # fetch the library page by page to keep the requests to plex small
+        size = self.config.get("plexLibraryPageSize", 500)
+        filters = None
+        if since is not None:
+            since = datetime.fromtimestamp(since)
+            filters = {"or": [{"updatedAt>>": since}, {"addedAt>>": since}]}
+        start = 0
+        while True:
+            page = lib.search(libtype=libtype, sort=sort, filters=filters,
+                              container_start=start, container_size=size, maxresults=size)
+            for item in page:
+                yield item
+            if len(page) < size:
+                return
+            start += size
+
+    def library_items(self, since=None):
+        # read the candidates straight from the plex database if configured
+        if self.plexDB is not None:
+            yield from self.plexDB.candidates(self.config["plexLibrarySections"], since)
+            return
+        # get files of everry section
+        for s in self.config["plexLibrarySections"]:
+            lib = self.plexSrv.library.section(s)
+            if isinstance(lib, plexapi.library.MovieSection):
+                libtype, sort = "movie", self.config["plexLibrarySort"]["movies"]
+            elif isinstance(lib, plexapi.library.ShowSection):
+                libtype, sort = "episode", self.config["plexLibrarySort"]["shows"]
+            else:
+                # ignore music and photos
+                continue
+            try:
+                items = list(self.search_library(lib, libtype, sort, since))
+            except (plexapi.exceptions.NotFound, plexapi.exceptions.BadRequest) as e:
+                # this section does not know the date filters: fall back to a full fetch
+                logging.warning("monitor: delta sync not possible for " + str(s) + ": " + str(e))
+                items = list(self.search_library(lib, libtype, sort))
+            yield from items
+
     def plexlibrary(self):
         # update local copy of plexlibrary after specific delay (defined in config)
         now = datetime.timestamp(datetime.now())
         if now > self.plexLibrary["date"] + self.config["plexLibraryUpdateInterval"]:
-            logging.info("monitor: library update started")
-            self.plexLibrary["files"] = []
-            # get files of everry section
-            for s in self.config["plexLibrarySections"]:
-                lib = self.plexSrv.library.section(s)
-                if isinstance(lib, plexapi.library.MovieSection):
-                    if len(self.config["plexLibraryQueryFilter"]) != 0:
-                        self.plexLibrary["files"] = self.plexLibrary["files"] \
-                                                    + lib.searchMovies(sort=self.config["plexLibrarySort"]["movies"],
-                                                                       **self.config["plexLibraryQueryFilter"])
-                    else:
-                        self.plexLibrary["files"] = self.plexLibrary["files"] + lib.searchMovies(sort=self.config["plexLibrarySort"]["movies"])
-                elif isinstance(lib, plexapi.library.ShowSection):
-                    if len(self.config["plexLibraryQueryFilter"]) != 0:
-                        self.plexLibrary["files"] = self.plexLibrary["files"] \
-                                                    + lib.searchEpisodes(sort=self.config["plexLibrarySort"]["shows"],
-                                                                         **self.config["plexLibraryQueryFilter"])
-                    else:
-                        self.plexLibrary["files"] = self.plexLibrary["files"] + lib.searchEpisodes(sort=self.config["plexLibrarySort"]["shows"])
-                elif isinstance(lib, plexapi.library.MusicSection):
-                    # ignore music
-                    pass
-                elif isinstance(lib, plexapi.library.PhotoSection):
-                    # ignore photos
-                    pass
-
+            # only fetch changes since the last sync, but reconcile the whole library from time to time
+            reconcile = now > self.plexLibrary["reconciled"] \
+                        + self.config.get("plexLibraryReconcileInterval", 86400)
+            # overlap one second: items changed within the same second as the watermark are fetched again
+            since = None if reconcile else self.plexLibrary["watermark"] - 1
+            logging.info("monitor: library " + ("reconcile" if reconcile else "delta sync") + " started")
+            # work on a copy: get_file might iterate the current candidates meanwhile
+            files = {} if reconcile else dict(self.plexLibrary["files"])
+            queues = {lane: self.queue() for lane in self.queues} if reconcile \
+                else self.queues
+            watermark = self.plexLibrary["watermark"]
+            changed = 0
+            for item in self.library_items(since):
+                changed += 1
+                # keep only a compact record of plexapi items, the full object is fetched when it is dispatched
+                record = item if isinstance(item, MediaRecord) else project(item)
+                watermark = max(watermark, record.updatedAt, record.addedAt)
+                # apply the plexapi query filter locally, changed files might not match anymore
+                # files that only need to be remuxed are wanted even if the filter excludes their codec
+                if not hasattr(item, "_checkAttrs") or len(self.config["plexLibraryQueryFilter"]) == 0 \
+                        or item._checkAttrs(item._data, **self.config["plexLibraryQueryFilter"]) \
+                        or self.lane(record) == transcoder.REMUX:
+                    files[record.ratingKey] = record
+                    self.enqueue(record, queues)
+                else:
+                    files.pop(record.ratingKey, None)
+                    for queue in queues.values():
+                        queue.remove(record.ratingKey)
+
+            self.plexLibrary["files"] = files
+            self.queues = queues
+            # the latest change seen, the overlap is only taken when asking for changes since then
+            self.plexLibrary["watermark"] = watermark
             self.plexLibrary["date"] = now
-            # reset failed transcoded files: plex data is quite up to date and therefore stuff could have changed
-            self.history["failure"] = []
-            logging.info("monitor: library update ended")
+            if reconcile:
+                self.plexLibrary["reconciled"] = now
+            logging.info("monitor: library update ended: " + str(changed) + " items fetched, "
+                         + str(len(files)) + " candidates, "
+                         + ", ".join(str(len(q)) + " " + lane for lane, q in queues.items()) + " queued")
@@ -19,7 +19,11 @@ import threading
 import glob
 import shutil
 
-from modules import csv_logger
+from modules import config_loader
+from modules import event_log
+from modules import job_store
+from modules import mailer
+from modules import transfer
 
 
 def threaded(fn):
@@ -40,17 +44,23 @@ def is_time_between(begin_time, end_time, check_time=None):
 
 class Organizer:
 
-    def __init__(self, config):
+    def __init__(self, parent, config):
         # set readiness to False to avoid conflicts
         self.ready = False
         self.zombie = False
+        self.ctrl = parent
         self.config = config
+        self.jobs = parent.jobs
         self.createTranscoderCache()
         self.plexSrv = None
         self.dbconn = None
         self.organizedFiles = []
         self.deleteQueue = []
         self.moveQueue = []
+        self.transfers = transfer.Transfers(self.config.get("organizerTransferWorkers", 2),
+                                            self.config.get("organizerTransferChecksum", "sha256"))
+        # seconds plex was stopped during the last organize run
+        self.downtime = 0
         if self.setup_plexapi():
             self.plexStatus = 1
             # set readiness to True because all is done
@@ -74,9 +84,8 @@ class Organizer:
         self.organizedFiles.append(file)
 
     def createTranscoderCache(self):
+        # leftovers of an earlier run were adopted or removed by the verifier at startup
         Path(self.config["transcoderCache"]).mkdir(parents=True, exist_ok=True)
-        for f in os.listdir(Path(self.config["transcoderCache"])):
-            shutil.rmtree(os.path.join(Path(self.config["transcoderCache"]), f))
 
     def stopPlex(self):
         if self.plexStatus == 1:
@@ -102,8 +111,9 @@ class Organizer:
 
     def transcodedFiles(self):
         files = []
-        for file in glob.iglob(self.config["transcoderCache"] + "/**/*." + self.config["targetContainer"],
-                               recursive=True):
+        # outputs are <ratingKey>/<name> in the cache: workers sharing the cache keep theirs deeper down
+        for file in glob.iglob(os.path.join(glob.escape(self.config["transcoderCache"]), "*",
+                                            "*." + self.config["targetContainer"])):
             files.append(file)
         return files
 
@@ -122,73 +132,118 @@ class Organizer:
         end = self.config["plexAnalyzeTimeWindow"]["end"]
         return is_time_between(time(start[0], start[1]), time(end[0], end[1]))
 
+    def plan(self, files):
+        """match the transcoded files with the jobs and compute every move, db update and delete up front"""
+        index = {str(f.ratingKey): f for f in files}
+        plan = []
+        for tf in self.transcodedFiles():
+            f = index.get(Path(tf).parent.name)
+            if f is None:
+                continue
+            # the files were verified by the verifier before they were handed to the organizer
+            path = config_loader.local_path(self.config, f.locations[0])
+            target = path.parent.joinpath(Path(tf).name)
+            logging.info("organizer: queue move " + str(tf).encode('ascii', 'replace').decode() + " to "
+                         + str(target).encode('ascii', 'replace').decode())
+            move = {"file": f, "from": tf, "to": target, "staged": None, "update": None, "delete": None}
+            # if the filepath has changed we need to take care of that within filesystem and plex database
+            if path.name != Path(tf).name:
+                move["update"] = (str(target), str(path), str(path).replace("\\", "/"))
+                # mark path to be deleted (that will happen after db commit)
+                move["delete"] = path
+            plan.append(move)
+        return plan
+
+    def stage(self, plan):
+        """move the transcoded files next to their destination while plex is still running"""
+        for move in plan:
+            target = Path(move["to"])
+            move["staged"] = target.parent.joinpath("." + target.name + ".video-grinder")
+        # a partially staged file of an interrupted run is resumed, the source stays in the cache until the
+        # new paths are committed: a crash before that leaves the job organizable from the cache
+        moved = set(self.transfers.run([(move["from"], move["staged"]) for move in plan], keep=True))
+        staged = []
+        for move in plan:
+            if (move["from"], move["staged"]) in moved:
+                event_log.__LOG__.log(["organizer", "file stage", 0, "successfully staged", move["from"],
+                                       str(move["staged"])])
+                staged.append(move)
+            else:
+                logging.warning("organizer: staging failed, file is organized next time: "
+                                + str(move["from"]).encode('ascii', 'replace').decode())
+                event_log.__LOG__.log(["organizer", "file stage", 1, "staging failed", move["from"],
+                                       str(move["staged"])])
+        return staged
+
+    def update_paths(self, dbcur, updates):
+        """point plex to the new files with one parameterized statement, the row counts are checked in bulk"""
+        if len(updates) == 0:
+            return
+        # count the rows each update is going to change before changing them
+        paths = sorted({p for u in updates for p in u[1:]})
+        matches = {}
+        for i in range(0, len(paths), 500):
+            chunk = paths[i:i + 500]
+            for file, count in dbcur.execute("SELECT file, COUNT(*) FROM media_parts WHERE file IN ("
+                                             + ", ".join("?" * len(chunk)) + ") GROUP BY file", chunk).fetchall():
+                matches[file] = count
+        dbcur.executemany("UPDATE media_parts SET file = ? WHERE file = ? OR file = ?", updates)
+        expected = 0
+        for new, old, oldSlash in updates:
+            count = matches.get(old, 0) + (matches.get(oldSlash, 0) if oldSlash != old else 0)
+            expected += count
+            if count != 1:
+                logging.warning("organizer: dbupdate could be invalid, recived " + str(count)
+                                + " and not 1 rowcount for file: " + old.encode('ascii', 'replace').decode() + " "
+                                + new.encode('ascii', 'replace').decode())
+                event_log.__LOG__.log(["organizer", "db update", 1, "dbupdate could be invalid",
+                                       old, new, str(count) + " rows changed."])
+            else:
+                event_log.__LOG__.log(["organizer", "db update", 0, "successfully updated",
+                                       old, new, str(count) + " rows changed."])
+        if dbcur.rowcount != expected:
+            logging.warning("organizer: dbupdate changed " + str(dbcur.rowcount) + " rows, expected " + str(expected))
+        logging.info("organizer: " + str(len(updates)) + " paths updated in plex db")
+
     @threaded
     def organize(self, files):
         self.ready = False
         changedfile = False
-        self.dbconn = sqlite3.connect(self.config["plexDB"])
-        dbcur = self.dbconn.cursor()
-
         logging.info("organizer: start organizing files")
 
-        # loop trough files currently present in transcoder cache (filesystem)
-        for tf in self.transcodedFiles():
-            # loop through files currently present in transcoder successfully history (monitor)
-            for f in files:
-                # if file exists on filesystem and in transcoder successfully history
-                if str(f.ratingKey) == Path(tf).parent.name:
-                    path = Path(f.locations[0])
-                    if "fakeFileSystem" in self.config and len(self.config["fakeFileSystem"]) > 0:
-                        path = Path(str(path).replace(self.config["fakeFileSystem"]["search"][0],
-                                                      self.config["fakeFileSystem"]["replace"][0])
-                                    .replace(self.config["fakeFileSystem"]["search"][1],
-                                             self.config["fakeFileSystem"]["replace"][1]))
-                    logging.info("organizer: queue move " + str(tf).encode('ascii', 'replace').decode() + " to "
-                                 + str(path.parent.joinpath(Path(tf).name)).encode('ascii', 'replace').decode())
-                    # do only move files if not readonly mode
-                    if self.config["readonly"] == "False":
-                        self.stopPlex()             # make sure plex service is not running
-                        changedfile = True          # this will cause a db update (commit)
-                        self.moveQueue.append({"from": tf,"to": path.parent.joinpath(Path(tf).name)})
-                    # if the filepath has changed we need to take care of that within filesystem and plex database
-                    if path.name != Path(tf).name:
-                        if self.config["readonly"] == "False":
-                            self.stopPlex()         # make sure plex service is not running
-                            changedfile = True      # this will cause a db update (commit)
-
-                            # update filepath in db
-                            updateStr = "UPDATE media_parts SET file = \"" \
-                                        + str(path.parent.joinpath(Path(tf).name)) \
-                                        + "\" WHERE file = \"" + str(path) + "\" "\
-                                        + "OR file = \"" + str(path).replace("\\", "/") + "\";"
-                            logging.debug("organizer: queue update db: "
-                                          + str(updateStr).encode('ascii', 'replace').decode())
-                            dbcur.execute(updateStr)
-                            if dbcur.rowcount != 1:
-                                logging.warning("organizer: dbupdate could be invalid, recived " + str(dbcur.rowcount)
-                                                + " and not 1 rowcount for file: " + str(f).encode('ascii', 'replace').decode() + " "
-                                                + str(path.parent.joinpath(Path(tf).name)).encode('ascii', 'replace').decode())
-                                csv_logger.__CSV__.log(["organizer", "db update", 1, "dbupdate could be invalid",
-                                                        updateStr, str(dbcur.rowcount) + " rows changed."])
-                            else:
-                                csv_logger.__CSV__.log(["organizer", "db update", 0, "successfully updated",
-                                                        updateStr, str(dbcur.rowcount) + " rows changed."])
-                            # mark path to be deleted (that will happen after db commit)
-                            self.deleteQueue.append(path)
-                    self.set_organized_file(f)
-        if changedfile:
+        plan = self.plan(files)
+        for move in plan:
+            self.set_organized_file(move["file"])
+
+        # do only move files if not readonly mode
+        if self.config["readonly"] == "False" and len(plan) > 0:
+            # phase one: copying takes long but plex keeps running meanwhile
+            plan = self.stage(plan)
+            self.moveQueue = plan
+            self.deleteQueue = [move["delete"] for move in plan if move["delete"] is not None]
+
+        self.dbconn = sqlite3.connect(self.config["plexDB"])
+        # staged files that are not needed anymore if the organizing is rolled back
+        unstage = []
+        if len(self.moveQueue) > 0:
+            changedfile = True
+            # phase two: only renames and the db commit happen while plex is down
+            stopped = teatime.monotonic()
+            moved = []
             try:
                 self.stopPlex()  # make sure plex service is not running
 
+                # all path updates in one transaction: committed only after the files are in place
+                dbcur = self.dbconn.cursor()
+                dbcur.execute("BEGIN IMMEDIATE")
+                self.update_paths(dbcur, [move["update"] for move in self.moveQueue if move["update"] is not None])
+
                 for f in self.moveQueue:
                     logging.info("organizer: move file from: " + str(f["from"]).encode('ascii', 'replace').decode()
                                  + " to: " + str(f["to"]).encode('ascii', 'replace').decode())
-                    shutil.move(f["from"], f["to"])
-                    csv_logger.__CSV__.log(["organizer", "file move", 0, "successfully moved", f["from"], f["to"]])
-                    # delete file and folders that were not organized: this will remove old folders and orphan files
-                    logging.info(
-                        "organizer: delete orphan files and folder: " + str(f["from"]).encode('ascii', 'replace').decode())
-                    shutil.rmtree(Path(f["from"]).parent)
+                    os.replace(f["staged"], f["to"])
+                    moved.append(f)
+                    event_log.__LOG__.log(["organizer", "file move", 0, "successfully moved", f["from"], f["to"]])
 
                 for f in self.deleteQueue:
                     logging.info("organizer: delete old file: " + str(f).encode('ascii', 'replace').decode())
@@ -197,30 +252,63 @@ class Organizer:
                             os.remove(f)
                         else:
                             logging.warning("organizer: file not existing anymore: " + str(f).encode('ascii', 'replace').decode())
-                    except FileNotFoundError as e:
+                    except FileNotFoundError:
                         logging.warning("organizer: file not existing anymore: " + str(f).encode('ascii', 'replace').decode())
-                    csv_logger.__CSV__.log(["organizer", "file delete", 0, "successfully deleted", f, ""])
+                    event_log.__LOG__.log(["organizer", "file delete", 0, "successfully deleted", f, ""])
 
                 logging.info("organizer: commit plex db update")
                 self.dbconn.commit()
-                csv_logger.__CSV__.log(["organizer", "db update", 0, "successfully committed", "", ""])
-
-            except FileNotFoundError as e:
-                logging.warning("organizer: file not existing anymore: " + str(f).encode('ascii', 'replace').decode())
-                return
+                event_log.__LOG__.log(["organizer", "db update", 0, "successfully committed", "", ""])
+
+            except FileNotFoundError:
+                # a staged file is gone: nothing is committed and plex gets the library back as it was
+                failed = next(f for f in self.moveQueue if f not in moved)
+                logging.warning("organizer: file not existing anymore, rolling back: "
+                                + str(failed["staged"]).encode('ascii', 'replace').decode())
+                event_log.__LOG__.log(["organizer", "file move", 404, "staged file not existing anymore",
+                                       failed["from"], str(failed["to"])])
+                self.dbconn.rollback()
+                # files that replaced their original in place are organized, plex's path of them did not change
+                done = [f for f in moved if f["update"] is None]
+                for f in moved:
+                    if f["update"] is not None:
+                        os.remove(f["to"])
+                # the transcoded files are still in the cache: their jobs stay done and are organized next time
+                unstage = [f for f in self.moveQueue if f not in done]
+                plan = self.moveQueue = done
+                self.deleteQueue = []
             except Exception as e:
                 # If something bad happend while commiting db or filesystem we gotta shut down everything
                 # and manually check the logs and do fixing stuff.
                 # This is to make sure no ugly stuff happens with our library.
-                logging.critical("organizer: we have a problem - like really.!: " + str(e) + " " + e.characters_written)
+                logging.critical("organizer: we have a problem - like really.!: " + str(e) + " "
+                                 + str(getattr(e, "characters_written", "")))
                 os._exit(1)
                 return
 
         self.dbconn.close()
 
+        # only now everything is committed and the jobs are finished for good
+        for move in plan:
+            self.jobs.set_state(move["file"].ratingKey, job_store.ORGANIZED)
+            mailer.__MAIL__.digest("organized: " + str(move["to"]))
+
         self.startPlex()                    # make sure plex starts again
 
+        for f in unstage:
+            Path(f["staged"]).unlink(missing_ok=True)
+
         if changedfile:
+            self.downtime = teatime.monotonic() - stopped
+            logging.info("organizer: plex was down for " + str(round(self.downtime, 1)) + " s to organize "
+                         + str(len(self.moveQueue)) + " files")
+            event_log.__LOG__.log(["organizer", "downtime", 0, "plex was down", str(round(self.downtime, 3)),
+                                   str(len(self.moveQueue)) + " files"])
+            # delete file and folders that were not organized: this will remove old folders and orphan files
+            for f in self.moveQueue:
+                logging.info(
+                    "organizer: delete orphan files and folder: " + str(f["from"]).encode('ascii', 'replace').decode())
+                shutil.rmtree(Path(f["from"]).parent, ignore_errors=True)
             # update and analyze library after changes are made
             self.updatePlexLibaray()
             if self.ready_to_analyze():
@@ -231,3 +319,4 @@ class Organizer:
 
         logging.info("organizer: end organizing files.")
         self.ready = True
+        self.ctrl.notify("organizer")
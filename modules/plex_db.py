@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  plex_db.py
+# desc:   read-only discovery of candidates in plex db
+##########################################################
+
+import logging
+import sqlite3
+from pathlib import Path
+
+from modules.media_record import MediaRecord
+
+# metadata_type of movies and episodes in metadata_items
+METADATA_TYPES = (1, 4)
+LIBTYPES = {1: "movie", 4: "episode"}
+
+# plex stores dates either as unix timestamps or as datetime strings (older versions)
+EPOCH = "CASE typeof({0}) WHEN 'integer' THEN {0} ELSE CAST(strftime('%s', {0}) AS INTEGER) END"
+
+CANDIDATES = ("SELECT mi.id, mi.title, mi.title_sort, " + EPOCH.format("mi.added_at") + ", "
+              + EPOCH.format("mi.updated_at") + ", "
+              "media.container, media.video_codec, media.audio_codec, media.bitrate, media.width, media.height, "
+              "media.duration, mp.file, mp.size, media.audio_channels, media.display_aspect_ratio, ls.name, "
+              "mi.metadata_type "
+              "FROM metadata_items mi "
+              "JOIN library_sections ls ON ls.id = mi.library_section_id "
+              "JOIN media_items media ON media.metadata_item_id = mi.id "
+              "JOIN media_parts mp ON mp.media_item_id = media.id "
+              "WHERE ls.name IN ({sections}) AND mi.metadata_type IN ({types}) "
+              "AND mi.deleted_at IS NULL AND media.deleted_at IS NULL AND mp.deleted_at IS NULL "
+              "{since}"
+              "ORDER BY mi.title_sort, mi.id, media.id, mp.id")
+
+
+def kbps(bitrate):
+    # the database stores bits per second, the plex api reports kbit/s
+    return bitrate // 1000 if bitrate else bitrate
+
+
+class PlexDB:
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # open read-only: plex keeps writing to its database (WAL) while we read
+        uri = Path(self.path).absolute().as_uri() + "?mode=ro"
+        dbconn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+        dbconn.execute("PRAGMA query_only = 1")
+        return dbconn
+
+    def candidates(self, sections, since=None):
+        """stream all movies and episodes of the given sections as MediaRecords (changed after since)"""
+        params = list(sections) + list(METADATA_TYPES)
+        sinceFilter = ""
+        if since is not None:
+            sinceFilter = "AND (" + EPOCH.format("mi.updated_at") + " > ? OR " \
+                          + EPOCH.format("mi.added_at") + " > ?) "
+            params += [since, since]
+        query = CANDIDATES.format(sections=", ".join("?" for _ in sections),
+                                  types=", ".join("?" for _ in METADATA_TYPES),
+                                  since=sinceFilter)
+        dbconn = self.connect()
+        try:
+            record = None
+            locations = []
+            for row in dbconn.execute(query, params):
+                # rows of the same item (several parts or versions) are next to each other
+                if record is not None and record.ratingKey != row[0]:
+                    record.locations = tuple(locations)
+                    yield record
+                    record = None
+                if record is None:
+                    record = MediaRecord(row[0], title=row[1], titleSort=row[2], addedAt=row[3] or 0,
+                                         updatedAt=row[4] or 0, container=row[5], videoCodec=row[6],
+                                         audioCodec=row[7], bitrate=kbps(row[8]), width=row[9], height=row[10],
+                                         duration=row[11], size=0, audioChannels=row[14], aspectRatio=row[15],
+                                         section=row[16], libtype=LIBTYPES.get(row[17]))
+                    locations = []
+                locations.append(row[12])
+                record.size += row[13] or 0
+            if record is not None:
+                record.locations = tuple(locations)
+                yield record
+        except sqlite3.Error as e:
+            logging.error("plexdb: reading candidates failed: " + str(e))
+            raise
+        finally:
+            dbconn.close()
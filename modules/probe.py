@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  probe.py
+# desc:   ffprobe metadata cache (path, size, mtime)
+##########################################################
+
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from ffmpy import FFprobe, FFRuntimeError
+
+from modules.media_record import MediaRecord
+
+# ffprobe format names of the containers plex knows under a different name
+CONTAINERS = {"matroska": "mkv", "mp4": "mp4", "mpegts": "ts", "mpeg": "mpeg", "asf": "asf"}
+
+
+def run_ffprobe(path):
+    ff = FFprobe(global_options="-v error",
+                 inputs={str(path): "-show_streams -show_format -of json"})
+    stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return json.loads(stdout.decode("utf-8", "replace"))
+
+
+def streams(data, codec_type):
+    return [s for s in data.get("streams", []) if s.get("codec_type") == codec_type]
+
+
+def video_stream(data):
+    # attached pictures (cover art) are video streams as well
+    for s in streams(data, "video"):
+        if not s.get("disposition", {}).get("attached_pic"):
+            return s
+    return None
+
+
+def duration(data):
+    """duration in ms"""
+    value = data.get("format", {}).get("duration")
+    return float(value) * 1000 if value not in [None, "N/A"] else None
+
+
+def start_time(data, stream=None):
+    """start of the stream (or the file) in s, 0 if unknown"""
+    value = (stream if stream is not None else data.get("format", {})).get("start_time")
+    return float(value) if value not in [None, "N/A"] else 0
+
+
+def container(data):
+    # ffprobe lists every format of the demuxer, plex names the container like the file extension
+    names = str(data.get("format", {}).get("format_name", "")).split(",")
+    for name, extension in CONTAINERS.items():
+        if name in names:
+            return extension
+    return names[0] or None
+
+
+def as_media(data):
+    """describe the probed file like plex does, so the library filters apply to it"""
+    video = video_stream(data) or {}
+    audio = next(iter(streams(data, "audio")), {})
+    fmt = data.get("format", {})
+    bitrate = fmt.get("bit_rate")
+    return MediaRecord(None, container=container(data),
+                       videoCodec=video.get("codec_name"), audioCodec=audio.get("codec_name"),
+                       bitrate=int(bitrate) // 1000 if bitrate not in [None, "N/A"] else None,
+                       width=video.get("width"), height=video.get("height"), duration=duration(data),
+                       size=int(fmt["size"]) if fmt.get("size") not in [None, "N/A"] else None,
+                       # plex names profiles in lower case ("main 10")
+                       videoProfile=str(video["profile"]).lower() if video.get("profile") else None,
+                       aspectRatio=round(video["width"] / video["height"], 2) if video.get("width")
+                       and video.get("height") else None,
+                       audioProfile=str(audio["profile"]).lower() if audio.get("profile") else None,
+                       audioChannels=audio.get("channels"))
+
+
+class ProbeCache:
+
+    def __init__(self, path, workers=2, backlog=1000):
+        self.path = str(path)
+        self.lock = threading.Lock()
+        self.dbconn = sqlite3.connect(self.path, check_same_thread=False)
+        self.dbconn.execute("CREATE TABLE IF NOT EXISTS probes ("
+                            "path TEXT PRIMARY KEY, "
+                            "size INTEGER NOT NULL, "
+                            "mtime REAL NOT NULL, "
+                            "probed REAL NOT NULL, "
+                            "data TEXT NOT NULL)")
+        self.dbconn.commit()
+        # probing happens in the background with a bounded number of ffprobe processes
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = set()
+        # files beyond the backlog are probed when they are dispatched
+        self.backlog = backlog
+
+    def get(self, path):
+        """cached probe of the file or None if the file is unknown or changed since"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.dbconn.execute("SELECT size, mtime, data FROM probes WHERE path = ?", (str(path),)).fetchone()
+        if row is None:
+            return None
+        if row[0] != stat.st_size or row[1] != stat.st_mtime:
+            # the file changed: forget about the old probe
+            self.invalidate(path)
+            return None
+        return json.loads(row[2])
+
+    def probe(self, path, cache=True):
+        """probe the file unless a valid probe is cached, returns None if ffprobe failed
+
+        files that are gone soon (outputs in the transcoder cache) are probed with cache=False
+        """
+        data = self.get(path) if cache else None
+        if data is not None:
+            return data
+        try:
+            stat = os.stat(path)
+            data = run_ffprobe(path)
+        except (OSError, FFRuntimeError, ValueError) as e:
+            logging.warning("probe: ffprobe failed for " + str(path).encode('ascii', 'replace').decode() + ": " + str(e))
+            return None
+        if not cache:
+            return data
+        with self.lock:
+            self.dbconn.execute("INSERT OR REPLACE INTO probes (path, size, mtime, probed, data) VALUES (?, ?, ?, ?, ?)",
+                                (str(path), stat.st_size, stat.st_mtime, datetime.timestamp(datetime.now()),
+                                 json.dumps(data)))
+            self.dbconn.commit()
+        return data
+
+    def submit(self, path):
+        # probe in the background, every file only once at a time
+        path = str(path)
+        with self.lock:
+            if path in self.pending or len(self.pending) >= self.backlog:
+                return
+            self.pending.add(path)
+        self.pool.submit(self.background_probe, path)
+
+    def background_probe(self, path):
+        try:
+            self.probe(path)
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def invalidate(self, path):
+        with self.lock:
+            self.dbconn.execute("DELETE FROM probes WHERE path = ?", (str(path),))
+            self.dbconn.commit()
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+        with self.lock:
+            self.dbconn.close()
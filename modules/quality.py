@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  quality.py
+# desc:   per title search of the cheapest encoder settings
+##########################################################
+
+import json
+import logging
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+from datetime import datetime
+from ffmpy import FFmpeg, FFRuntimeError
+
+# how ffmpeg reports the score of each metric (the distorted video is the first input)
+METRICS = {
+    "ssim": ("ssim", re.compile(r"SSIM .*All:([\d.]+)")),
+    "psnr": ("psnr", re.compile(r"PSNR .*average:([\d.]+|inf)")),
+    "vmaf": ("libvmaf", re.compile(r"VMAF score[:=]\s*([\d.]+)"))
+}
+DEFAULT_TARGETS = {"ssim": 0.98, "psnr": 42, "vmaf": 93}
+
+__FILTERS__ = None
+
+
+def available_filters():
+    # ffmpeg is only asked once which filters it was built with
+    global __FILTERS__
+    if __FILTERS__ is None:
+        try:
+            stdout, _ = FFmpeg(global_options="-hide_banner -filters").run(stdout=subprocess.PIPE,
+                                                                           stderr=subprocess.PIPE)
+            __FILTERS__ = {line.split()[1] for line in stdout.decode("utf-8", "replace").splitlines()
+                           if len(line.split()) > 2}
+        except (OSError, FFRuntimeError):
+            __FILTERS__ = set()
+    return __FILTERS__
+
+
+class QualitySearch:
+    """encode a few short samples at several quality levels and pick the cheapest one meeting the target
+
+    The levels are configured from the cheapest to the best one and are expected to improve
+    the quality monotonically, so a binary search needs at most log2(levels) + 1 rounds.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.enabled = config.get("transcoderQualitySearch", "False") == "True"
+        self.levels = config.get("qualitySearchLevels", [])
+        self.template = config.get("qualitySearchSettings", "")
+        self.samples = config.get("qualitySearchSamples", 3)
+        self.sampleSeconds = config.get("qualitySearchSampleSeconds", 4)
+        self.metric = config.get("qualitySearchMetric", "ssim")
+        if self.metric == "vmaf" and self.enabled and "libvmaf" not in available_filters():
+            logging.warning("quality: ffmpeg has no libvmaf, ssim is used instead")
+            self.metric = "ssim"
+        self.target = config.get("qualitySearchTargets", {}).get(self.metric, DEFAULT_TARGETS[self.metric])
+        # results of another configuration are searched again
+        self.signature = json.dumps([self.template, self.levels, self.samples, self.sampleSeconds, self.metric,
+                                     self.target, config["targetVideoCodec"]])
+        self.lock = threading.Lock()
+        self.dbconn = sqlite3.connect(str(config["qualityCacheFile"]), check_same_thread=False)
+        self.dbconn.execute("CREATE TABLE IF NOT EXISTS quality ("
+                            "ratingKey INTEGER PRIMARY KEY, "
+                            "signature TEXT NOT NULL, "
+                            "level TEXT NOT NULL, "
+                            "score REAL, "
+                            "cost REAL NOT NULL, "
+                            "searched REAL NOT NULL)")
+        self.dbconn.commit()
+
+    def settings(self, ratingKey, path, duration, workDir):
+        """video settings for the file and the search result (None if the search is disabled)"""
+        if not self.enabled or not duration or len(self.levels) == 0 or self.config["readonly"] != "False":
+            return self.config["targetVideoSettings"], None
+        with self.lock:
+            row = self.dbconn.execute("SELECT level, score, cost FROM quality WHERE ratingKey = ? AND signature = ?",
+                                      (int(ratingKey), self.signature)).fetchone()
+        if row is not None:
+            result = {"level": json.loads(row[0]), "score": row[1], "cost": row[2], "cached": True}
+        else:
+            result = self.search(path, duration, workDir)
+            with self.lock:
+                self.dbconn.execute("INSERT OR REPLACE INTO quality (ratingKey, signature, level, score, cost, searched) "
+                                    "VALUES (?, ?, ?, ?, ?, ?)",
+                                    (int(ratingKey), self.signature, json.dumps(result["level"]), result["score"],
+                                     result["cost"], datetime.timestamp(datetime.now())))
+                self.dbconn.commit()
+        return self.template.replace("{quality}", str(result["level"])), result
+
+    def search(self, path, duration, workDir):
+        workDir.mkdir(parents=True, exist_ok=True)
+        starts = [max(0.0, duration / 1000 * (i + 1) / (self.samples + 1) - self.sampleSeconds / 2)
+                  for i in range(self.samples)]
+        started = time.monotonic()
+        measured = {}
+        try:
+            low, high = 0, len(self.levels) - 1
+            while low <= high:
+                middle = (low + high) // 2
+                measured[middle] = self.evaluate(path, self.levels[middle], starts, workDir)
+                if measured[middle][1] is not None and measured[middle][1] >= self.target:
+                    high = middle - 1
+                else:
+                    low = middle + 1
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+        # the smallest samples meeting the target, the best level if none does
+        passed = [i for i, (size, score) in measured.items() if score is not None and score >= self.target]
+        best = min(passed, key=lambda i: measured[i][0]) if passed else len(self.levels) - 1
+        cost = time.monotonic() - started
+        logging.info("quality: " + str(path).encode('ascii', 'replace').decode() + ": level " + str(self.levels[best])
+                     + " (" + self.metric + " " + str(measured.get(best, (0, None))[1]) + ") after "
+                     + str(len(measured)) + " rounds of " + str(self.samples) + "x" + str(self.sampleSeconds)
+                     + " s in " + str(round(cost, 1)) + " s")
+        return {"level": self.levels[best], "score": measured.get(best, (0, None))[1], "cost": cost,
+                "cached": False}
+
+    def evaluate(self, path, level, starts, workDir):
+        """total size of the samples and their worst score at this level"""
+        settings = self.template.replace("{quality}", str(level))
+        size = 0
+        scores = []
+        for i, start in enumerate(starts):
+            # samples get their own extension to never be mistaken for transcoded files
+            sample = workDir.joinpath("sample_%s_%02d.sample" % (re.sub(r"\W", "_", str(level)), i))
+            seek = "-ss " + str(round(start, 3)) + " -t " + str(self.sampleSeconds)
+            try:
+                FFmpeg(global_options="-hide_banner -nostdin -v error -y",
+                       inputs={str(path): seek},
+                       outputs={str(sample): "-map 0:V:0 -an -sn -c:v " + self.config["targetVideoCodec"] + " "
+                                             + settings + " -f matroska"}
+                       ).run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                size += sample.stat().st_size
+                _, stderr = FFmpeg(global_options="-hide_banner -nostdin -nostats",
+                                   inputs={str(sample): None, str(path): seek},
+                                   outputs={"-": "-lavfi \"[0:v]setpts=PTS-STARTPTS[d];[1:v:0]setpts=PTS-STARTPTS[r];"
+                                                 "[d][r]" + METRICS[self.metric][0] + "\" -f null"}
+                                   ).run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except (OSError, FFRuntimeError) as e:
+                logging.warning("quality: sample at level " + str(level) + " failed: " + str(e))
+                return size, None
+            match = METRICS[self.metric][1].search(stderr.decode("utf-8", "replace"))
+            if match is None:
+                return size, None
+            scores.append(float(match.group(1)))
+        return size, min(scores) if scores else None
+
+    def close(self):
+        with self.lock:
+            self.dbconn.close()
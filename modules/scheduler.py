@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  scheduler.py
+# desc:   decides which file is transcoded next
+##########################################################
+
+import heapq
+import itertools
+import threading
+
+from modules.media_record import timestamp
+
+# share of the original size that is left after transcoding to hevc
+CODEC_RATIO = {"mpeg1video": 0.2, "mpeg2video": 0.25, "msmpeg4v2": 0.35, "msmpeg4v3": 0.35, "msmpeg4": 0.35,
+               "mpeg4": 0.4, "wmv1": 0.4, "wmv2": 0.4, "wmv3": 0.45, "vc1": 0.45, "h263": 0.35,
+               "h264": 0.6, "vp8": 0.6, "vp9": 0.95, "hevc": 1.0, "av1": 1.0}
+DEFAULT_RATIO = 0.5
+
+# pixels per frame of the plex videoResolution values
+RESOLUTION_PIXELS = {"4k": 3840 * 2160, "1080": 1920 * 1080, "720": 1280 * 720, "576": 720 * 576,
+                     "480": 720 * 480, "sd": 640 * 480}
+
+# nominal encoder throughput (1080p at ~200 fps): only the ratio between files matters
+ENCODE_PIXEL_RATE = 1920 * 1080 * 200
+FRAME_RATE = 25
+
+
+def media_size(media):
+    # MediaRecords know their size, plexapi media has it in their parts
+    size = getattr(media, "size", None)
+    if size is None and hasattr(media, "parts"):
+        size = sum(p.size or 0 for p in media.parts)
+    if not size and media.bitrate and media.duration:
+        # bitrate in kbit/s and duration in ms
+        size = media.bitrate * media.duration / 8
+    return size or 0
+
+
+def pixels(media):
+    if media.width and media.height:
+        return media.width * media.height
+    return RESOLUTION_PIXELS.get(str(media.videoResolution).lower(), RESOLUTION_PIXELS["1080"])
+
+
+def estimated_savings(file):
+    """estimated bytes saved per second of encoding"""
+    media = file.media[0]
+    if not media.duration:
+        return 0
+    saved = media_size(media) * (1 - CODEC_RATIO.get(str(media.videoCodec).lower(), DEFAULT_RATIO))
+    encodeSeconds = media.duration / 1000 * FRAME_RATE * pixels(media) / ENCODE_PIXEL_RATE
+    return saved / encodeSeconds
+
+
+# attributes plexLibrarySort can order the title policy by, the plex sorts of movies and shows
+SORTABLE = ("titleSort", "title", "addedAt", "updatedAt", "duration", "size", "bitrate")
+LIBTYPES = {"movie": "movies", "episode": "shows"}
+
+
+def parse_sort(sort):
+    """split a plex sort like "addedAt:desc,titleSort" into (attribute, descending) pairs"""
+    fields = []
+    for field in str(sort).split(","):
+        name, _, direction = field.strip().partition(":")
+        if name not in SORTABLE or direction not in ["", "asc", "desc"]:
+            raise ValueError("Sort invalid: " + str(sort) + " (sort by " + ", ".join(SORTABLE) + ")")
+        fields.append((name, direction == "desc"))
+    return fields
+
+
+class Descending:
+    """a sort value in reverse order"""
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def sort_value(file, name):
+    value = getattr(file, name, None)
+    if name in ["titleSort", "title"]:
+        return str(value or file.title or "").lower()
+    if name in ["addedAt", "updatedAt"]:
+        return timestamp(value)
+    return value or 0
+
+
+def library_order(sections=(), sort=None):
+    """key of the title policy: the files in the order plex lists them, section by section"""
+    fields = {libtype: parse_sort((sort or {}).get(name, "titleSort")) for libtype, name in LIBTYPES.items()}
+    rank = {section: i for i, section in enumerate(sections)}
+    # movies and episodes only need to be kept apart if they are sorted differently
+    mixed = fields["movie"] != fields["episode"]
+
+    def key(file):
+        libtype = getattr(file, "libtype", None) or "movie"
+        values = tuple(Descending(sort_value(file, name)) if descending else sort_value(file, name)
+                       for name, descending in fields.get(libtype, fields["movie"]))
+        return rank.get(getattr(file, "section", None), len(rank)), libtype if mixed else "", values
+    return key
+
+
+# sort keys of all policies: the smallest key is transcoded first
+POLICIES = {
+    "savings": lambda file: -estimated_savings(file),
+    "oldest": lambda file: timestamp(file.addedAt),
+    "size": lambda file: -media_size(file.media[0]),
+    "title": library_order()
+}
+
+
+class Scheduler:
+
+    def __init__(self, policy="title", sections=(), sort=None):
+        if policy not in POLICIES:
+            raise ValueError("Scheduling policy unknown: " + str(policy) + " (use one of " + str(list(POLICIES)) + ")")
+        self.policy = policy
+        # the title policy keeps the order of plexLibrarySections and plexLibrarySort
+        self.key = library_order(sections, sort) if policy == "title" else POLICIES[policy]
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, file):
+        # add a new file or update an existing one: the old entry is invalidated and skipped later
+        entry = [self.key(file), next(self.counter), file]
+        with self.lock:
+            old = self.entries.pop(file.ratingKey, None)
+            if old is not None:
+                old[-1] = None
+            self.entries[file.ratingKey] = entry
+            heapq.heappush(self.heap, entry)
+            self.compact()
+
+    def remove(self, ratingKey):
+        with self.lock:
+            entry = self.entries.pop(ratingKey, None)
+            if entry is not None:
+                entry[-1] = None
+
+    def peek(self, skip=None):
+        """return the next file without removing it, files matching skip() are dropped on the way"""
+        with self.lock:
+            while self.heap:
+                file = self.heap[0][-1]
+                if file is not None and (skip is None or not skip(file)):
+                    return file
+                heapq.heappop(self.heap)
+                if file is not None:
+                    del self.entries[file.ratingKey]
+        return None
+
+    def compact(self):
+        # rebuild the heap when most entries are invalidated ones
+        if len(self.heap) > 1024 and len(self.heap) > 2 * len(self.entries):
+            self.heap = [e for e in self.heap if e[-1] is not None]
+            heapq.heapify(self.heap)
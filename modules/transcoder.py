@@ -9,13 +9,142 @@
 ##########################################################
 import json
 import logging
+import math
+import os
 import shutil
 import subprocess
 import threading
-from ffmpy import FFmpeg, FFRuntimeError
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ffmpy import FFmpeg, FFprobe, FFRuntimeError
 from pathlib import Path
 
-from modules import csv_logger
+from modules import config_loader
+from modules import event_log
+from modules import probe
+
+# media attributes logged for every transcoded file
+MEDIA_STATS = ["aspectRatio", "audioChannels", "audioCodec", "audioProfile", "bitrate", "container", "duration",
+               "has64bitOffsets", "height", "id", "isOptimizedVersion", "key", "optimizedForStreaming", "proxyType",
+               "target", "title", "videoCodec", "videoFrameRate", "videoProfile", "videoResolution", "width"]
+
+# lines of ffmpeg's stderr kept to classify errors
+STDERR_LINES = 100
+
+
+def number(value, cast=float):
+    # ffmpeg reports "N/A" for values not known yet
+    try:
+        return cast(str(value).rstrip("x").replace("kbits/s", ""))
+    except ValueError:
+        return None
+
+
+def parse_progress(block, duration=None):
+    """turn a block of ffmpeg's -progress output into a dict of numbers"""
+    progress = {
+        "frame": number(block.get("frame"), int),
+        "fps": number(block.get("fps")),
+        "speed": number(block.get("speed")),
+        "bitrate": number(block.get("bitrate")),
+        "total_size": number(block.get("total_size"), int),
+        "out_time": block.get("out_time"),
+        "out_time_us": number(block.get("out_time_us", block.get("out_time_ms")), int),
+        "progress": block.get("progress")
+    }
+    # duration of the source in ms
+    if duration and progress["out_time_us"] is not None:
+        progress["percent"] = round(min(100, progress["out_time_us"] / 10 / duration), 1)
+    return progress
+
+# hardware encoders use their own engines, chunked encoding only pays off for cpu encoders
+HARDWARE_ENCODERS = ("_nvenc", "_vaapi", "_qsv", "_amf", "_videotoolbox", "_v4l2m2m", "_mf")
+
+
+def is_hardware_encoder(codec):
+    return str(codec).endswith(HARDWARE_ENCODERS)
+
+# codec produced by an encoder (hevc_nvenc -> hevc)
+ENCODER_CODECS = {"libx265": "hevc", "libx264": "h264", "libaom-av1": "av1", "libsvtav1": "av1", "librav1e": "av1",
+                  "libvpx-vp9": "vp9", "libvpx": "vp8"}
+
+# subtitles that cannot be copied into the target container and what to convert them to
+SUBTITLE_CONVERSIONS = {"mkv": ({"mov_text"}, "srt"), "mp4": ({"subrip", "ass", "ssa", "webvtt"}, "mov_text")}
+
+# segments of an interrupted transcode that are done already, kept in the job's cache directory
+CHECKPOINT = "checkpoint.json"
+
+# worker lanes: remuxing is i/o bound and never takes up an encoder
+TRANSCODE = "transcode"
+REMUX = "remux"
+
+# exit code of jobs that belong to another lane: they are queued again instead of being processed
+REQUEUE = 409
+
+
+def video_codec(encoder):
+    encoder = str(encoder)
+    if encoder in ENCODER_CODECS:
+        return ENCODER_CODECS[encoder]
+    return encoder.split("_")[0]
+
+
+def remuxable(media, config):
+    """the video stream matches the target already, only the container does not"""
+    return config.get("transcoderRemux", "False") == "True" \
+        and str(media.videoCodec).lower() == video_codec(config["targetVideoCodec"]) \
+        and str(media.container).lower() != str(config["targetContainer"]).lower()
+
+
+def subtitle_codec(config, probed=None):
+    # copying subtitles fails if the target container does not support them
+    codec = config["targetSubtitleCodec"]
+    if codec == "copy" and probed is not None and config["targetContainer"] in SUBTITLE_CONVERSIONS:
+        unsupported, conversion = SUBTITLE_CONVERSIONS[config["targetContainer"]]
+        if any(s.get("codec_name") in unsupported for s in probe.streams(probed, "subtitle")):
+            return conversion
+    return codec
+
+
+def keyframes(path, times, window=30):
+    """find the keyframe next to each of the given times (s), only the packets around the times are read"""
+    intervals = ",".join("%.3f%%+%d" % (max(0, t - window / 2), window) for t in times)
+    ff = FFprobe(global_options="-v error",
+                 inputs={str(path): "-select_streams v:0 -show_entries packet=pts_time,flags -of csv=p=0 "
+                                    "-read_intervals " + intervals})
+    stdout, _ = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    frames = set()
+    for line in stdout.decode("utf-8", "replace").splitlines():
+        fields = line.split(",")
+        if len(fields) >= 2 and "K" in fields[1] and fields[0] not in ["", "N/A"]:
+            frames.add(float(fields[0]))
+    splits = []
+    for t in times:
+        candidates = [k for k in frames if k > 0 and (len(splits) == 0 or k > splits[-1])]
+        if len(candidates) > 0:
+            splits.append(min(candidates, key=lambda k: abs(k - t)))
+    return splits
+
+
+def resumable(cacheDir):
+    """the cache directory holds segments a re-dispatched job can continue from"""
+    return Path(cacheDir).joinpath("chunks", CHECKPOINT).is_file()
+
+
+def read_checkpoint(chunkDir, key):
+    # a checkpoint of another source or other settings is worthless
+    try:
+        checkpoint = json.loads(chunkDir.joinpath(CHECKPOINT).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get("key") == key else None
+
+
+def write_checkpoint(chunkDir, checkpoint):
+    # replace the checkpoint at once, a reboot must not leave half of it behind
+    temporary = chunkDir.joinpath(CHECKPOINT + ".tmp")
+    temporary.write_text(json.dumps(checkpoint), encoding="utf-8")
+    os.replace(temporary, chunkDir.joinpath(CHECKPOINT))
 
 
 def threaded(fn):
@@ -27,130 +156,340 @@ def threaded(fn):
 
 class Transcoder:
 
-    def __init__(self, config):
-        self.config = config
+    def __init__(self, parent, config, lane=TRANSCODE, profile=None):
+        self.ctrl = parent
+        # transcoders of an encoder profile encode with the profile's settings
+        self.profile = profile
+        self.config = profile.config if profile is not None else config
+        self.lane = lane
         self.exit_code = -1
         self.file = None
+        # source and output of the last job, the output is verified before it is organized
+        self.source = None
+        self.output = None
         self.ready = True
+        # live progress of the running ffmpeg process (frame, fps, speed, out_time, bitrate, total_size)
+        self.progress = {}
+        self.segments = {}
+        self.stderrTail = deque(maxlen=STDERR_LINES)
 
     @threaded
     def transcode(self, file):
+        try:
+            self.run(file)
+        except Exception as e:
+            # the controller only collects known exit codes: an unexpected error must not leave the job running
+            logging.exception("transcoder: unexpected error: " + str(e))
+            self.exit_code = 500
+            event_log.__LOG__.log(["transcoder", "transcode", self.exit_code, "unexpected error: " + str(e),
+                                   str(file), ""])
+        finally:
+            # set readiness to True only after the exit code is known and let the controller
+            # hand out the next job right away
+            self.ready = True
+            self.ctrl.notify("transcoder")
+
+    def run(self, file):
         # set readiness to False to avoid conflicts
         self.ready = False
         self.file = file
+        self.source = None
+        self.output = None
 
-        fileStats = [
-            file.media[0].aspectRatio,
-            file.media[0].audioChannels,
-            file.media[0].audioCodec,
-            file.media[0].audioProfile,
-            file.media[0].bitrate,
-            file.media[0].container,
-            file.media[0].duration,
-            file.media[0].has64bitOffsets,
-            file.media[0].height,
-            file.media[0].id,
-            file.media[0].isOptimizedVersion,
-            file.media[0].key,
-            file.media[0].optimizedForStreaming,
-            file.media[0].proxyType,
-            file.media[0].target,
-            file.media[0].title,
-            file.media[0].videoCodec,
-            file.media[0].videoFrameRate,
-            file.media[0].videoProfile,
-            file.media[0].videoResolution,
-            file.media[0].width
-        ]
-
-        csv_logger.__CSV__.log(["transcoder", "transcode", 999, "get file info", file.locations[0], ""] + fileStats)
+        # plexapi objects and MediaRecords do not share all attributes
+        fileStats = {stat: getattr(file.media[0], stat, None) for stat in MEDIA_STATS}
+
+        # the stats plex knows go into one field instead of a column each
+        event_log.__LOG__.log(["transcoder", "transcode", 999, "get file info", file.locations[0], "",
+                               {stat: value for stat, value in fileStats.items() if value is not None}])
 
         # cannot process files with more than one location
         if len(file.locations) > 1:
             logging.warning("transcoder: more than one file found - cannot handle that. :-( :"
                             + str(file).encode('ascii', 'replace').decode())
             self.exit_code = 405
-            csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code, "more than one file", str(file), ""])
-            self.ready = True
+            event_log.__LOG__.log(["transcoder", "transcode", self.exit_code, "more than one file", str(file), ""])
             return
         # get path of file and check if file exists
-        path = Path(file.locations[0])
-        if "fakeFileSystem" in self.config and len(self.config["fakeFileSystem"]) > 0:
-            path = Path(str(path).replace(self.config["fakeFileSystem"]["search"][0],
-                                          self.config["fakeFileSystem"]["replace"][0])
-                        .replace(self.config["fakeFileSystem"]["search"][1],
-                                 self.config["fakeFileSystem"]["replace"][1]))
+        path = config_loader.local_path(self.config, file.locations[0])
         if not path.is_file():
             logging.warning("transcoder: No such file or directory: " + str(path).encode('ascii', 'replace').decode())
             self.exit_code = 404
-            csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code, "no such file or directory", str(path), ""])
-            self.ready = True
+            event_log.__LOG__.log(["transcoder", "transcode", self.exit_code, "no such file or directory", str(path), ""])
+            return
+        # prefer the real data of the file (ffprobe) over plex's view
+        probed = self.ctrl.probes.probe(path)
+        duration = probe.duration(probed) if probed else file.media[0].duration
+        # the video stream only needs a new container: copy it instead of encoding it again
+        remux = probed is not None and remuxable(probe.as_media(probed), self.config)
+        if self.lane == REMUX and not remux:
+            # remuxers never encode, they do not hold an encoder slot
+            if probed is None:
+                logging.warning("transcoder: cannot probe, not remuxing: " + str(path).encode('ascii', 'replace').decode())
+                self.exit_code = 500
+                event_log.__LOG__.log(["transcoder", "remux", self.exit_code, "cannot probe", str(path), ""])
+            else:
+                # ffprobe disagrees with plex: the file goes back to be picked up by a transcoder
+                logging.info("transcoder: needs encoding, queued again: " + str(path).encode('ascii', 'replace').decode())
+                self.exit_code = REQUEUE
+                event_log.__LOG__.log(["transcoder", "remux", self.exit_code, "needs encoding", str(path), ""])
             return
         # get path of cache directory and create if not existing
         cacheDir = Path(self.config["transcoderCache"]).joinpath(str(file.ratingKey))
         cacheDir.mkdir(parents=True, exist_ok=True)
         # get target path to transcode to
         cachePath = cacheDir.joinpath(str(path.stem) + "." + self.config["targetContainer"])
-        # build transcode string
-        hwaccel = str("-hwaccel " + self.config["transcoderHWaccel"]) if self.config["transcoderHWaccel"] != "False" else ""
-        # create ffmpeg request
-        ff = FFmpeg(
-            inputs={str(path): str("-y " + hwaccel)},
-            outputs={str(cachePath): str(self.config["targetGlobalSettings"] + " "
-                                         + "-c:v " + self.config["targetVideoCodec"] + " "
-                                         + self.config["targetVideoSettings"]) + " "
-                                         + "-c:a " + self.config["targetAudioCodec"] + " "
-                                         + self.config["targetAudioSettings"]
-                                         + "-c:s " + self.config["targetSubtitleCodec"] + " "
-                                         + self.config["targetSubtitleSettings"]
-                     }
-        )
-        logging.info("transcoder: Starting transcoding: " + str(path).encode('ascii', 'replace').decode())
+        self.source = path
+        self.output = cachePath
+        if remux:
+            ff = FFmpeg(
+                global_options="-hide_banner -nostats -progress pipe:1",
+                inputs={str(path): "-y"},
+                outputs={str(cachePath): self.output_options("-c:v copy", probed)}
+            )
+            videoSettings, quality, hwaccel = None, None, ""
+        else:
+            # the quality search picks the settings per title if enabled
+            search = self.quality_search()
+            if search is not None:
+                videoSettings, quality = search.settings(file.ratingKey, path, duration, cacheDir.joinpath("quality"))
+            else:
+                videoSettings, quality = self.config.get("targetVideoSettings", ""), None
+            # build transcode string
+            hwaccel = str("-hwaccel " + self.config["transcoderHWaccel"]) if self.config["transcoderHWaccel"] != "False" else ""
+            # create ffmpeg request: progress is written to stdout, stderr only contains messages
+            ff = FFmpeg(
+                global_options="-hide_banner -nostats -progress pipe:1",
+                inputs={str(path): str("-y " + hwaccel)},
+                outputs={str(cachePath): self.output_options("-c:v " + self.config["targetVideoCodec"] + " "
+                                                             + videoSettings, probed)}
+            )
+        logging.info("transcoder: Starting " + ("remuxing" if remux else "transcoding")
+                     + (" (" + self.profile.name + ")" if self.profile is not None and not remux else "") + ": "
+                     + str(path).encode('ascii', 'replace').decode())
         logging.debug("transcoder: " + ff.cmd)
 
-        csv_logger.__CSV__.log(["transcoder", "transcode", 0, "starting transcoding", str(path), str(cachePath)])
+        event_log.__LOG__.log(["transcoder", "transcode", 0, "starting " + ("remuxing" if remux else "transcoding"),
+                               str(path), str(cachePath), self.profile.name if self.profile is not None else ""])
 
         successfully = True
         try:
             # make sure to only change file when not readonly
             if self.config["readonly"] == "False":
                 # run transcode command
-                stdout, stderr = ff.run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                self.stderrTail.clear()
+                if not remux and self.segmented() and duration:
+                    self.transcode_chunked(path, cachePath, duration, probed, videoSettings, hwaccel)
+                else:
+                    self.execute(ff, duration)
         except FFRuntimeError as ffe:
             successfully = False
             # After receiving SIGINT ffmpeg has a 255 exit code
             if ffe.exit_code == 255:
                 self.exit_code = 255
             else:
-                # if failed, clean up caching directory and broken files
-                if cachePath.parent.is_dir():
-                    if self.config["readonly"] == "False":
-                        shutil.rmtree(cachePath.parent)
-                if "No such file or directory" in str(ffe.stderr):
+                # if failed, clean up caching directory and broken files, completed segments are kept
+                if self.config["readonly"] == "False":
+                    self.discard(cachePath)
+                if "No such file or directory" in "\n".join(self.stderrTail):
                     # not found error
                     self.exit_code = 404
-                    csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code,
-                                    "no such file or directory (FFRuntimeError)", str(path), str(cachePath)])
+                    event_log.__LOG__.log(["transcoder", "transcode", self.exit_code,
+                                   "no such file or directory (FFRuntimeError)", str(path), str(cachePath)])
                 else:
                     # undefined error
                     self.exit_code = 500
-                    csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code,
-                                    "unkown error (FFRuntimeError)", str(path), str(cachePath)])
-                logging.error("transcoder: An FFRuntimeError occurred in: " "{}".format(ffe))
+                    event_log.__LOG__.log(["transcoder", "transcode", self.exit_code,
+                                   "unkown error (FFRuntimeError)", str(path), str(cachePath)])
+                logging.error("transcoder: An FFRuntimeError occurred in: " "{}".format(ffe) + "\n"
+                              + "\n".join(list(self.stderrTail)[-10:]))
         except KeyboardInterrupt:
             successfully = False
-            if cachePath.parent.is_dir():
-                if self.config["readonly"] == "False":
-                    shutil.rmtree(cachePath.parent)
+            # completed segments are kept for the next attempt
+            if self.config["readonly"] == "False":
+                self.discard(cachePath)
             self.exit_code = 255
-            csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code,
-                            "keyboardInterupt", str(path), str(cachePath)])
-        finally:
-            # set readiness to True because all is done
-            self.ready = True
+            event_log.__LOG__.log(["transcoder", "transcode", self.exit_code,
+                           "keyboardInterupt", str(path), str(cachePath)])
 
         if successfully:
             logging.info("transcoder: Successfully transcoded: " + str(cachePath).encode('ascii', 'replace').decode())
             self.exit_code = 1
-            csv_logger.__CSV__.log(["transcoder", "transcode", self.exit_code,
-                            "successfully transcoded", str(path), str(cachePath)])
+            event_log.__LOG__.log(["transcoder", "transcode", self.exit_code,
+                           "successfully transcoded", str(path), str(cachePath)])
+            if cachePath.is_file():
+                # the savings next to what the quality search cost to get them
+                event_log.__LOG__.log(["transcoder", "savings", self.exit_code,
+                                       "quality " + (str(quality["level"]) + " (" + str(quality["score"]) + ")"
+                                                     if quality else "not searched"),
+                                       str(path), str(cachePath), path.stat().st_size - cachePath.stat().st_size,
+                                       round(quality["cost"], 1) if quality and not quality["cached"] else 0])
+
+    @staticmethod
+    def discard(cachePath):
+        """remove what a failed or interrupted transcode left, but not the segments it can continue from"""
+        if not cachePath.parent.is_dir():
+            return
+        if resumable(cachePath.parent):
+            # a half written output must never be organized
+            cachePath.unlink(missing_ok=True)
+        else:
+            shutil.rmtree(cachePath.parent)
+
+    def quality_search(self):
+        # transcoders of a profile search with the profile's settings, the others with the ones of their owner if any
+        if self.profile is not None:
+            return self.profile.quality
+        return getattr(self.ctrl, "quality", None)
+
+    def execute(self, ff, duration=None, segment=None):
+        """run ffmpeg and follow its output line by line instead of buffering all of it"""
+        if segment is None:
+            self.progress = {}
+        progressRead, progressWrite = os.pipe()
+        stderrRead, stderrWrite = os.pipe()
+        readers = [threading.Thread(target=self.read_progress, args=(progressRead, duration, segment)),
+                   threading.Thread(target=self.read_stderr, args=(stderrRead,))]
+        for reader in readers:
+            reader.start()
+        try:
+            ff.run(stdout=progressWrite, stderr=stderrWrite)
+        finally:
+            # ffmpeg is gone: closing our ends lets the readers run into EOF
+            os.close(progressWrite)
+            os.close(stderrWrite)
+            for reader in readers:
+                reader.join()
+
+    def read_progress(self, fd, duration=None, segment=None):
+        block = {}
+        with os.fdopen(fd, "rb") as stream:
+            for line in stream:
+                key, _, value = line.decode("utf-8", "replace").strip().partition("=")
+                block[key] = value
+                # every block of progress ends with progress=continue or progress=end
+                if key == "progress":
+                    if segment is None:
+                        self.progress = parse_progress(block, duration)
+                    else:
+                        self.segments[segment] = parse_progress(block)
+                        self.progress = self.segments_progress(duration)
+
+    def read_stderr(self, fd):
+        with os.fdopen(fd, "rb") as stream:
+            for line in stream:
+                self.stderrTail.append(line.decode("utf-8", "replace").rstrip())
+
+    def segments_progress(self, duration=None):
+        # the progress of a chunked transcode is the sum of all its segments
+        segments = list(self.segments.values())
+        progress = {"segments": len(segments), "progress": "continue"}
+        for key in ["frame", "fps", "speed", "total_size", "out_time_us"]:
+            progress[key] = sum(p.get(key) or 0 for p in segments)
+        if duration:
+            progress["percent"] = round(min(100, progress["out_time_us"] / 10 / duration), 1)
+        return progress
+
+    def output_options(self, video, probed=None):
+        return " ".join([self.config["targetGlobalSettings"], video,
+                         "-c:a", self.config["targetAudioCodec"], self.config["targetAudioSettings"],
+                         "-c:s", subtitle_codec(self.config, probed), self.config["targetSubtitleSettings"]])
+
+    def chunked(self):
+        return self.config.get("transcoderChunks", 0) > 1 and not is_hardware_encoder(self.config["targetVideoCodec"])
+
+    def segmented(self):
+        # parallel chunks only pay off for cpu encoders, time-bounded segments make any transcode resumable
+        return self.chunked() or self.config.get("transcoderSegmentSeconds", 0) > 0
+
+    def segment_times(self, duration):
+        """times (s) to split the source at: transcoderChunks parts, none longer than transcoderSegmentSeconds"""
+        seconds = duration / 1000
+        count = self.config["transcoderChunks"] if self.chunked() else 1
+        if self.config.get("transcoderSegmentSeconds", 0) > 0:
+            count = max(count, math.ceil(seconds / self.config["transcoderSegmentSeconds"]))
+        return [seconds * i / count for i in range(1, count)]
+
+    def transcode_chunked(self, path, cachePath, duration=None, probed=None, videoSettings=None, hwaccel=""):
+        """split the video at keyframes, encode the segments and concat them losslessly
+
+        every encoded segment is recorded in a checkpoint: a job dispatched again after an interruption
+        continues with the first segment that is not done yet"""
+        chunkDir = cachePath.parent.joinpath("chunks")
+        settings = videoSettings or self.config["targetVideoSettings"]
+        stat = path.stat()
+        key = {"source": str(path), "size": stat.st_size, "mtime": stat.st_mtime,
+               "codec": self.config["targetVideoCodec"], "settings": settings, "times": self.segment_times(duration)}
+        checkpoint = read_checkpoint(chunkDir, key)
+        if checkpoint is None:
+            shutil.rmtree(chunkDir, ignore_errors=True)
+            checkpoint = {"key": key, "split": False, "done": {}}
+        chunkDir.mkdir(parents=True, exist_ok=True)
+
+        if not checkpoint["split"]:
+            splits = keyframes(path, key["times"]) if key["times"] else []
+            logging.info("transcoder: chunked transcoding in " + str(len(splits) + 1) + " segments: "
+                         + str(path).encode('ascii', 'replace').decode())
+            # split the video stream without re-encoding (the segment muxer cuts at the next keyframe)
+            # segments get their own extension to never be mistaken for transcoded files
+            self.execute(FFmpeg(
+                global_options="-hide_banner -nostats -y -progress pipe:1",
+                inputs={str(path): None},
+                outputs={str(chunkDir.joinpath("source_%03d.seg")):
+                         "-map 0:v:0 -c copy -f segment -segment_format matroska -reset_timestamps 1"
+                         + (" -segment_times " + ",".join("%.3f" % (t - 0.001) for t in splits) if splits else "")}
+            ), duration)
+            checkpoint["split"] = True
+            write_checkpoint(chunkDir, checkpoint)
+        else:
+            logging.info("transcoder: resuming chunked transcoding with " + str(len(checkpoint["done"]))
+                         + " segments done: " + str(path).encode('ascii', 'replace').decode())
+
+        # encode the segments in parallel (cpu encoders) or one after the other: every segment is its own ffmpeg
+        sources = sorted(chunkDir.glob("source_*.seg"))
+        encoded = [chunkDir.joinpath("encoded_" + s.name[len("source_"):]) for s in sources]
+        # segments done before count towards the progress right away
+        self.segments = {i: {"out_time_us": checkpoint["done"][e.name]} for i, e in enumerate(encoded)
+                         if e.name in checkpoint["done"] and e.is_file()}
+        lock = threading.Lock()
+
+        def encode(i, source, target):
+            self.execute(FFmpeg(
+                global_options="-hide_banner -nostats -y -progress pipe:1",
+                inputs={str(source): hwaccel or None},
+                outputs={str(target): "-map 0:v:0 -c:v " + self.config["targetVideoCodec"] + " " + settings
+                                      + " -f matroska"}
+            ), duration, i)
+            with lock:
+                checkpoint["done"][target.name] = self.segments.get(i, {}).get("out_time_us") or 0
+                write_checkpoint(chunkDir, checkpoint)
+
+        workers = self.config.get("transcoderChunkWorkers", os.cpu_count()) if self.chunked() else 1
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(encode, i, source, target) for i, (source, target) in enumerate(zip(sources, encoded))
+                       if i not in self.segments]
+            try:
+                for future in futures:
+                    future.result()
+            except FFRuntimeError:
+                # do not start the remaining segments if one failed
+                for future in futures:
+                    future.cancel()
+                raise
+
+        # concat the encoded video and take all other streams from the source once: the source stays the first
+        # input, so maps in targetGlobalSettings (e.g. -map 0) select from it like in a transcode that is not chunked
+        segmentList = chunkDir.joinpath("segments.txt")
+        segmentList.write_text("".join("file '" + str(e).replace("'", "'\\''") + "'\n" for e in encoded),
+                               encoding="utf-8")
+        maps = "" if "-map" in self.config["targetGlobalSettings"].split() else "-map 0:a? -map 0:s? "
+        # the segments start at 0: shift them to where the video of the source started to keep audio in sync
+        videos = probe.streams(probed, "video") if probed else []
+        offset = probe.start_time(probed, videos[0]) if videos else 0
+        self.execute(FFmpeg(
+            global_options="-hide_banner -nostats -y -progress pipe:1",
+            inputs={str(path): None, str(segmentList): "-itsoffset %.6f -f concat -safe 0" % offset},
+            # the encoded video replaces the first video stream of the source
+            outputs={str(cachePath): "-map 1:v:0 " + maps + self.output_options("-c:v copy", probed) + " -map -0:v:0"}
+        ), duration)
+        shutil.rmtree(chunkDir)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  transfer.py
+# desc:   verified and resumable file moves between devices
+##########################################################
+
+import errno
+import hashlib
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# bytes per system call: large enough for the kernel, small enough for a useful progress
+CHUNK = 64 * 1024 * 1024
+BLOCK = 1024 * 1024
+
+# the kernel (or the filesystem) does not support the copy method: use the next one
+FALLBACK_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+def copy_methods(infd, outfd):
+    # copy_file_range and sendfile copy inside the kernel, read/write works everywhere
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(lambda offset, count: os.copy_file_range(infd, outfd, count, offset, offset))
+    if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+        def sendfile(offset, count):
+            os.lseek(outfd, offset, os.SEEK_SET)
+            return os.sendfile(outfd, infd, offset, count)
+        methods.append(sendfile)
+
+    def read_write(offset, count):
+        os.lseek(infd, offset, os.SEEK_SET)
+        os.lseek(outfd, offset, os.SEEK_SET)
+        return os.write(outfd, os.read(infd, min(count, BLOCK)))
+    methods.append(read_write)
+    return methods
+
+
+def copy(src, dst, progress=None):
+    """copy src to dst, a partial dst of an interrupted copy is continued, returns the bytes resumed"""
+    size = os.stat(src).st_size
+    offset = os.stat(dst).st_size if os.path.exists(dst) else 0
+    if offset > size:
+        offset = 0
+    with open(src, "rb") as fsrc, open(dst, "r+b" if offset > 0 else "wb") as fdst:
+        fdst.truncate(offset)
+        resumed = position = offset
+        for method in copy_methods(fsrc.fileno(), fdst.fileno()):
+            try:
+                while position < size:
+                    copied = method(position, min(CHUNK, size - position))
+                    if copied == 0:
+                        # nothing copied: not supported for these files
+                        break
+                    position += copied
+                    if progress is not None:
+                        progress(position)
+            except OSError as e:
+                if e.errno not in FALLBACK_ERRORS:
+                    raise
+            if position >= size:
+                break
+        if position < size:
+            raise OSError(errno.EIO, "copy incomplete (" + str(position) + " of " + str(size) + " bytes)", str(src))
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    return resumed
+
+
+def checksum(path, algorithm="sha256"):
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Transfers:
+
+    def __init__(self, workers=2, algorithm="sha256"):
+        self.workers = workers
+        self.algorithm = algorithm
+        # one pool per destination device: devices do not slow down each other
+        self.pools = {}
+        self.progress = {}
+        self.lock = threading.Lock()
+
+    def move(self, src, dst, keep=False):
+        """move src to dst, the source is only deleted once the copy is verified (never if keep is set)"""
+        if os.stat(src).st_dev == os.stat(Path(dst).parent).st_dev:
+            # same device: a rename is enough, a second link if the source is kept
+            if not keep:
+                os.replace(src, dst)
+                return True
+            try:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                os.link(src, dst)
+                return True
+            except OSError as e:
+                # the filesystem knows no hard links: copy
+                logging.debug("transfer: cannot link, copying: " + str(e))
+        # the source is hashed meanwhile: hashlib releases the gil, the kernel does the copying
+        sourceHash = {}
+        hasher = threading.Thread(target=lambda: sourceHash.setdefault("digest", checksum(src, self.algorithm)))
+        hasher.start()
+        try:
+            resumed = copy(src, dst, progress=lambda position: self.progress.__setitem__(str(dst), position))
+        finally:
+            hasher.join()
+        if resumed > 0:
+            logging.info("transfer: resumed at " + str(resumed) + " bytes: " + str(dst).encode('ascii', 'replace').decode())
+        if sourceHash.get("digest") != checksum(dst, self.algorithm):
+            logging.warning("transfer: checksum mismatch: " + str(dst).encode('ascii', 'replace').decode())
+            # do not resume from broken data next time
+            os.remove(dst)
+            return False
+        if not keep:
+            os.remove(src)
+        return True
+
+    def pool(self, dst):
+        device = os.stat(Path(dst).parent).st_dev
+        with self.lock:
+            if device not in self.pools:
+                self.pools[device] = ThreadPoolExecutor(max_workers=self.workers)
+            return self.pools[device]
+
+    def run(self, moves, keep=False):
+        """move all (src, dst) pairs, in parallel per destination device, returns the moved pairs"""
+        futures = [(src, dst, self.pool(dst).submit(self.move, src, dst, keep)) for src, dst in moves]
+        moved = []
+        for src, dst, future in futures:
+            try:
+                if future.result():
+                    moved.append((src, dst))
+            except OSError as e:
+                logging.warning("transfer: moving " + str(src).encode('ascii', 'replace').decode() + " failed: " + str(e))
+            self.progress.pop(str(dst), None)
+        return moved
+
+    def close(self):
+        with self.lock:
+            for pool in self.pools.values():
+                pool.shutdown(wait=False)
+            self.pools = {}
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  verifier.py
+# desc:   verify transcoded files before they are organized
+##########################################################
+
+import logging
+import shutil
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from ffmpy import FFmpeg, FFRuntimeError
+
+from modules import config_loader
+from modules import coordinator
+from modules import event_log
+from modules import job_store
+from modules import probe
+from modules import transcoder
+
+# exit code of jobs whose output did not pass the verification
+FAILED = 422
+
+
+def stream_counts(data):
+    # cover art is not a video stream to compare
+    return {"video": sum(1 for s in probe.streams(data, "video") if not s.get("disposition", {}).get("attached_pic")),
+            "audio": len(probe.streams(data, "audio")),
+            "subtitle": len(probe.streams(data, "subtitle"))}
+
+
+class Verifier:
+
+    def __init__(self, parent, config):
+        self.ctrl = parent
+        self.config = config
+        # verification decodes a little but never takes up an encoder
+        self.pool = ThreadPoolExecutor(max_workers=self.config.get("verifierWorkers", 2))
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.results = deque()
+
+    def busy(self):
+        return self.pending
+
+    def submit(self, file, source, output):
+        with self.lock:
+            self.pending += 1
+        self.pool.submit(self.run, file, source, output)
+
+    def finished(self):
+        """the verified files since the last call as (file, problems), no problems means verified"""
+        results = []
+        with self.lock:
+            while self.results:
+                results.append(self.results.popleft())
+        return results
+
+    def run(self, file, source, output):
+        try:
+            problems = self.verify(source, output)
+        except Exception as e:
+            problems = ["verification error: " + str(e)]
+        if len(problems) > 0:
+            logging.warning("verifier: " + str(output).encode('ascii', 'replace').decode() + ": " + "; ".join(problems))
+            event_log.__LOG__.log(["verifier", "verify", FAILED, "; ".join(problems), str(source), str(output)])
+        else:
+            logging.info("verifier: verified " + str(output).encode('ascii', 'replace').decode())
+            event_log.__LOG__.log(["verifier", "verify", 0, "verified", str(source), str(output)])
+        with self.lock:
+            self.results.append((file, problems))
+            self.pending -= 1
+        self.ctrl.notify("verifier")
+
+    def verify(self, source, output, outputData=None):
+        """compare the output to its source, returns the problems found"""
+        # readonly runs do not write any output
+        if self.config["readonly"] != "False":
+            return []
+        if output is None or not Path(output).is_file():
+            return ["output missing"]
+        sourceData = self.ctrl.probes.probe(source)
+        # outputs leave the cache once they are organized: their probes are not kept
+        outputData = outputData or self.ctrl.probes.probe(output, cache=False)
+        if sourceData is None or outputData is None:
+            return ["cannot probe " + ("source" if sourceData is None else "output")]
+        problems = []
+
+        sourceDuration = probe.duration(sourceData)
+        outputDuration = probe.duration(outputData)
+        if sourceDuration is None or outputDuration is None:
+            problems.append("unknown duration")
+        elif abs(sourceDuration - outputDuration) > max(2000, sourceDuration * 0.01):
+            problems.append("duration " + str(round(outputDuration)) + " ms instead of " + str(round(sourceDuration)) + " ms")
+
+        # all streams are kept with -map 0, otherwise ffmpeg picks one stream of each type
+        mapAll = "-map 0" in self.config["targetGlobalSettings"]
+        sourceCounts = stream_counts(sourceData)
+        outputCounts = stream_counts(outputData)
+        for codecType, count in sourceCounts.items():
+            expected = count if mapAll else min(count, 1)
+            if outputCounts[codecType] < expected:
+                problems.append(str(outputCounts[codecType]) + " " + codecType + " streams instead of " + str(expected))
+
+        ratio = Path(output).stat().st_size / max(Path(source).stat().st_size, 1)
+        if ratio < self.config.get("verifierMinSizeRatio", 0.05):
+            problems.append("size ratio " + str(round(ratio, 4)))
+
+        if outputDuration:
+            problems += self.decode_samples(output, outputDuration)
+        return problems
+
+    def adopt(self, jobs):
+        """verify the outputs an earlier run left in the transcoder cache: complete ones are marked as done,
+        partial or invalid ones are removed and their jobs are queued again"""
+        # readonly runs neither write outputs nor touch the cache of a real run
+        if self.config["readonly"] != "False":
+            return 0
+        cache = Path(self.config["transcoderCache"])
+        cache.mkdir(parents=True, exist_ok=True)
+        candidates = []
+        for entry in cache.iterdir():
+            # the caches of workers on this box are theirs to clean up
+            if entry.name == coordinator.WORKER_CACHE:
+                continue
+            job = jobs.get_job(entry.name) if entry.name.isdigit() else None
+            outputs = list(entry.glob("*." + self.config["targetContainer"])) if entry.is_dir() else []
+            if job is not None and job["state"] in [job_store.RUNNING, job_store.VERIFYING, job_store.DONE] \
+                    and job["location"] and len(outputs) == 1:
+                candidates.append((entry, job, outputs[0]))
+            elif job is not None and job["state"] in [job_store.PENDING, job_store.RUNNING, job_store.FAILED] \
+                    and transcoder.resumable(entry):
+                # interrupted or failed in the middle of a segmented transcode: the next attempt continues
+                # with the segments done
+                logging.info("verifier: keeping the segments of " + str(entry).encode('ascii', 'replace').decode())
+            else:
+                self.discard(jobs, entry, job)
+        if len(candidates) == 0:
+            return 0
+        results = self.pool.map(lambda c: self.check(config_loader.local_path(self.config, c[1]["location"]), c[2]),
+                                candidates)
+        adopted, encodeSeconds, mediaSeconds = 0, 0.0, 0.0
+        for (entry, job, output), (problems, duration) in zip(candidates, results):
+            if len(problems) > 0:
+                logging.info("verifier: not adopting " + str(output).encode('ascii', 'replace').decode() + ": "
+                             + "; ".join(problems))
+                if transcoder.resumable(entry):
+                    # the concat did not finish, the segments are still good
+                    output.unlink()
+                    jobs.set_state(job["ratingKey"], job_store.PENDING)
+                else:
+                    self.discard(jobs, entry, job)
+                continue
+            # partial files of an interrupted upload do not belong to the output
+            for part in entry.glob("*.part"):
+                part.unlink()
+            jobs.set_state(job["ratingKey"], job_store.DONE, detail="adopted")
+            adopted += 1
+            mediaSeconds += (duration or 0) / 1000
+            # the output was written last when the transcode finished
+            if job["started"]:
+                encodeSeconds += max(0.0, output.stat().st_mtime - job["started"])
+        logging.info("verifier: adopted " + str(adopted) + " of " + str(len(candidates)) + " transcoded files, "
+                     + str(round(encodeSeconds / 3600, 2)) + " encode hours (" + str(round(mediaSeconds / 3600, 2))
+                     + " hours of media) recovered")
+        event_log.__LOG__.log(["verifier", "adopt", 0, "adopted", str(len(candidates)), str(adopted),
+                               {"encodeHours": round(encodeSeconds / 3600, 3),
+                                "mediaHours": round(mediaSeconds / 3600, 3)}])
+        return adopted
+
+    def check(self, source, output):
+        # like run() for the adoption at startup, which needs the duration as well
+        try:
+            outputData = self.ctrl.probes.probe(output, cache=False) if Path(output).is_file() else None
+            problems = self.verify(source, output, outputData)
+        except Exception as e:
+            return ["verification error: " + str(e)], None
+        return problems, probe.duration(outputData) if len(problems) == 0 and outputData else None
+
+    def discard(self, jobs, entry, job):
+        if entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+        else:
+            entry.unlink()
+        # the transcoded file is gone, so the job has to be done again
+        if job is not None and job["state"] in [job_store.RUNNING, job_store.VERIFYING, job_store.DONE]:
+            jobs.set_state(job["ratingKey"], job_store.PENDING)
+
+    def decode_samples(self, output, duration):
+        # decode a few short windows spread over the file: truncated or corrupt outputs fail here
+        windows = self.config.get("verifierSampleWindows", 3)
+        seconds = self.config.get("verifierSampleSeconds", 2)
+        problems = []
+        for i in range(windows):
+            start = max(0.0, duration / 1000 * (i + 1) / (windows + 1) - seconds / 2)
+            ff = FFmpeg(global_options="-hide_banner -nostdin -v error -xerror",
+                        inputs={str(output): "-ss " + str(round(start, 3))},
+                        outputs={"-": "-t " + str(seconds) + " -map 0:V? -map 0:a? -f null"})
+            try:
+                _, stderr = ff.run(stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                errors = stderr.decode("utf-8", "replace").strip()
+            except FFRuntimeError as e:
+                errors = str(e)
+            if errors:
+                problems.append("decode error at " + str(round(start)) + " s: " + errors.splitlines()[-1])
+        return problems
+
+    def close(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+##########################################################
+# title:  worker.py
+# desc:   remote transcoder pulling its jobs from a coordinator
+##########################################################
+
+import json
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from modules import coordinator
+from modules import encoders
+from modules import probe
+from modules import quality
+from modules import transcoder
+from modules import transfer
+
+
+class Worker:
+
+    def __init__(self, config):
+        logging.info("worker: initializing")
+        self.url = config["workerCoordinator"].rstrip("/")
+        self.name = config.get("workerName", "") or socket.gethostname() + "-" + str(os.getpid())
+        # a worker only ever touches its own part of the cache: outputs of a coordinator sharing the
+        # transcoder cache wait there to be organized
+        self.cache = Path(config["transcoderCache"]).joinpath(coordinator.WORKER_CACHE, re.sub(r"[^\w.-]", "_", self.name))
+        self.config = config = dict(config, transcoderCache=str(self.cache))
+        self.token = config.get("coordinatorToken", "")
+        self.timeout = config.get("workerTimeout", 60)
+        self.pollInterval = config.get("workerPollInterval", 10)
+        # the transcoders only need the parts of a controller they use: probes and notify
+        probes = config["probeCacheFile"] if config["readonly"] == "False" else ":memory:"
+        self.probes = probe.ProbeCache(probes, config.get("probeWorkers", 2), config.get("probeBacklog", 1000))
+        # every working encoder profile brings its transcoders, the coordinator does not know about them
+        self.profiles = encoders.profiles(config)
+        self.transcoders = []
+        for profile in self.profiles:
+            profile.quality = quality.QualitySearch(profile.config)
+            self.transcoders += [transcoder.Transcoder(self, config, transcoder.TRANSCODE, profile)
+                                 for _ in range(profile.concurrency.limit)]
+        # lease of every transcoder that got a job from the coordinator
+        self.leases = {}
+        self.ttl = 60
+        self.running = False
+        self.wakeup = threading.Event()
+        # leases of an earlier run are gone, and so are their outputs
+        shutil.rmtree(self.cache, ignore_errors=True)
+        self.cache.mkdir(parents=True, exist_ok=True)
+        logging.info("worker: " + self.name + " initialized for " + self.url)
+
+    def notify(self, reason):
+        self.wakeup.set()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def request(self, method, path, data=None, headers=None, **params):
+        """call the coordinator, returns the status and the decoded answer"""
+        url = self.url + path + ("?" + urlencode(params) if params else "")
+        request = Request(url, data=data, method=method, headers=dict(headers or {}, **{"X-Grinder-Token": self.token}))
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                return response.status, json.loads(body) if body else None
+        except HTTPError as e:
+            return e.code, None
+
+    def run(self):
+        self.running = True
+        nextHeartbeat = 0
+        idle = False
+        while self.running:
+            try:
+                self.report()
+                idle = not self.claim()
+                if time.monotonic() >= nextHeartbeat:
+                    self.heartbeat()
+                    nextHeartbeat = time.monotonic() + self.ttl / 3
+            except (URLError, OSError) as e:
+                logging.warning("worker: coordinator not reachable: " + str(e))
+                idle = True
+            # wake up as soon as a transcoder is done, ask for new jobs from time to time
+            wait = nextHeartbeat - time.monotonic()
+            if idle:
+                wait = min(wait, self.pollInterval)
+            self.wakeup.wait(max(0, wait))
+            self.wakeup.clear()
+
+    def claim(self):
+        """fill the idle transcoders, returns False if the coordinator has no job for us"""
+        for tr in self.transcoders:
+            if not tr.ready or tr in self.leases:
+                continue
+            status, answer = self.request("POST", "/jobs/claim", worker=self.name)
+            if status != 200:
+                return False
+            self.ttl = answer["ttl"]
+            file = coordinator.as_record(answer["file"])
+            self.leases[tr] = answer["lease"]
+            logging.info("worker: claimed " + str(file).encode('ascii', 'replace').decode())
+            tr.exit_code = -1
+            tr.ready = False
+            tr.transcode(file)
+        return True
+
+    def heartbeat(self):
+        for tr, lease in list(self.leases.items()):
+            if lease is None:
+                continue
+            status, _ = self.request("POST", "/jobs/" + lease + "/heartbeat")
+            if status == coordinator.GONE:
+                # the coordinator gave the job to someone else: the result will be thrown away
+                logging.warning("worker: lost the lease of " + str(tr.file).encode('ascii', 'replace').decode())
+                self.leases[tr] = None
+
+    def report(self):
+        for tr, lease in list(self.leases.items()):
+            if not tr.ready:
+                continue
+            if lease is not None and not self.upload(tr, lease):
+                # try again next time, the heartbeats keep the lease alive
+                continue
+            del self.leases[tr]
+            if tr.output is not None:
+                shutil.rmtree(tr.output.parent, ignore_errors=True)
+
+    def upload(self, tr, lease):
+        """send the result of a transcoder to the coordinator, returns False if it has to be sent again"""
+        output = tr.output
+        if tr.exit_code in [0, 1] and output is not None and output.is_file():
+            # do not send the whole file for a lease that is gone already
+            status, _ = self.request("POST", "/jobs/" + lease + "/heartbeat")
+            if status == coordinator.GONE:
+                return True
+            with open(output, "rb") as f:
+                status, _ = self.request("PUT", "/jobs/" + lease + "/result", data=f,
+                                         headers={"Content-Length": str(output.stat().st_size),
+                                                  "X-Checksum": transfer.checksum(output, "sha256")},
+                                         exit_code=tr.exit_code, name=output.name)
+        else:
+            status, _ = self.request("POST", "/jobs/" + lease + "/result", data=b"", exit_code=tr.exit_code)
+        logging.info("worker: reported " + str(tr.file).encode('ascii', 'replace').decode() + " (exit code "
+                     + str(tr.exit_code) + "): " + str(status))
+        return status in [200, coordinator.GONE]
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the checks import the modules and fixtures like video-grinder.py and the benchmarks do
+sys.path.append(str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,38 @@
+from datetime import time
+
+import pytest
+
+from modules import config_loader
+
+
+def test_operators():
+    cases = [("< 75", 74, 75), ("<= 75", 75, 76), ("> 10", 11, 10), (">= 10", 10, 9), ("== 'hevc'", "hevc", "h264"),
+             ("!= 'hevc'", "h264", "hevc"), ("in ['mkv', 'mp4']", "mkv", "avi"),
+             ("not in ['mkv', 'mp4']", "avi", "mkv"), ("  <   1.5  ", 1, 2), ("== None", None, 0)]
+    for expression, matching, other in cases:
+        check = config_loader.compile_expression(expression)
+        assert check(matching) and not check(other), expression
+
+
+def test_disabled():
+    assert config_loader.compile_expression(-1) is None
+    assert config_loader.compile_expression([]) is None
+
+
+def test_time_windows():
+    check = config_loader.compile_expression([{"start": [22, 0], "end": [6, 0]}, {"start": [12, 0], "end": [13, 0]}])
+    assert check(time(23, 30)) and check(time(5, 59)) and check(time(12, 30))
+    assert not check(time(6, 1)) and not check(time(18, 0))
+
+
+def test_invalid_expressions():
+    # no or an unknown operator, values that are not literals: nothing of it is ever evaluated
+    for expression in ["75", "=< 75", "<> 75", "=~ 'hevc'", "< ", "== hevc", "< __import__('os')", "in [1, 2",
+                       "== 'hevc", "< 1 2", None, {"<": 75}]:
+        with pytest.raises(ValueError):
+            config_loader.compile_expression(expression)
+
+
+def test_readiness_skips_disabled_checks():
+    checks = config_loader.compile_readiness({"sys": {"cpu": "< 75", "memory": -1}, "gpu": {}})
+    assert [(counter, value) for counter, value, _ in checks] == [("sys", "cpu")]
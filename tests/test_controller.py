@@ -0,0 +1,20 @@
+from modules import controller
+from modules import transcoder
+
+
+class Transcoder:
+    def __init__(self, exit_code, ready=True, lane=transcoder.TRANSCODE):
+        self.exit_code = exit_code
+        self.ready = ready
+        self.lane = lane
+        self.profile = None
+
+
+def test_uncollected_transcoder_is_not_dispatched():
+    # events wake the dispatcher between a transcoder finishing and queue() collecting its result:
+    # handing it a new file would overwrite the exit code and leave the finished job running forever
+    ctrl = controller.Ctrl.__new__(controller.Ctrl)
+    finished, collected, idle = Transcoder(1), Transcoder(999), Transcoder(-1)
+    assert ctrl.get_ready_transcoder([finished]) is False
+    assert ctrl.get_ready_transcoder([finished, collected]) is collected
+    assert ctrl.get_ready_transcoder([Transcoder(-1, ready=False), idle]) is idle
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from modules import controller
+from modules import coordinator
+from modules import job_store
+from modules import monitor
+from modules import scheduler
+from modules import transcoder
+from modules.media_record import MediaRecord
+
+MOVIE = MediaRecord(7, title="Movie", container="avi", videoCodec="h264", width=1920, height=1080,
+                    duration=60000, size=100, locations=["/media/movie.avi"])
+
+
+class Probes:
+    def get(self, path):
+        return None
+
+    def submit(self, path):
+        pass
+
+
+class Verifier:
+    def finished(self):
+        return []
+
+
+def grinder(tmp_path):
+    """a controller with one monitor holding one movie in its queue and no local transcoders"""
+    config = {"targetVideoCodec": "libx265", "targetContainer": "mkv", "transcoderCache": str(tmp_path),
+              "predicates": {"queueFull": [], "plexLibraryFilesFilter": []}}
+    ctrl = controller.Ctrl.__new__(controller.Ctrl)
+    ctrl.config = config
+    ctrl.jobs = job_store.JobStore(str(tmp_path / "jobs.db"))
+    ctrl.transcoders, ctrl.organizers, ctrl.profiles = [], [], []
+    ctrl.verifier = Verifier()
+    ctrl.dispatchLock = threading.Lock()
+    ctrl.wakeup = threading.Event()
+    mo = monitor.Monitor.__new__(monitor.Monitor)
+    mo.config, mo.ctrl, mo.jobs, mo.probes = config, ctrl, ctrl.jobs, Probes()
+    mo.ready, mo.zombie, mo.sleeping = True, False, False
+    mo.plexDB = object()
+    mo.states, mo.failureReason = {}, {}
+    mo.plexLibrary = {"date": 1, "files": {MOVIE.ratingKey: MOVIE}}
+    mo.queues = {lane: scheduler.Scheduler() for lane in [transcoder.TRANSCODE, transcoder.REMUX]}
+    mo.enqueue(MOVIE)
+    ctrl.monitors = [mo]
+    ctrl.coordinator = coordinator.Coordinator(ctrl, {"coordinatorPort": 0, "coordinatorLeaseTimeout": 0.2,
+                                                      "transcoderCache": str(tmp_path)}).start()
+    return ctrl
+
+
+def post(ctrl, path):
+    host, port = ctrl.coordinator.server_address
+    with urlopen(Request("http://" + host + ":" + str(port) + path, data=b"", method="POST"), timeout=5) as response:
+        return response.status, json.loads(response.read() or b"null")
+
+
+def test_expired_lease_is_queued_again(tmp_path):
+    ctrl = grinder(tmp_path)
+    try:
+        status, lease = post(ctrl, "/jobs/claim?worker=w1")
+        assert status == 200 and lease["file"]["ratingKey"] == MOVIE.ratingKey
+        assert ctrl.jobs.get_state(MOVIE.ratingKey) == job_store.RUNNING
+        # nothing else to hand out while the lease is alive, heartbeats keep it alive
+        assert post(ctrl, "/jobs/claim?worker=w2")[0] == 204
+        assert post(ctrl, "/jobs/" + lease["lease"] + "/heartbeat")[0] == 200
+        time.sleep(0.3)
+        # the next round of the controller takes the job back from the silent worker
+        ctrl.queue()
+        assert ctrl.jobs.get_state(MOVIE.ratingKey) == job_store.PENDING
+        assert ctrl.coordinator.busy() == 0
+        # a late worker learns that its lease is gone, the job goes to the next worker
+        with pytest.raises(HTTPError) as gone:
+            post(ctrl, "/jobs/" + lease["lease"] + "/heartbeat")
+        assert gone.value.code == coordinator.GONE
+        status, again = post(ctrl, "/jobs/claim?worker=w2")
+        assert status == 200 and again["file"]["ratingKey"] == MOVIE.ratingKey and again["lease"] != lease["lease"]
+    finally:
+        ctrl.coordinator.stop()
+        ctrl.jobs.close()
+
+
+def test_token_is_needed_off_the_loopback():
+    with pytest.raises(ValueError):
+        coordinator.Coordinator(None, {"coordinatorPort": 0, "coordinatorAddress": "0.0.0.0"})
@@ -0,0 +1,72 @@
+import pytest
+
+from modules import config_loader
+from modules import encoders
+from modules import gpu_telemetry
+from modules import monitor
+
+
+class Failing:
+    """a gpu that went away: every reading fails until it is back"""
+    name = "failing"
+
+    def __init__(self):
+        self.gone = True
+
+    def devices(self):
+        if self.gone:
+            raise OSError("no devices found")
+        return [gpu_telemetry.device(0, "gpu 0", load=50, memoryUtil=20, temperature=60)]
+
+    def close(self):
+        pass
+
+
+def unavailable(monkeypatch, *names):
+    for name in names:
+        monkeypatch.setattr(gpu_telemetry.BACKENDS[name], "available", staticmethod(lambda: False))
+
+
+def test_auto_falls_back_to_the_next_backend(monkeypatch):
+    unavailable(monkeypatch, "nvml")
+    monkeypatch.setattr(gpu_telemetry.NvidiaSmiBackend, "available", staticmethod(lambda: True))
+    assert isinstance(gpu_telemetry.backend("auto"), gpu_telemetry.NvidiaSmiBackend)
+    unavailable(monkeypatch, "nvidia-smi", "sysfs")
+    assert isinstance(gpu_telemetry.backend("auto"), gpu_telemetry.NullBackend)
+
+
+def test_configured_backend_that_is_not_available(monkeypatch):
+    unavailable(monkeypatch, "nvml")
+    assert isinstance(gpu_telemetry.backend("nvml"), gpu_telemetry.NullBackend)
+    with pytest.raises(ValueError):
+        gpu_telemetry.backend("gputil")
+
+
+def test_sampler_survives_failing_readings():
+    backend = Failing()
+    sampler = gpu_telemetry.Sampler(backend, interval=60).start()
+    try:
+        assert sampler.devices() == [] and sampler.failing
+        backend.gone = False
+        sampler.sample()
+        assert [d["load"] for d in sampler.devices()] == [50] and not sampler.failing
+    finally:
+        sampler.close()
+
+
+def test_gpu_profiles_are_not_ready_without_telemetry():
+    config = {"targetVideoCodec": "libx265", "transcoderCount": 1, "readonly": "True", "transcoderHWaccel": "False",
+              "transcoderReady": {"sys": {"cpu": "< 75"}, "gpu": {"load": "< 75"}},
+              "encoderProfiles": {"nvenc": {"codec": "hevc_nvenc"}, "x265": {"codec": "libx265"}}}
+    config["predicates"] = {"transcoderReady": config_loader.compile_readiness(config["transcoderReady"])}
+    nvenc, x265 = encoders.profiles(config)
+    sampler = gpu_telemetry.Sampler(Failing())
+    mo = monitor.Monitor.__new__(monitor.Monitor)
+    mo.config, mo.gpuUnavailable = config, False
+    mo.ctrl = type("Ctrl", (), {"gpus": sampler, "profiles": [nvenc, x265]})()
+    mo.states = {"sys": {"cpu": 10}, "plex": {}, "gpu": {}}
+    mo.gpu()
+    # an empty reading is not an idle gpu
+    assert mo.gpuUnavailable
+    assert mo.ready_to_transcode(nvenc) is False and mo.failureReason["value"] == "load"
+    assert mo.ready_to_transcode(x265) is True
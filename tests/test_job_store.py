@@ -0,0 +1,41 @@
+from modules import job_store
+
+STATES = {1: job_store.PENDING, 2: job_store.RUNNING, 3: job_store.VERIFYING, 4: job_store.DONE,
+          5: job_store.FAILED, 6: job_store.ORGANIZED}
+
+
+def store(path):
+    jobs = job_store.JobStore(str(path))
+    for ratingKey, state in STATES.items():
+        jobs.set_state(ratingKey, job_store.RUNNING, location="/media/" + str(ratingKey) + ".avi")
+        if state != job_store.RUNNING:
+            jobs.set_state(ratingKey, state, exit_code=0 if state == job_store.DONE else None)
+    return jobs
+
+
+def test_recover_queues_interrupted_jobs_again(tmp_path):
+    jobs = store(tmp_path / "jobs.db")
+    assert sorted(jobs.recover()) == [2, 3]
+    expected = {**STATES, 2: job_store.PENDING, 3: job_store.PENDING}
+    assert {rk: jobs.get_state(rk) for rk in STATES} == expected
+    assert not jobs.is_processed(2) and jobs.is_processed(4)
+    # the job keeps what is known about it, the attempt counts once it is started again
+    job = jobs.get_job(2)
+    assert (job["location"], job["attempts"]) == ("/media/2.avi", 1)
+    assert jobs.recover() == []
+    jobs.close()
+    # the states survive a restart
+    jobs = job_store.JobStore(str(tmp_path / "jobs.db"))
+    assert {rk: jobs.get_state(rk) for rk in STATES} == expected
+    assert jobs.get_job(4)["exitCode"] == 0
+    jobs.close()
+
+
+def test_retry_failed_waits_for_the_interval(tmp_path):
+    jobs = store(tmp_path / "jobs.db")
+    assert jobs.retry_failed(older_than=3600) == []
+    assert jobs.get_state(5) == job_store.FAILED
+    assert jobs.retry_failed() == [5]
+    assert jobs.get_state(5) == job_store.PENDING
+    assert jobs.get_jobs(job_store.FAILED) == []
+    jobs.close()
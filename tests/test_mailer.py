@@ -0,0 +1,192 @@
+import socketserver
+import threading
+import time
+
+import pytest
+
+from modules import mailer
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """just enough smtp to receive mails from smtplib"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            refuse = server.refuse > 0
+            server.refuse -= 1
+        if refuse:
+            self.reply("421 try again later")
+            return
+        self.reply("220 localhost")
+        received = 0
+        for line in self.rfile:
+            command = line.decode().strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self.reply("250 localhost")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 go ahead")
+                data = []
+                for line in self.rfile:
+                    if line.rstrip(b"\r\n") == b".":
+                        break
+                    data.append(line.decode())
+                with server.lock:
+                    server.mails.append("".join(data))
+                self.reply("250 OK")
+                received += 1
+                if received == server.dropAfter:
+                    # the server drops the connection without telling the client
+                    return
+            elif command == "QUIT":
+                with server.lock:
+                    server.quits += 1
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("500 unknown command")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.mails = []
+        self.connections = 0
+        self.quits = 0
+        # connections refused before one is accepted, messages per connection before it is dropped
+        self.refuse = 0
+        self.dropAfter = 0
+
+
+@pytest.fixture
+def smtp():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def config(server, **kwargs):
+    return dict({"hostname": "127.0.0.1", "port": server.server_address[1], "security": "none",
+                 "username": "grinder", "receiver": "admin", "timeout": 5, "retryDelay": 0.1}, **kwargs)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_connection_is_reused(smtp):
+    mail = mailer.Mailer(config(smtp))
+    try:
+        for i in range(3):
+            mail.send("subject " + str(i), "message")
+        assert wait_for(lambda: len(smtp.mails) == 3)
+    finally:
+        mail.close()
+    assert ["Subject: subject " + str(i) in m for i, m in enumerate(smtp.mails)] == [True] * 3
+    assert smtp.connections == 1
+    assert wait_for(lambda: smtp.quits == 1)
+
+
+def test_idle_connection_is_closed(smtp):
+    mail = mailer.Mailer(config(smtp, idleTimeout=0.2))
+    try:
+        mail.send("first", "message")
+        assert wait_for(lambda: smtp.quits == 1)
+        mail.send("second", "message")
+        assert wait_for(lambda: len(smtp.mails) == 2)
+    finally:
+        mail.close()
+    assert smtp.connections == 2
+
+
+def test_reconnect_after_the_server_dropped_the_connection(smtp):
+    smtp.dropAfter = 1
+    mail = mailer.Mailer(config(smtp, retryDelay=30))
+    try:
+        mail.send("first", "message")
+        assert wait_for(lambda: len(smtp.mails) == 1)
+        # the dropped connection is noticed on the next mail: a new one is opened right away
+        start = time.monotonic()
+        mail.send("second", "message")
+        assert wait_for(lambda: len(smtp.mails) == 2)
+        assert time.monotonic() - start < 5
+    finally:
+        mail.close()
+    assert smtp.connections == 2
+    assert "Subject: second" in smtp.mails[1]
+
+
+def test_backoff_while_the_server_refuses(smtp):
+    smtp.refuse = 2
+    mail = mailer.Mailer(config(smtp))
+    try:
+        start = time.monotonic()
+        mail.send("subject", "message")
+        assert wait_for(lambda: len(smtp.mails) == 1)
+        # 0.1 s after the first refusal, 0.2 s after the second
+        assert time.monotonic() - start >= 0.3
+    finally:
+        mail.close()
+    assert smtp.connections == 3
+
+
+def test_mail_is_dropped_after_the_last_retry(smtp):
+    smtp.refuse = 10
+    mail = mailer.Mailer(config(smtp, retries=2, retryDelay=0.01))
+    try:
+        mail.send("subject", "message")
+        assert wait_for(lambda: smtp.connections == 3)
+        mail.send("next", "message")
+        assert wait_for(lambda: smtp.connections == 6)
+    finally:
+        mail.close()
+    assert smtp.mails == []
+
+
+def test_digest_batches_mails_and_events(smtp):
+    mail = mailer.Mailer(config(smtp, digestInterval=0.3))
+    try:
+        mail.send("Video-Grinder: Organizer starts", "We just let you know that organizer is starting.")
+        mail.digest("transcoded: /media/a.avi")
+        mail.digest("failed (500): /media/b.avi")
+        # nothing goes out before the interval is over
+        time.sleep(0.1)
+        assert smtp.mails == []
+        assert wait_for(lambda: len(smtp.mails) == 1)
+        assert "Subject: Video-Grinder: 3 events" in smtp.mails[0]
+        for event in ["organizer is starting", "transcoded: /media/a.avi", "failed (500): /media/b.avi"]:
+            assert event in smtp.mails[0]
+        # events after a digest go into the next one, an empty interval sends nothing
+        mail.digest("transcoded: /media/c.avi")
+    finally:
+        mail.close()
+    # closing sends what is left
+    assert len(smtp.mails) == 2 and "Subject: Video-Grinder: 1 events" in smtp.mails[1]
+    assert smtp.connections == 1
+
+
+def test_events_are_not_kept_without_digest(smtp):
+    mail = mailer.Mailer(config(smtp))
+    try:
+        mail.digest("transcoded: /media/a.avi")
+        mail.send("subject", "message")
+    finally:
+        mail.close()
+    assert len(smtp.mails) == 1 and "Subject: subject" in smtp.mails[0]
+    assert mail.events == []
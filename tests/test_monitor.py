@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import pytest
+
+from modules import config_loader
+from modules import monitor
+from modules.media_record import MediaRecord, project
+
+
+def filtered(files_filter):
+    mo = monitor.Monitor.__new__(monitor.Monitor)
+    mo.config = {"predicates": {"plexLibraryFilesFilter": config_loader.compile_files_filter(files_filter)}}
+    return mo
+
+
+def plex_movie(**media):
+    # plexapi objects only need their attributes for the projection
+    part = SimpleNamespace(file="/media/movie.avi", size=100)
+    return SimpleNamespace(ratingKey=1, title="Movie", titleSort=None, addedAt=None, updatedAt=None,
+                           media=[SimpleNamespace(parts=[part], **media)])
+
+
+def test_transcodable_on_records():
+    record = project(plex_movie(container="avi", videoCodec="h264", width=1920, height=1080,
+                                videoProfile="high", audioChannels=6))
+    assert filtered({"videoCodec": "!= 'hevc'", "videoProfile": "== 'high'"}).transcodable(record)
+    assert not filtered({"videoProfile": "== 'main'"}).transcodable(record)
+    assert filtered({"audioChannels": "> 2", "height": ">= 1080"}).transcodable(record)
+    # records of other sources do not know every attribute
+    assert not filtered({"videoProfile": "== 'high'"}).transcodable(MediaRecord(2, videoCodec="h264"))
+
+
+def test_filter_on_attributes_records_do_not_keep_is_refused():
+    with pytest.raises(ValueError):
+        config_loader.compile_files_filter({"videoProfile": "== 'main'", "hdr": "== True"})
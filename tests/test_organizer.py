@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from modules import event_log
+from modules import job_store
+from modules import mailer
+from modules import organizer
+from modules.media_record import MediaRecord
+
+# (ratingKey, file in the library): avi files get a new name, the mkv is replaced in place
+FILES = [(1, "a.avi"), (2, "b.mkv"), (3, "c.avi")]
+
+
+class PlexServer:
+    def __init__(self, url, token):
+        pass
+
+
+class Ctrl:
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.organized = threading.Event()
+
+    def notify(self, name):
+        self.organized.set()
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(organizer, "PlexServer", PlexServer)
+    monkeypatch.setattr(organizer.teatime, "sleep", lambda seconds: None)
+    event_log.__LOG__ = event_log.EventLog(tmp_path / "log.csv", ["date", "type", "action", "code", "status"])
+    mailer.__MAIL__ = mailer.Mailer({"hostname": ""})
+    media, cache = tmp_path / "media", tmp_path / "cache"
+    media.mkdir()
+    plexDB = sqlite3.connect(str(tmp_path / "plex.db"))
+    plexDB.execute("CREATE TABLE media_parts (file TEXT)")
+    jobs = job_store.JobStore(str(tmp_path / "jobs.db"))
+    files = []
+    for ratingKey, name in FILES:
+        media.joinpath(name).write_bytes(b"old")
+        plexDB.execute("INSERT INTO media_parts VALUES (?)", (str(media / name),))
+        cache.joinpath(str(ratingKey)).mkdir(parents=True)
+        cache.joinpath(str(ratingKey), name.rsplit(".", 1)[0] + ".mkv").write_bytes(b"new " + name.encode())
+        jobs.set_state(ratingKey, job_store.DONE)
+        files.append(MediaRecord(ratingKey, title=name, locations=[str(media / name)]))
+    plexDB.commit()
+    plexDB.close()
+    config = {"readonly": "False", "plexDB": str(tmp_path / "plex.db"), "transcoderCache": str(cache),
+              "targetContainer": "mkv", "plexServer": "", "X-Plex-Token": "", "plexServiceStopCommand": "true",
+              "plexServiceStartCommand": "true", "plexLibrarySections": [],
+              "plexAnalyzeTimeWindow": {"start": [0, 0], "end": [0, 0]}}
+    org = organizer.Organizer(Ctrl(jobs), config)
+    yield org, files, media, cache
+    org.transfers.close()
+    jobs.close()
+    event_log.__LOG__.close()
+
+
+def organize(org, files):
+    # organize runs in a thread of its own and notifies the controller at the end
+    org.ctrl.organized.clear()
+    org.organize(files)
+    assert org.ctrl.organized.wait(30)
+
+
+def paths(org):
+    dbconn = sqlite3.connect(org.config["plexDB"])
+    try:
+        return sorted(os.path.basename(row[0]) for row in dbconn.execute("SELECT file FROM media_parts"))
+    finally:
+        dbconn.close()
+
+
+def test_organize(library):
+    org, files, media, cache = library
+    organize(org, files)
+    assert sorted(os.listdir(media)) == ["a.mkv", "b.mkv", "c.mkv"]
+    assert media.joinpath("b.mkv").read_bytes() == b"new b.mkv"
+    assert paths(org) == ["a.mkv", "b.mkv", "c.mkv"]
+    assert [org.jobs.get_state(rk) for rk, _ in FILES] == [job_store.ORGANIZED] * 3
+    assert list(cache.iterdir()) == []
+    assert org.ready
+
+
+def test_interrupted_before_the_commit_is_organized_from_the_cache(library):
+    org, files, media, cache = library
+    # a crash after staging: the library holds staged files, plex and the cache know nothing about them
+    org.stage(org.plan(files))
+    assert sorted(os.listdir(media)) == [".a.mkv.video-grinder", ".b.mkv.video-grinder", ".c.mkv.video-grinder",
+                                         "a.avi", "b.mkv", "c.avi"]
+    assert sorted(p.name for p in cache.glob("*/*.mkv")) == ["a.mkv", "b.mkv", "c.mkv"]
+    # the next run stages again and finishes
+    organize(org, files)
+    assert sorted(os.listdir(media)) == ["a.mkv", "b.mkv", "c.mkv"]
+    assert paths(org) == ["a.mkv", "b.mkv", "c.mkv"]
+    assert [org.jobs.get_state(rk) for rk, _ in FILES] == [job_store.ORGANIZED] * 3
+
+
+def test_rollback_if_a_staged_file_is_gone(library, monkeypatch):
+    org, files, media, cache = library
+    stage = org.stage
+
+    def losing(plan):
+        staged = stage(plan)
+        # the staged file of the last move disappears before plex is stopped
+        os.remove(staged[-1]["staged"])
+        return staged
+
+    monkeypatch.setattr(org, "stage", losing)
+    plan = org.plan(files)
+    lost = plan[-1]["file"].ratingKey
+    organize(org, files)
+    # plex is running and ready again, nothing of the db update is committed
+    assert org.ready and org.plexStatus == 1
+    assert paths(org) == ["a.avi", "b.mkv", "c.avi"]
+    assert not any(name.endswith(".video-grinder") for name in os.listdir(media))
+    # every job not organized keeps its output in the cache for the next run
+    for ratingKey, name in FILES:
+        state = org.jobs.get_state(ratingKey)
+        assert state in [job_store.ORGANIZED, job_store.DONE]
+        if state == job_store.DONE:
+            assert cache.joinpath(str(ratingKey)).is_dir()
+    assert org.jobs.get_state(lost) == job_store.DONE
+    monkeypatch.setattr(org, "stage", stage)
+    organize(org, [f for f in files if org.jobs.get_state(f.ratingKey) == job_store.DONE])
+    assert sorted(os.listdir(media)) == ["a.mkv", "b.mkv", "c.mkv"]
+    assert paths(org) == ["a.mkv", "b.mkv", "c.mkv"]
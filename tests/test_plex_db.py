@@ -0,0 +1,93 @@
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks import plex_fixture
+from modules import job_store
+from modules import monitor
+from modules import plex_db
+from modules.media_record import MediaRecord
+
+
+def library(tmp_path):
+    path = tmp_path / "plex.db"
+    plex_fixture.create(path, "Movies", [
+        MediaRecord(None, title="Alpha", container="avi", videoCodec="h264", audioCodec="aac", bitrate=4000,
+                    width=1920, height=1080, duration=60000, size=100, locations=["/media/alpha.avi"]),
+        MediaRecord(None, title="Beta", container="mkv", videoCodec="hevc", audioCodec="ac3", bitrate=2000,
+                    width=1280, height=720, duration=30000, size=50, locations=["/media/beta.mkv"])
+    ])
+    return path
+
+
+def test_candidates(tmp_path):
+    path = library(tmp_path)
+    records = {r.ratingKey: r for r in plex_db.PlexDB(path).candidates(["Movies"])}
+    assert sorted(records) == [1, 2]
+    alpha = records[1]
+    assert (alpha.title, alpha.container, alpha.videoCodec, alpha.width, alpha.height) == \
+           ("Alpha", "avi", "h264", 1920, 1080)
+    # bits per second in the database, kbit/s like the plex api
+    assert alpha.bitrate == 4000
+    assert alpha.locations == ("/media/alpha.avi",)
+    assert alpha.size == 100
+
+
+def test_candidates_of_other_sections_and_deleted_items(tmp_path):
+    path = library(tmp_path)
+    dbconn = sqlite3.connect(str(path))
+    dbconn.execute("UPDATE media_parts SET deleted_at = 1 WHERE id = 2")
+    dbconn.commit()
+    dbconn.close()
+    assert [r.ratingKey for r in plex_db.PlexDB(path).candidates(["Movies"])] == [1]
+    assert list(plex_db.PlexDB(path).candidates(["TV Series"])) == []
+
+
+def test_candidates_with_several_parts(tmp_path):
+    path = library(tmp_path)
+    dbconn = sqlite3.connect(str(path))
+    dbconn.execute("INSERT INTO media_parts (id, media_item_id, file, size) VALUES (3, 1, '/media/alpha-2.avi', 20)")
+    dbconn.commit()
+    dbconn.close()
+    alpha = next(r for r in plex_db.PlexDB(path).candidates(["Movies"]) if r.ratingKey == 1)
+    assert alpha.locations == ("/media/alpha.avi", "/media/alpha-2.avi")
+    assert alpha.size == 120
+
+
+def test_candidates_since(tmp_path):
+    path = library(tmp_path)
+    dbconn = sqlite3.connect(str(path))
+    dbconn.execute("UPDATE metadata_items SET added_at = 100, updated_at = 100")
+    # older versions of plex store datetime strings
+    dbconn.execute("UPDATE metadata_items SET updated_at = '1970-01-01 00:05:00' WHERE id = 2")
+    dbconn.commit()
+    dbconn.close()
+    assert [r.ratingKey for r in plex_db.PlexDB(path).candidates(["Movies"], since=200)] == [2]
+    assert list(plex_db.PlexDB(path).candidates(["Movies"], since=300)) == []
+
+
+def test_candidates_without_plexapi():
+    # enumerating the database must not need the plex api
+    code = "import sys; from modules import plex_db; print('plexapi' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=str(Path(__file__).resolve().parent.parent),
+                            stdout=subprocess.PIPE, check=True)
+    assert result.stdout.strip() == b"False"
+
+
+def test_monitor_without_plex(tmp_path):
+    # a monitor on the database backend keeps working while plex cannot be reached
+    path = library(tmp_path)
+    jobs = job_store.JobStore(str(tmp_path / "jobs.db"))
+    jobs.set_state(1, job_store.DONE)
+    mo = monitor.Monitor.__new__(monitor.Monitor)
+    mo.config = {"plexServer": "http://127.0.0.1:9", "X-Plex-Token": "", "plexLibrarySections": ["Movies"]}
+    mo.plexDB = plex_db.PlexDB(path)
+    mo.jobs = jobs
+    mo.zombie = False
+    mo.successfullyTranscoded = []
+    assert mo.setup_plexapi() is False
+    assert mo.zombie is False
+    mo.restore_successfully_transcoded()
+    assert [f.ratingKey for f in mo.successfullyTranscoded] == [1]
+    jobs.close()
@@ -0,0 +1,37 @@
+import threading
+
+from modules import probe
+
+
+def test_outputs_are_not_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(probe, "run_ffprobe", lambda path: {"format": {"duration": "60"}})
+    source, output = tmp_path / "source.avi", tmp_path / "output.mkv"
+    source.write_bytes(b"source")
+    output.write_bytes(b"output")
+    cache = probe.ProbeCache(":memory:")
+    try:
+        assert probe.duration(cache.probe(source)) == probe.duration(cache.probe(output, cache=False)) == 60000
+        assert cache.get(source) is not None
+        assert cache.get(output) is None
+    finally:
+        cache.close()
+
+
+def test_backlog_is_bounded(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def ffprobe(path):
+        release.wait(10)
+        return {}
+    monkeypatch.setattr(probe, "run_ffprobe", ffprobe)
+    cache = probe.ProbeCache(":memory:", workers=1, backlog=3)
+    try:
+        for i in range(10):
+            tmp_path.joinpath(str(i)).write_bytes(b"video")
+            cache.submit(tmp_path / str(i))
+        # the rest is probed when it is dispatched
+        assert len(cache.pending) == 3
+    finally:
+        release.set()
+        cache.pool.shutdown(wait=True)
+        cache.close()
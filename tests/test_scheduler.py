@@ -0,0 +1,66 @@
+import pytest
+
+from modules import scheduler
+from modules.media_record import MediaRecord
+
+
+def record(ratingKey, title, section="Movies", libtype="movie", addedAt=0, videoCodec="h264", size=1000,
+           duration=60000, height=1080):
+    return MediaRecord(ratingKey, title=title, section=section, libtype=libtype, addedAt=addedAt,
+                       videoCodec=videoCodec, size=size, duration=duration, width=height * 16 // 9, height=height)
+
+
+def order(queue, files):
+    for file in files:
+        queue.push(file)
+    taken = []
+    while True:
+        file = queue.peek()
+        if file is None:
+            return taken
+        taken.append(file.ratingKey)
+        queue.remove(file.ratingKey)
+
+
+def test_savings():
+    files = [record(1, "hevc", videoCodec="hevc"), record(2, "small", size=100), record(3, "mpeg2", videoCodec="mpeg2video"),
+             record(4, "h264"), record(5, "4k", height=2160)]
+    # mpeg2 saves most, a 4k file takes four times as long to encode as its 1080p twin, hevc saves nothing
+    assert order(scheduler.Scheduler("savings"), files) == [3, 4, 5, 2, 1]
+
+
+def test_oldest():
+    files = [record(1, "b", addedAt=30), record(2, "a", addedAt=10), record(3, "c", addedAt=20)]
+    assert order(scheduler.Scheduler("oldest"), files) == [2, 3, 1]
+
+
+def test_size():
+    files = [record(1, "b", size=10), record(2, "a", size=30), record(3, "c", size=20)]
+    assert order(scheduler.Scheduler("size"), files) == [2, 3, 1]
+
+
+def test_title_keeps_the_library_order():
+    files = [record(1, "Zulu"), record(2, "Pilot", section="TV Series", libtype="episode", addedAt=10),
+             record(3, "alpha"), record(4, "Finale", section="TV Series", libtype="episode", addedAt=20),
+             record(5, "Beta", section="Other")]
+    # without a configuration the titles decide
+    assert order(scheduler.Scheduler("title"), files) == [3, 5, 4, 2, 1]
+    # sections in the configured order, unknown ones last, every section sorted like plex lists it
+    queue = scheduler.Scheduler("title", ["TV Series", "Movies"], {"movies": "titleSort:desc", "shows": "addedAt"})
+    assert order(queue, files) == [2, 4, 1, 3, 5]
+
+
+def test_updated_file_is_queued_once():
+    queue = scheduler.Scheduler("oldest")
+    queue.push(record(1, "a", addedAt=10))
+    queue.push(record(2, "b", addedAt=20))
+    queue.push(record(1, "a", addedAt=30))
+    assert len(queue) == 2
+    assert order(queue, []) == [2, 1]
+
+
+def test_sort():
+    assert scheduler.parse_sort("addedAt:desc, titleSort") == [("addedAt", True), ("titleSort", False)]
+    for sort in ["year", "titleSort:up", ""]:
+        with pytest.raises(ValueError):
+            scheduler.parse_sort(sort)
@@ -0,0 +1,128 @@
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from modules import transcoder
+
+HOUR = 3600 * 1000
+CONFIG = {"targetVideoCodec": "libx265", "targetVideoSettings": "-crf 24", "transcoderChunks": 4,
+          "transcoderChunkWorkers": 4, "transcoderSegmentSeconds": 0, "targetAudioCodec": "copy",
+          "targetAudioSettings": "", "targetSubtitleCodec": "copy", "targetSubtitleSettings": "",
+          "targetContainer": "mkv", "targetGlobalSettings": "-map 0 -map_metadata 0"}
+
+
+class FFmpeg:
+    """runs instead of ffmpeg: writes the files ffmpeg would write and remembers the commands"""
+
+    def __init__(self, tr, segments=4):
+        self.tr = tr
+        self.segments = segments
+        self.commands = []
+        self.fail = None
+        self.lock = threading.Lock()
+
+    def __call__(self, ff, duration=None, segment=None):
+        target = Path(ff.cmd.split()[-1])
+        with self.lock:
+            self.commands.append(ff.cmd)
+        if "%03d" in target.name:
+            for i in range(self.segments):
+                target.parent.joinpath(target.name % i).write_bytes(b"source")
+            return
+        if target.name == self.fail:
+            raise transcoder.FFRuntimeError(ff.cmd, 1, b"", b"")
+        if segment is not None:
+            self.tr.segments[segment] = {"out_time_us": 900 * 10 ** 6}
+        target.write_bytes(b"encoded")
+
+    def encoded(self):
+        return sorted(name for name in (Path(c.split()[-1]).name for c in self.commands) if name.startswith("encoded_"))
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcoder, "keyframes", lambda path, times: times)
+    source = tmp_path / "movie.avi"
+    source.write_bytes(b"movie")
+    output = tmp_path / "cache" / "1" / "movie.mkv"
+    output.parent.mkdir(parents=True)
+    return source, output
+
+
+def chunked(config):
+    tr = transcoder.Transcoder(None, config)
+    tr.execute = FFmpeg(tr)
+    return tr
+
+
+def test_chunks_are_encoded_and_joined(job):
+    source, output = job
+    tr = chunked(CONFIG)
+    assert tr.segment_times(HOUR) == [900, 1800, 2700]
+    tr.transcode_chunked(source, output, HOUR, {"streams": [{"codec_type": "video", "start_time": "1.4"}]})
+    split, concat = tr.execute.commands[0], tr.execute.commands[-1]
+    assert "-segment_times 899.999,1799.999,2699.999" in split
+    assert tr.execute.encoded() == ["encoded_000.seg", "encoded_001.seg", "encoded_002.seg", "encoded_003.seg"]
+    assert all("-c:v libx265 -crf 24" in c for c in tr.execute.commands[1:-1])
+    # the video of the segments is shifted to the start of the source video, the other streams come from the source
+    assert "-itsoffset 1.400000 -f concat" in concat and "-map 1:v:0 -map 0" in concat
+    assert output.is_file() and not output.parent.joinpath("chunks").exists()
+    assert sorted(tr.segments) == [0, 1, 2, 3]
+
+
+def test_hardware_encoders_are_not_chunked():
+    tr = transcoder.Transcoder(None, dict(CONFIG, targetVideoCodec="hevc_nvenc"))
+    assert not tr.chunked() and not tr.segmented()
+    assert tr.segment_times(HOUR) == []
+
+
+def test_interrupted_transcode_continues_from_the_checkpoint(job):
+    source, output = job
+    config = dict(CONFIG, targetVideoCodec="hevc_nvenc", targetVideoSettings="-cq 28", transcoderSegmentSeconds=900)
+    tr = chunked(config)
+    tr.execute.fail = "encoded_002.seg"
+    with pytest.raises(transcoder.FFRuntimeError):
+        tr.transcode_chunked(source, output, HOUR)
+    # the segments encoded so far are kept for the next dispatch
+    checkpoint = json.loads(output.parent.joinpath("chunks", transcoder.CHECKPOINT).read_text())
+    # (the segment after the failed one might have started before the failure was noticed)
+    assert {"encoded_000.seg", "encoded_001.seg"} <= set(checkpoint["done"])
+    assert "encoded_002.seg" not in checkpoint["done"]
+    assert checkpoint["split"] and transcoder.resumable(output.parent)
+    transcoder.Transcoder.discard(output)
+    assert transcoder.resumable(output.parent)
+
+    tr = chunked(config)
+    tr.transcode_chunked(source, output, HOUR)
+    # not split again, only the missing segments are encoded, the ones done count towards the progress
+    assert not any("%03d" in c for c in tr.execute.commands)
+    assert tr.execute.encoded() == sorted({"encoded_%03d.seg" % i for i in range(4)} - set(checkpoint["done"]))
+    assert sorted(tr.segments) == [0, 1, 2, 3]
+    assert output.is_file() and not transcoder.resumable(output.parent)
+
+
+def test_checkpoint_of_other_settings_is_discarded(job):
+    source, output = job
+    config = dict(CONFIG, targetVideoCodec="hevc_nvenc", targetVideoSettings="-cq 28", transcoderSegmentSeconds=900)
+    tr = chunked(config)
+    tr.execute.fail = "encoded_001.seg"
+    with pytest.raises(transcoder.FFRuntimeError):
+        tr.transcode_chunked(source, output, HOUR)
+    tr = chunked(dict(config, targetVideoSettings="-cq 30"))
+    tr.transcode_chunked(source, output, HOUR)
+    assert "%03d" in tr.execute.commands[0]
+    assert len(tr.execute.encoded()) == 4
+    assert all("-cq 30" in c for c in tr.execute.commands[1:-1])
+
+
+def test_broken_checkpoint_is_not_resumed(tmp_path):
+    chunks = tmp_path / "chunks"
+    chunks.mkdir()
+    chunks.joinpath(transcoder.CHECKPOINT).write_text('{"key": {"source": ')
+    assert transcoder.read_checkpoint(chunks, {"source": "movie.avi"}) is None
+    transcoder.write_checkpoint(chunks, {"key": {"source": "movie.avi"}, "split": True, "done": {}})
+    assert transcoder.read_checkpoint(chunks, {"source": "movie.avi"})["split"]
+    assert transcoder.read_checkpoint(chunks, {"source": "other.avi"}) is None
+    assert not chunks.joinpath(transcoder.CHECKPOINT + ".tmp").exists()
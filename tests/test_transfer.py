@@ -0,0 +1,66 @@
+import errno
+import os
+
+import pytest
+
+from modules import transfer
+
+
+@pytest.fixture
+def nolink(monkeypatch):
+    # a filesystem without hard links: moves that keep their source copy and verify the copy
+    def link(src, dst):
+        raise OSError(errno.EPERM, "no hard links", dst)
+    monkeypatch.setattr(transfer.os, "link", link)
+
+
+def test_copy_continues_a_partial_copy(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(os.urandom(3 * transfer.BLOCK + 5))
+    dst.write_bytes(src.read_bytes()[:transfer.BLOCK])
+    assert transfer.copy(src, dst) == transfer.BLOCK
+    assert dst.read_bytes() == src.read_bytes()
+    # a dst larger than the source is not part of it
+    dst.write_bytes(b"x" * (4 * transfer.BLOCK))
+    assert transfer.copy(src, dst) == 0
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_move_removes_the_source(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"video")
+    assert transfer.Transfers().move(src, dst)
+    assert not src.exists() and dst.read_bytes() == b"video"
+
+
+def test_move_keeps_the_source(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"video")
+    dst.write_bytes(b"partial")
+    assert transfer.Transfers().move(src, dst, keep=True)
+    assert src.read_bytes() == dst.read_bytes() == b"video"
+
+
+def test_move_copies_if_linking_fails(tmp_path, nolink):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"video")
+    transfers = transfer.Transfers()
+    assert transfers.run([(src, dst)], keep=True) == [(src, dst)]
+    assert src.read_bytes() == dst.read_bytes() == b"video"
+    assert not os.path.samefile(src, dst)
+    transfers.close()
+
+
+def test_move_drops_a_copy_with_a_checksum_mismatch(tmp_path, nolink, monkeypatch):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"video")
+
+    def broken(src, dst, progress=None):
+        open(dst, "wb").write(b"vide0")
+        return 0
+    monkeypatch.setattr(transfer, "copy", broken)
+    transfers = transfer.Transfers()
+    assert transfers.run([(src, dst)], keep=True) == []
+    # the source stays and no broken data is left to resume from
+    assert src.read_bytes() == b"video" and not dst.exists()
+    transfers.close()
@@ -0,0 +1,37 @@
+from modules import event_log
+from modules import job_store
+from modules import transcoder
+from modules import verifier
+
+
+class Ctrl:
+    class probes:
+        @staticmethod
+        def probe(path, cache=True):
+            return None
+
+    def notify(self, name):
+        pass
+
+
+def test_adopt_keeps_segments_of_jobs_to_continue(tmp_path):
+    event_log.__LOG__ = event_log.EventLog(tmp_path / "log.csv", ["date", "type", "action", "code", "status"])
+    cache = tmp_path / "cache"
+    jobs = job_store.JobStore(str(tmp_path / "jobs.db"))
+    states = {1: job_store.PENDING, 2: job_store.RUNNING, 3: job_store.FAILED, 4: job_store.ORGANIZED}
+    for ratingKey, state in states.items():
+        jobs.set_state(ratingKey, job_store.RUNNING, location="/media/" + str(ratingKey) + ".avi")
+        jobs.set_state(ratingKey, state)
+        chunks = cache.joinpath(str(ratingKey), "chunks")
+        chunks.mkdir(parents=True)
+        chunks.joinpath(transcoder.CHECKPOINT).write_text("{}")
+    v = verifier.Verifier(Ctrl(), {"readonly": "False", "transcoderCache": str(cache), "targetContainer": "mkv"})
+    try:
+        assert v.adopt(jobs) == 0
+    finally:
+        v.close()
+        event_log.__LOG__.close()
+    # the segments of jobs that are transcoded (again) are kept, the ones of organized jobs are not needed anymore
+    assert sorted(int(p.name) for p in cache.iterdir()) == [1, 2, 3]
+    assert [jobs.get_state(rk) for rk in states] == list(states.values())
+    jobs.close()
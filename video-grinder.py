@@ -24,12 +24,17 @@ try:
     from modules import config_loader
     from modules import sentry
     from modules import controller
-    from modules import csv_logger
+    from modules import event_log
     from modules import mailer
+    from modules import worker
+
+    # run as remote worker of a coordinator instead of grinding the library ourselves: --worker
+    workerMode = "--worker" in sys.argv
+    arguments = [a for a in sys.argv[1:] if a != "--worker"]
 
     # load config: use config path from console parameter or default path
-    if len(sys.argv) > 1:
-        config_file = sys.argv[1]
+    if len(arguments) > 0:
+        config_file = arguments[0]
     else:
         config_file = r"config/default.json"
 
@@ -49,23 +54,23 @@ try:
                         format='%(asctime)s; %(levelname)s; %(message)s')
     logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
 
-    # create global CSV Logger
-    csv_logger.__CSV__ = csv_logger.csvLogger(cfg.config["csvLogFile"].replace("{datetime}", datetime.now().strftime("%Y%m%d-%H%M%S")),
-                                              ["date", "type", "action", "code", "status", "Old", "New", "aspectRatio",
-                                               "audioChannels", "audioCodec", "audioProfile", "bitrate", "container",
-                                               "duration", "has64bitOffsets", "height", "id", "isOptimizedVersion",
-                                               "key", "optimizedForStreaming", "proxyType", "target", "title",
-                                               "videoCodec", "videoFrameRate", "videoProfile",
-                                               "videoResolution", "width"])
+    # create global event log (written in the background)
+    event_log.__LOG__ = event_log.EventLog(cfg.config["csvLogFile"].replace("{datetime}", datetime.now().strftime("%Y%m%d-%H%M%S")),
+                                           ["date", "type", "action", "code", "status", "Old", "New", "Detail"],
+                                           cfg.config)
 
     # create global mailer
     mailer.__MAIL__ = mailer.Mailer(cfg.config["smtp"])
 
-    # create new instance of controller
-    ctrl = controller.Ctrl(cfg.config)
+    if workerMode:
+        # transcode the jobs of the coordinator, organizing stays with the coordinator
+        worker.Worker(cfg.config).run()
+    else:
+        # create new instance of controller
+        ctrl = controller.Ctrl(cfg.config)
 
-    # tell the controller to start its work
-    ctrl.take_control()
+        # tell the controller to start its work
+        ctrl.take_control()
 
 except Exception as e:
     # if an exception occurs log message and send exception to sentry crash analytics